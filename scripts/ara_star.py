@@ -0,0 +1,135 @@
+import heapq
+import math
+import time
+import numpy as np
+from astar import GridAStar
+
+# heuristic inflation of the first search, and how much it is lowered after
+# each search until it reaches 1 (optimal)
+ARA_INITIAL_EPSILON = 2.5
+ARA_EPSILON_STEP = 0.5
+
+# time budget of a call to solve (s)
+ARA_DEADLINE = 0.1
+
+# number of expansions between two checks of the deadline
+DEADLINE_CHECK_INTERVAL = 100
+
+# Anytime Repairing A* (Likhachev, Gordon and Thrun 2003) on the GridAStar cell
+# grid. A first search with a heuristic inflated by epsilon quickly finds a
+# path at most epsilon times longer than optimal. epsilon is then lowered step
+# by step, and each search reuses the g values of the previous ones, only
+# reopening the cells whose g value improved. solve() returns when its
+# deadline is reached, with the best path found so far, and the next call
+# resumes the search where it stopped.
+class AnytimeRepairingAStar(GridAStar):
+
+    def __init__(self, statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution=1, epsilon=ARA_INITIAL_EPSILON, deadline=ARA_DEADLINE):
+        super(AnytimeRepairingAStar, self).__init__(statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution)
+        self.epsilon = max(1.0, epsilon)    # heuristic inflation of the running search
+        self.deadline = deadline
+        self.path_epsilon = np.inf  # suboptimality bound of self.path
+        self.complete = False       # True once the path is optimal, or the goal is known to be unreachable
+        self.timed_out = False      # True if the last call to solve stopped at its deadline
+
+        self.open_keys = {}         # f value of each cell in the open set, heap entries with another value are stale
+        self.open_heap = []         # binary heap of (f value, cell) entries
+        self.incons_cells = set()   # closed cells whose g value improved, reopened by the next search
+        if self.init_cell is not None and self.goal_cell is not None:
+            self.g_cells[self.init_cell] = 0.0
+            self.push(self.init_cell)
+
+    # heuristic distance from a cell to the goal cell
+    def heuristic(self, cell):
+        j, i = divmod(cell, self.stride)
+        goal_j, goal_i = divmod(self.goal_cell, self.stride)
+        return self.resolution*math.hypot(i - goal_i, j - goal_j)
+
+    # inserts a cell in the open set, or updates its f value
+    def push(self, cell):
+        f = self.g_cells[cell] + self.epsilon*self.heuristic(cell)
+        self.open_keys[cell] = f
+        heapq.heappush(self.open_heap, (f, cell))
+
+    # Expands cells until the path to the goal is epsilon-suboptimal
+    # INPUT: (stop_time)
+    #          stop_time - time.time() at which the search is interrupted
+    # OUTPUT: Boolean, False if the search was interrupted before it finished
+    def improve_path(self, stop_time):
+        g_cells = self.g_cells
+        parent_cells = self.parent_cells
+        visited_cells = self.visited_cells
+        cell_free = self.cell_free
+        open_keys = self.open_keys
+        open_heap = self.open_heap
+        goal_cell = self.goal_cell
+        while open_heap:
+            f, current = open_heap[0]
+            if open_keys.get(current) != f:
+                heapq.heappop(open_heap)    # stale entry
+                continue
+            if f >= g_cells[goal_cell]:
+                return True
+            if self.num_expanded % DEADLINE_CHECK_INTERVAL == 0 and time.time() > stop_time:
+                return False
+            heapq.heappop(open_heap)
+            del open_keys[current]
+            visited_cells[current] = True
+            self.num_expanded += 1
+
+            g_current = g_cells[current]
+            for offset, cost in self.neighbor_offsets:
+                neighbor = current + offset
+                free = cell_free[neighbor]
+                if free < 0:
+                    free = self.is_free_cell(neighbor)
+                if not free:
+                    continue
+                tentative_g_score = g_current + cost
+                if tentative_g_score < g_cells[neighbor]:
+                    g_cells[neighbor] = tentative_g_score
+                    parent_cells[neighbor] = current
+                    if visited_cells[neighbor]:
+                        self.incons_cells.add(neighbor)
+                    else:
+                        self.push(neighbor)
+        return True
+
+    # Continues the anytime search until the path is optimal or the deadline
+    # is reached, and places the best path found so far inside self.path
+    # INPUT: None
+    # OUTPUT: Boolean, True if a path from x_init to x_goal is known
+    def solve(self):
+        if self.init_cell is None or self.goal_cell is None:
+            # endpoints outside of the state space are only handled by the generic solver
+            self.complete = True
+            return super(AnytimeRepairingAStar, self).solve()
+
+        stop_time = time.time() + self.deadline
+        self.num_expanded = 0
+        self.timed_out = False
+        while not self.complete:
+            if not self.improve_path(stop_time):
+                self.timed_out = True
+                break
+            if self.g_cells[self.goal_cell] == np.inf:
+                self.complete = True    # the open set ran out, the goal is unreachable
+                break
+            if self.epsilon < self.path_epsilon:
+                self.path = self.reconstruct_path()
+                self.path_epsilon = self.epsilon
+            if self.epsilon <= 1.0:
+                self.complete = True
+                break
+
+            # next search, with a less inflated heuristic
+            self.epsilon = max(1.0, self.epsilon - ARA_EPSILON_STEP)
+            cells = list(self.open_keys) + list(self.incons_cells)
+            self.open_keys = {}
+            self.open_heap = []
+            self.incons_cells = set()
+            self.visited_cells[:] = False
+            for cell in cells:
+                self.push(cell)
+
+        return self.path is not None
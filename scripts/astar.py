@@ -1,29 +1,36 @@
+import heapq
+import itertools
+import math
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+from grids import DetOccupancyGrid2D
 import pdb
 
 # Represents a motion planning problem to be solved using A*
 class AStar(object):
 
-    def __init__(self, statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution=1):
+    def __init__(self, statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution=1, costmap=None):
         self.statespace_lo = statespace_lo         # state space lower bound (e.g., (-5, -5))
         self.statespace_hi = statespace_hi         # state space upper bound (e.g., (5, 5))
         self.occupancy = occupancy                 # occupancy grid
         self.resolution = resolution               # resolution of the discretization of state space (cell/m)
+        self.costmap = costmap                     # optional clearance costmap of the state space (see costmap.py)
         self.x_init = self.snap_to_grid(x_init)    # initial state
         self.x_goal = self.snap_to_grid(x_goal)    # goal state
 
-        self.closed_set = []    # the set containing the states that have been visited
-        self.open_set = []      # the set containing the states that are condidate for future expension
+        self.closed_set = set() # the set containing the states that have been visited
+        self.open_set = set()   # the set containing the states that are condidate for future expension
+        self.open_heap = []     # binary heap of (f score, tie breaker, state) entries backing open_set
+        self.heap_count = itertools.count()  # insertion counter, breaks f score ties in FIFO order
 
         self.f_score = {}       # dictionary of the f score (estimated cost from start to goal passing through state)
         self.g_score = {}       # dictionary of the g score (cost-to-go from start to state)
         self.came_from = {}     # dictionary keeping track of each state's parent to reconstruct the path
+        self.num_expanded = 0   # number of states expanded by solve
 
-        self.open_set.append(x_init)
-        self.g_score[x_init] = 0
-        self.f_score[x_init] = self.distance(x_init,x_goal)
+        self.g_score[self.x_init] = 0
+        self.f_score[self.x_init] = self.distance(self.x_init,self.x_goal)
+        self.add_to_open_set(self.x_init)
 
         self.path = None        # the final path as a list of states
 
@@ -52,6 +59,19 @@ class AStar(object):
     def distance(self, x1, x2):
         return np.linalg.norm(np.array(x1)-np.array(x2))
 
+    # computes the cost of moving between two neighboring states: their
+    # distance, plus the clearance cost of x2 in proportion to it if there is
+    # a costmap
+    # INPUT: (x1, x2)
+    #          x1 - first state tuple
+    #          x2 - second state tuple
+    # OUTPUT: Float edge cost
+    def edge_cost(self, x1, x2):
+        cost = self.distance(x1, x2)
+        if self.costmap is not None:
+            cost += cost*self.costmap.cost_at(x2)
+        return cost
+
     # returns the closest point on a discrete state grid
     # INPUT: (x)
     #          x - tuple state
@@ -93,11 +113,26 @@ class AStar(object):
 
         return neighbors
 
+    # Adds a state to open_set (or lowers its f_score if it is already in it) by
+    # pushing a new heap entry. Entries left behind by an f_score decrease are
+    # not removed from the heap, they are skipped lazily by find_best_f_score
+    # INPUT: (x)
+    #          x - tuple state, whose f_score has already been set
+    # OUTPUT: None
+    def add_to_open_set(self, x):
+        self.open_set.add(x)
+        heapq.heappush(self.open_heap, (self.f_score[x], next(self.heap_count), x))
+
     # Gets the state in open_set that has the lowest f_score
     # INPUT: None
     # OUTPUT: A tuple, the state found in open_set that has the lowest f_score
     def find_best_f_score(self):
-        return min(self.open_set, key=lambda x: self.f_score[x])
+        while True:
+            f, _, x = self.open_heap[0]
+            if x in self.open_set and f == self.f_score[x]:
+                return x
+            # stale entry: the state was closed or its f_score was lowered since
+            heapq.heappop(self.open_heap)
 
     # Gets the state in closed_set that has the lowest f_score
     # INPUT: None
@@ -150,9 +185,11 @@ class AStar(object):
 
             # remove x_current from open set
             self.open_set.remove(x_current)
+            heapq.heappop(self.open_heap)
 
             # add x_current to closed set
-            self.closed_set.append(x_current)
+            self.closed_set.add(x_current)
+            self.num_expanded += 1
 
             # if len(self.open_set)==0:
             #     x_current = self.find_best_closed_f_score()
@@ -168,15 +205,11 @@ class AStar(object):
                     continue
 
                 # Calculate g score for neighbor
-                tentative_g_score = self.g_score[x_current] + self.distance(x_current, x_neigh)
-
-                # Add neighbor to open set if not already in it
-                if x_neigh not in self.open_set:
-                    self.open_set.append(x_neigh)
+                tentative_g_score = self.g_score[x_current] + self.edge_cost(x_current, x_neigh)
 
                 # If neighbor already in open set check g score for neighbor and skip if
                 # existing g score was lower
-                elif tentative_g_score > self.g_score[x_neigh]:
+                if x_neigh in self.open_set and tentative_g_score > self.g_score[x_neigh]:
                     continue
 
                 # set came from 
@@ -188,6 +221,9 @@ class AStar(object):
                 # set f score
                 self.f_score[x_neigh] = tentative_g_score + self.distance(x_neigh, self.x_goal)
 
+                # Add neighbor to open set (or reposition it in the heap)
+                self.add_to_open_set(x_neigh)
+
             # # instead of returning false, set x_goal to the nearest neighbor in the closed set
             # if len(self.open_set)==0:
             #     x_current = self.find_best_f_score()
@@ -196,33 +232,593 @@ class AStar(object):
 
         return False
 
-# A 2D state space grid with a set of rectangular obstacles. The grid is fully deterministic
-class DetOccupancyGrid2D(object):
-    def __init__(self, width, height, obstacles):
-        self.width = width
-        self.height = height
-        self.obstacles = obstacles
+# Bidirectional variant of AStar: a forward search from x_init and a backward
+# search from x_goal over the same states, neighbors and occupancy grid. Both
+# are guided by the averaged potential p(x) = (h(x, x_goal) - h(x, x_init))/2,
+# the forward one with the key g + p and the backward one with g - p, which
+# keeps both consistent. The side with the smaller key is expanded next.
+# Every state generated by both searches closes a candidate path, and the
+# searches meet in the middle: they stop once the two smallest keys add up
+# to at least the shortest candidate, which bounds the cost of any path not
+# found yet, so the path returned is as short as AStar's
+class BidirectionalAStar(AStar):
+
+    def __init__(self, statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution=1, costmap=None):
+        super(BidirectionalAStar, self).__init__(statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution, costmap)
+        self.num_expanded_forward = 0   # number of states expanded by the forward search
+        self.num_expanded_backward = 0  # number of states expanded by the backward search
+
+    # Averaged potential guiding the searches, so that the forward and the
+    # backward keys of a state add up to the length of a path through it
+    # INPUT: (x, d)
+    #          x - tuple state
+    #          d - search direction, 0 forward and 1 backward
+    # OUTPUT: Float, the potential of x for that direction
+    def potential(self, x, d):
+        p = 0.5*(self.distance(x, self.x_goal) - self.distance(x, self.x_init))
+        return p if d == 0 else -p
+
+    # Solves the planning problem with the two searches, and places the
+    # solution path inside self.path, like AStar.solve
+    # INPUT: None
+    # OUTPUT: Boolean, True if a solution from x_init to x_goal was found
+    def solve(self):
+        if self.x_init == self.x_goal:
+            self.path = [self.x_init]
+            return True
+
+        # per direction (0 forward, 1 backward) search state, the forward one is AStar's
+        g_scores = [self.g_score, {self.x_goal: 0}]
+        came_froms = [self.came_from, {}]
+        closed_sets = [self.closed_set, set()]
+        open_heaps = [[], []]   # binary heaps of (key, tie breaker, g score, state) entries
+        for d, x in enumerate([self.x_init, self.x_goal]):
+            open_heaps[d].append((self.potential(x, d), next(self.heap_count), 0, x))
+
+        best_length = np.inf    # length of the shortest path found so far
+        x_meet = None           # state where the searches of that path meet
+        while True:
+            # drop the stale entries of states already expanded or reached with a lower g score
+            for d in range(2):
+                heap = open_heaps[d]
+                while heap and (heap[0][3] in closed_sets[d] or heap[0][2] != g_scores[d][heap[0][3]]):
+                    heapq.heappop(heap)
+            if not open_heaps[0] or not open_heaps[1]:
+                break
+            if open_heaps[0][0][0] + open_heaps[1][0][0] >= best_length:
+                break
+
+            d = 0 if open_heaps[0][0][0] <= open_heaps[1][0][0] else 1
+            _, _, g_current, x_current = heapq.heappop(open_heaps[d])
+            closed_sets[d].add(x_current)
+            self.num_expanded += 1
+            if d == 0:
+                self.num_expanded_forward += 1
+            else:
+                self.num_expanded_backward += 1
 
-    def is_free(self, x):
-        for obs in self.obstacles:
-            inside = True
-            for dim in range(len(x)):
-                if x[dim] < obs[0][dim] or x[dim] > obs[1][dim]:
-                    inside = False
-                    break
-            if inside:
-                return False
+            for x_neigh in self.get_neighbors(x_current):
+                if x_neigh in closed_sets[d]:
+                    continue
+                if d == 0:
+                    tentative_g_score = g_current + self.edge_cost(x_current, x_neigh)
+                else:
+                    # the backward search follows the edges in reverse
+                    tentative_g_score = g_current + self.edge_cost(x_neigh, x_current)
+                if tentative_g_score >= g_scores[d].get(x_neigh, np.inf):
+                    continue
+                g_scores[d][x_neigh] = tentative_g_score
+                came_froms[d][x_neigh] = x_current
+                heapq.heappush(open_heaps[d], (tentative_g_score + self.potential(x_neigh, d), next(self.heap_count), tentative_g_score, x_neigh))
+                if x_neigh in g_scores[1-d] and tentative_g_score + g_scores[1-d][x_neigh] < best_length:
+                    best_length = tentative_g_score + g_scores[1-d][x_neigh]
+                    x_meet = x_neigh
+
+        if x_meet is None:
+            return False
+        path = [x_meet]
+        while path[-1] != self.x_init:
+            path.append(came_froms[0][path[-1]])
+        path.reverse()
+        while path[-1] != self.x_goal:
+            path.append(came_froms[1][path[-1]])
+        self.path = path
         return True
 
-    def plot(self, fig_num=0):
-        fig = plt.figure(fig_num)
-        for obs in self.obstacles:
-            ax = fig.add_subplot(111, aspect='equal')
-            ax.add_patch(
-            patches.Rectangle(
-            obs[0],
-            obs[1][0]-obs[0][0],
-            obs[1][1]-obs[0][1],))
+# Computes the integer grid indices k such that resolution*k lies in [lo, hi),
+# using the same float comparisons as AStar.is_free so both solvers agree on
+# which boundary states are inside the state space
+# INPUT: (lo, hi, resolution)
+#          lo - lower bound of the state space along one dimension
+#          hi - upper bound of the state space along one dimension
+#          resolution - grid resolution
+# OUTPUT: (k_lo, n), the index of the first grid point and the number of grid points
+def grid_index_range(lo, hi, resolution):
+    k_lo = int(math.floor(float(lo)/resolution)) - 1
+    while resolution*k_lo < lo:
+        k_lo += 1
+    k_hi = int(math.ceil(float(hi)/resolution)) + 1
+    while resolution*k_hi >= hi:
+        k_hi -= 1
+    return k_lo, max(0, k_hi-k_lo+1)
+
+# Queries an occupancy grid at every point of a discrete state grid, using its
+# vectorized is_free_states when it has one
+# INPUT: (occupancy, grid_lo, grid_shape, resolution)
+#          occupancy - occupancy grid
+#          grid_lo - grid index of the first point along each dimension (see grid_index_range)
+#          grid_shape - number of grid points along each dimension
+#          resolution - grid resolution
+# OUTPUT: A boolean numpy array of shape (grid_shape[1], grid_shape[0]), True for free points
+def occupancy_free_cells(occupancy, grid_lo, grid_shape, resolution):
+    xs = resolution*(grid_lo[0] + np.arange(grid_shape[0]))
+    ys = resolution*(grid_lo[1] + np.arange(grid_shape[1]))
+    if hasattr(occupancy, 'is_free_states'):
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        return occupancy.is_free_states(grid_x, grid_y)
+    free = np.zeros((len(ys), len(xs)), dtype=bool)
+    for j in range(len(ys)):
+        for i in range(len(xs)):
+            free[j,i] = occupancy.is_free((xs[i], ys[j]))
+    return free
+
+# Index ranges of the points of a discrete state grid whose occupancy may
+# differ between two occupancy grids, from the changed_bounds of the new grid
+# when it has them (see StochOccupancyGrid2D.changed_bounds)
+# INPUT: (occupancy, old_occupancy, grid_lo, grid_shape, resolution)
+#          occupancy - new occupancy grid
+#          old_occupancy - occupancy grid it replaces
+#          grid_lo - grid index of the first point along each dimension (see grid_index_range)
+#          grid_shape - number of grid points along each dimension
+#          resolution - grid resolution
+# OUTPUT: A list of (i0, i1, j0, j1) ranges [i0, i1) x [j0, j1) of grid points,
+#         or None if any point may differ
+def occupancy_changed_ranges(occupancy, old_occupancy, grid_lo, grid_shape, resolution):
+    if occupancy is old_occupancy:
+        return []
+    if not hasattr(occupancy, 'changed_bounds'):
+        return None
+    bounds = occupancy.changed_bounds(old_occupancy)
+    if bounds is None:
+        return None
+    ranges = []
+    for x_min, y_min, x_max, y_max in bounds:
+        i0 = max(0, int(math.floor(x_min/resolution)) - grid_lo[0])
+        i1 = min(grid_shape[0], int(math.ceil(x_max/resolution)) - grid_lo[0] + 1)
+        j0 = max(0, int(math.floor(y_min/resolution)) - grid_lo[1])
+        j1 = min(grid_shape[1], int(math.ceil(y_max/resolution)) - grid_lo[1] + 1)
+        if i1 > i0 and j1 > j0:
+            ranges.append((i0, i1, j0, j1))
+    return ranges
+
+# Grid-native variant of AStar. States are flat integer indices into a cell grid
+# covering [statespace_lo, statespace_hi), padded with a one cell occupied border
+# so neighbor lookups never need bounds checks. g score, parent and visited
+# bookkeeping live in preallocated numpy arrays instead of dicts keyed by float
+# tuples, and world coordinates are only computed when the path is reconstructed.
+# Occupancy is queried lazily through occupancy.is_free and cached per cell.
+class GridAStar(AStar):
+
+    def __init__(self, statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution=1, costmap=None):
+        super(GridAStar, self).__init__(statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution, costmap)
+
+        self.grid_lo = []       # grid index of the first cell along each dimension
+        self.grid_shape = []    # number of cells along each dimension
+        for dim in range(2):
+            k_lo, n = grid_index_range(statespace_lo[dim], statespace_hi[dim], resolution)
+            self.grid_lo.append(k_lo)
+            self.grid_shape.append(n)
+        self.stride = self.grid_shape[0] + 2    # row length of the padded grid
+        num_cells = self.stride * (self.grid_shape[1] + 2)
+
+        # per cell occupancy cache: -1 not queried yet, 0 occupied, 1 free
+        self.cell_free = np.full(num_cells, -1, dtype=np.int8)
+        cell_free_2d = self.cell_free.reshape(self.grid_shape[1] + 2, self.stride)
+        cell_free_2d[0,:] = 0
+        cell_free_2d[-1,:] = 0
+        cell_free_2d[:,0] = 0
+        cell_free_2d[:,-1] = 0
+
+        self.g_cells = np.full(num_cells, np.inf)                   # g score of each cell
+        self.parent_cells = np.full(num_cells, -1, dtype=np.int64)  # parent of each cell, -1 if none
+        self.visited_cells = np.zeros(num_cells, dtype=bool)        # bitmap of the closed cells
+
+        # clearance cost of each cell, None without a costmap (which must cover the same state space)
+        self.cost_cells = None
+        if costmap is not None:
+            cost_cells = np.zeros((self.grid_shape[1] + 2, self.stride))
+            cost_cells[1:-1,1:-1] = costmap.costs
+            self.cost_cells = cost_cells.ravel()
+
+        # flat index offsets and edge costs of the 8-connected neighborhood
+        self.neighbor_offsets = []
+        for dx, dy in [(0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
+            self.neighbor_offsets.append((dx + dy*self.stride, resolution*math.sqrt(dx*dx + dy*dy)))
+
+        self.init_cell = self.state_to_cell(self.x_init)
+        self.goal_cell = self.state_to_cell(self.x_goal)
+        # the endpoints are always free, as in AStar.is_free
+        if self.init_cell is not None:
+            self.cell_free[self.init_cell] = 1
+        if self.goal_cell is not None:
+            self.cell_free[self.goal_cell] = 1
+
+    # Converts a snapped state to its flat cell index
+    # INPUT: (x)
+    #          x - tuple state on the discrete state grid
+    # OUTPUT: Integer flat cell index, or None if x is outside the state space
+    def state_to_cell(self, x):
+        i = int(round(x[0]/self.resolution)) - self.grid_lo[0]
+        j = int(round(x[1]/self.resolution)) - self.grid_lo[1]
+        if i < 0 or j < 0 or i >= self.grid_shape[0] or j >= self.grid_shape[1]:
+            return None
+        return (i+1) + (j+1)*self.stride
+
+    # Converts a flat cell index back to a state on the discrete state grid
+    # INPUT: (cell)
+    #          cell - integer flat cell index
+    # OUTPUT: A tuple, the state at the center of the cell
+    def cell_to_state(self, cell):
+        j, i = divmod(cell, self.stride)
+        return (self.resolution*(self.grid_lo[0] + i - 1), self.resolution*(self.grid_lo[1] + j - 1))
+
+    # Checks if a cell is free, querying the occupancy grid the first time
+    # INPUT: (cell)
+    #          cell - integer flat cell index
+    # OUTPUT: Boolean True/False
+    def is_free_cell(self, cell):
+        free = self.cell_free[cell]
+        if free < 0:
+            free = 1 if self.occupancy.is_free(self.cell_to_state(cell)) else 0
+            self.cell_free[cell] = free
+        return free == 1
+
+    # Queries the occupancy grid for every cell of the state space at once (see
+    # occupancy_free_cells). The endpoint exception of is_free is not applied
+    # INPUT: None
+    # OUTPUT: A boolean numpy array of shape (grid_shape[1], grid_shape[0]), True for free cells
+    def compute_free_cells(self):
+        return occupancy_free_cells(self.occupancy, self.grid_lo, self.grid_shape, self.resolution)
+
+    # flattens a boolean (grid_shape[1], grid_shape[0]) array of cells into the
+    # padded cell indexing, with the border cells set to False
+    def pad_cells(self, free):
+        padded = np.zeros((self.grid_shape[1] + 2, self.stride), dtype=bool)
+        padded[1:-1,1:-1] = free
+        return padded.ravel()
+
+    # Follows the parent array from a cell back to the initial cell
+    # INPUT: (cell)
+    #          cell - integer flat cell index, reached by the search
+    # OUTPUT: A list of tuples, which is a list of the states that go from start to the cell
+    def path_to_cell(self, cell):
+        cells = [cell]
+        while cells[-1] != self.init_cell:
+            cells.append(int(self.parent_cells[cells[-1]]))
+        path = [self.cell_to_state(c) for c in reversed(cells)]
+        path[0] = self.x_init
+        return path
+
+    # Follows the parent array from the goal cell back to the initial cell
+    # INPUT: None
+    # OUTPUT: A list of tuples, which is a list of the states that go from start to goal
+    def reconstruct_path(self):
+        if self.init_cell is None or self.goal_cell is None:
+            # path found by the generic solver
+            return super(GridAStar, self).reconstruct_path()
+        path = self.path_to_cell(self.goal_cell)
+        path[-1] = self.x_goal
+        return path
+
+    # Solves the planning problem using A* over flat cell indices. Places the
+    # solution path inside self.path, like AStar.solve
+    # INPUT: None
+    # OUTPUT: Boolean, True if a solution from x_init to x_goal was found
+    def solve(self):
+        if self.init_cell is None or self.goal_cell is None:
+            # endpoints outside of the state space are only handled by the generic solver
+            return super(GridAStar, self).solve()
+
+        g_cells = self.g_cells
+        parent_cells = self.parent_cells
+        visited_cells = self.visited_cells
+        cell_free = self.cell_free
+        cost_cells = self.cost_cells
+        stride = self.stride
+        resolution = self.resolution
+        goal_cell = self.goal_cell
+        goal_j, goal_i = divmod(goal_cell, stride)
+        hypot = math.hypot
+
+        g_cells[self.init_cell] = 0.0
+        init_j, init_i = divmod(self.init_cell, stride)
+        open_heap = [(resolution*hypot(init_i - goal_i, init_j - goal_j), self.init_cell)]
+        while open_heap:
+            _, current = heapq.heappop(open_heap)
+            if visited_cells[current]:
+                continue    # stale entry for a cell that was already expanded
+            if current == goal_cell:
+                self.num_expanded = int(np.count_nonzero(visited_cells))
+                self.path = self.reconstruct_path()
+                return True
+            visited_cells[current] = True
+
+            g_current = g_cells[current]
+            for offset, cost in self.neighbor_offsets:
+                neighbor = current + offset
+                if visited_cells[neighbor]:
+                    continue
+                free = cell_free[neighbor]
+                if free < 0:
+                    free = self.is_free_cell(neighbor)
+                if not free:
+                    continue
+                tentative_g_score = g_current + cost
+                if cost_cells is not None:
+                    tentative_g_score += cost*cost_cells[neighbor]
+                if tentative_g_score < g_cells[neighbor]:
+                    g_cells[neighbor] = tentative_g_score
+                    parent_cells[neighbor] = current
+                    j, i = divmod(neighbor, stride)
+                    heapq.heappush(open_heap, (tentative_g_score + resolution*hypot(i - goal_i, j - goal_j), neighbor))
+
+        self.num_expanded = int(np.count_nonzero(visited_cells))
+        return False
+
+# One-to-many shortest paths on the GridAStar cell grid: a single Dijkstra
+# search from x_init that stops as soon as every goal in x_goals is settled,
+# or at the first (closest) one. Replaces one AStar search per goal. Like the
+# endpoints of AStar, goals are always reachable, but a goal inside an obstacle
+# is never expanded, so it cannot shortcut the paths to the other goals.
+class GridDijkstra(GridAStar):
+
+    def __init__(self, statespace_lo, statespace_hi, x_init, x_goals, occupancy, resolution=1):
+        # the single goal of GridAStar is unused, the search has one per x_goals
+        super(GridDijkstra, self).__init__(statespace_lo, statespace_hi, x_init, x_init, occupancy, resolution)
+        self.x_goals = [self.snap_to_grid(x_goal) for x_goal in x_goals]
+        self.goal_cells = {}    # dictionary of the goal states at each goal cell
+        self.blocked_cells = set()  # goal cells inside obstacles
+        for x_goal in self.x_goals:
+            cell = self.state_to_cell(x_goal)
+            if cell is None:
+                continue
+            self.goal_cells.setdefault(cell, []).append(x_goal)
+            if self.cell_free[cell] < 0 and not self.is_free_cell(cell):
+                self.blocked_cells.add(cell)
+            self.cell_free[cell] = 1
+        self.paths = {}         # dictionary of the path to each goal state, None if not found
+
+    # Runs the search and places the path to each goal inside self.paths.
+    # Goals outside of the state space are solved separately with GridAStar
+    # INPUT: (first_only)
+    #          first_only - stop at the first goal settled, i.e. the closest one
+    # OUTPUT: Boolean, True if a path to at least one goal was found
+    def solve(self, first_only=False):
+        self.paths = dict((x_goal, None) for x_goal in self.x_goals)
+        if self.init_cell is None:
+            pending = set()
+            outside_goals = self.x_goals
+        else:
+            pending = set(self.goal_cells)
+            outside_goals = [x_goal for x_goal in self.x_goals if self.state_to_cell(x_goal) is None]
+
+        g_cells = self.g_cells
+        parent_cells = self.parent_cells
+        visited_cells = self.visited_cells
+        cell_free = self.cell_free
+        if pending:
+            g_cells[self.init_cell] = 0.0
+            open_heap = [(0.0, self.init_cell)]
+        else:
+            open_heap = []
+        while open_heap and pending:
+            g_current, current = heapq.heappop(open_heap)
+            if visited_cells[current]:
+                continue    # stale entry for a cell that was already expanded
+            visited_cells[current] = True
+            if current in pending:
+                pending.discard(current)
+                for x_goal in self.goal_cells[current]:
+                    path = self.path_to_cell(current)
+                    path[-1] = x_goal
+                    self.paths[x_goal] = path
+                if first_only:
+                    self.num_expanded = int(np.count_nonzero(visited_cells))
+                    return True
+                if current in self.blocked_cells and current != self.init_cell:
+                    continue
+
+            for offset, cost in self.neighbor_offsets:
+                neighbor = current + offset
+                if visited_cells[neighbor]:
+                    continue
+                free = cell_free[neighbor]
+                if free < 0:
+                    free = self.is_free_cell(neighbor)
+                if not free:
+                    continue
+                tentative_g_score = g_current + cost
+                if tentative_g_score < g_cells[neighbor]:
+                    g_cells[neighbor] = tentative_g_score
+                    parent_cells[neighbor] = current
+                    heapq.heappush(open_heap, (tentative_g_score, neighbor))
+        self.num_expanded = int(np.count_nonzero(visited_cells))
+
+        for x_goal in outside_goals:
+            if first_only and any(path is not None for path in self.paths.values()):
+                break
+            problem = GridAStar(self.statespace_lo, self.statespace_hi, self.x_init, x_goal, self.occupancy, self.resolution)
+            if problem.solve():
+                self.paths[x_goal] = problem.path
+
+        return any(path is not None for path in self.paths.values())
+
+# Jump Point Search (Harabor and Grastien 2011) on the GridAStar cell grid.
+# The 8-connected grid has uniform edge costs, so most of the optimal paths
+# through open space are symmetric. JPS only expands the jump points where an
+# optimal path may have to turn, scanning along straight and diagonal lines in
+# between, and returns paths as short as GridAStar's with far fewer open set
+# insertions. Like AStar, diagonal moves may cut the corners of obstacles.
+# The whole state space is queried upfront, with occupancy.is_free_states
+# when the occupancy grid has it (see occupancy_free_cells).
+class JumpPointSearch(GridAStar):
+
+    def __init__(self, statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution=1):
+        super(JumpPointSearch, self).__init__(statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution)
+        self.num_inserted = 0   # number of open set insertions made by solve
+
+    # Scans from a cell along a horizontal or vertical line
+    # INPUT: (free, cell, step, side)
+    #          free - sequence of the cell occupancies
+    #          cell - integer flat cell index the scan starts from (excluded)
+    #          step - flat offset of the scan direction
+    #          side - flat offset perpendicular to the scan direction
+    # OUTPUT: The first jump point along the line, or None
+    def jump_straight(self, free, cell, step, side):
+        goal_cell = self.goal_cell
+        while True:
+            cell += step
+            if not free[cell]:
+                return None
+            if cell == goal_cell:
+                return cell
+            # forced neighbor: a side cell is blocked but the one after it is free
+            if (free[cell + step + side] and not free[cell + side]) or (free[cell + step - side] and not free[cell - side]):
+                return cell
+
+    # Scans from a cell along a diagonal line
+    # INPUT: (free, cell, dx, dy)
+    #          free - sequence of the cell occupancies
+    #          cell - integer flat cell index the scan starts from (excluded)
+    #          dx, dy - direction of the scan, each -1 or 1
+    # OUTPUT: The first jump point along the line, or None
+    def jump_diagonal(self, free, cell, dx, dy):
+        goal_cell = self.goal_cell
+        step_y = dy*self.stride
+        while True:
+            cell += dx + step_y
+            if not free[cell]:
+                return None
+            if cell == goal_cell:
+                return cell
+            if (free[cell - dx + step_y] and not free[cell - dx]) or (free[cell + dx - step_y] and not free[cell - step_y]):
+                return cell
+            # a cell is also a jump point if a straight scan out of it finds one
+            if self.jump_straight(free, cell, dx, self.stride) is not None or self.jump_straight(free, cell, step_y, 1) is not None:
+                return cell
+
+    # Gets the directions a jump point is expanded in, pruning the neighbors
+    # that are reached at least as cheaply without going through it
+    # INPUT: (free, cell)
+    #          free - sequence of the cell occupancies
+    #          cell - integer flat cell index, whose parent is already set
+    # OUTPUT: List of (dx, dy) directions
+    def pruned_directions(self, free, cell):
+        parent = self.parent_cells[cell]
+        if parent < 0:
+            return [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx != 0 or dy != 0]
+        stride = self.stride
+        j, i = divmod(cell, stride)
+        parent_j, parent_i = divmod(int(parent), stride)
+        dx = (i > parent_i) - (i < parent_i)
+        dy = (j > parent_j) - (j < parent_j)
+        if dx != 0 and dy != 0:
+            directions = [(0, dy), (dx, 0), (dx, dy)]
+            if not free[cell - dx]:
+                directions.append((-dx, dy))
+            if not free[cell - dy*stride]:
+                directions.append((dx, -dy))
+        elif dx != 0:
+            directions = [(dx, 0)]
+            if not free[cell + stride]:
+                directions.append((dx, 1))
+            if not free[cell - stride]:
+                directions.append((dx, -1))
+        else:
+            directions = [(0, dy)]
+            if not free[cell + 1]:
+                directions.append((1, dy))
+            if not free[cell - 1]:
+                directions.append((-1, dy))
+        return directions
+
+    # Follows the parent array from a cell back to the initial cell, filling in
+    # the cells of the straight and diagonal lines between jump points
+    # INPUT: (cell)
+    #          cell - integer flat cell index, reached by the search
+    # OUTPUT: A list of tuples, which is a list of the states that go from start to the cell
+    def path_to_cell(self, cell):
+        jump_points = [cell]
+        while jump_points[-1] != self.init_cell:
+            jump_points.append(int(self.parent_cells[jump_points[-1]]))
+        jump_points.reverse()
+        cells = [jump_points[0]]
+        for jump_point in jump_points[1:]:
+            j, i = divmod(cells[-1], self.stride)
+            end_j, end_i = divmod(jump_point, self.stride)
+            step = ((end_i > i) - (end_i < i)) + ((end_j > j) - (end_j < j))*self.stride
+            while cells[-1] != jump_point:
+                cells.append(cells[-1] + step)
+        path = [self.cell_to_state(c) for c in cells]
+        path[0] = self.x_init
+        return path
+
+    # Solves the planning problem by expanding jump points only. Places the
+    # solution path inside self.path, like AStar.solve
+    # INPUT: None
+    # OUTPUT: Boolean, True if a solution from x_init to x_goal was found
+    def solve(self):
+        if self.init_cell is None or self.goal_cell is None:
+            # endpoints outside of the state space are only handled by the generic solver
+            return super(JumpPointSearch, self).solve()
+
+        self.cell_free[:] = self.pad_cells(self.compute_free_cells())
+        self.cell_free[self.init_cell] = 1
+        self.cell_free[self.goal_cell] = 1
+        free = bytearray(self.cell_free.astype(np.uint8).tobytes())  # faster to index than numpy
+
+        g_cells = self.g_cells
+        parent_cells = self.parent_cells
+        visited_cells = self.visited_cells
+        stride = self.stride
+        resolution = self.resolution
+        goal_cell = self.goal_cell
+        goal_j, goal_i = divmod(goal_cell, stride)
+        hypot = math.hypot
+
+        g_cells[self.init_cell] = 0.0
+        init_j, init_i = divmod(self.init_cell, stride)
+        open_heap = [(resolution*hypot(init_i - goal_i, init_j - goal_j), self.init_cell)]
+        self.num_inserted = 1
+        self.num_expanded = 0
+        while open_heap:
+            _, current = heapq.heappop(open_heap)
+            if visited_cells[current]:
+                continue    # stale entry for a cell that was already expanded
+            if current == goal_cell:
+                self.path = self.reconstruct_path()
+                return True
+            visited_cells[current] = True
+            self.num_expanded += 1
+
+            g_current = g_cells[current]
+            current_j, current_i = divmod(current, stride)
+            for dx, dy in self.pruned_directions(free, current):
+                if dx != 0 and dy != 0:
+                    jump_point = self.jump_diagonal(free, current, dx, dy)
+                else:
+                    jump_point = self.jump_straight(free, current, dx + dy*stride, 1 if dx == 0 else stride)
+                if jump_point is None or visited_cells[jump_point]:
+                    continue
+                j, i = divmod(jump_point, stride)
+                tentative_g_score = g_current + resolution*hypot(i - current_i, j - current_j)
+                if tentative_g_score < g_cells[jump_point]:
+                    g_cells[jump_point] = tentative_g_score
+                    parent_cells[jump_point] = current
+                    heapq.heappush(open_heap, (tentative_g_score + resolution*hypot(i - goal_i, j - goal_j), jump_point))
+                    self.num_inserted += 1
+
+        return False
 
 ### TESTING
 
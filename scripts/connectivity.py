@@ -0,0 +1,94 @@
+import numpy as np
+import scipy.ndimage
+from astar import grid_index_range, occupancy_free_cells
+
+# 8-connected neighborhood, the same motion model as AStar.get_neighbors
+EIGHT_CONNECTED = np.ones((3, 3), dtype=bool)
+
+# Connected components of the free cells of a planning state space, labeled
+# once per occupancy grid. Answers whether A* can connect two states in O(1),
+# so unreachable goals are rejected without flooding the state space. Build a
+# new index whenever the occupancy grid changes.
+class ConnectivityIndex(object):
+
+    def __init__(self, statespace_lo, statespace_hi, occupancy, resolution=1):
+        self.statespace_lo = statespace_lo
+        self.statespace_hi = statespace_hi
+        self.occupancy = occupancy
+        self.resolution = resolution
+
+        self.grid_lo = []
+        self.grid_shape = []
+        for dim in range(2):
+            k_lo, n = grid_index_range(statespace_lo[dim], statespace_hi[dim], resolution)
+            self.grid_lo.append(k_lo)
+            self.grid_shape.append(n)
+
+        # free cells indexed [j, i], and their component label (0 for occupied cells)
+        self.free = occupancy_free_cells(occupancy, self.grid_lo, self.grid_shape, resolution)
+        self.labels, self.num_components = scipy.ndimage.label(self.free, structure=EIGHT_CONNECTED)
+
+    def snap_to_grid(self, x):
+        return (self.resolution*round(x[0]/self.resolution), self.resolution*round(x[1]/self.resolution))
+
+    # Converts a state to its (i, j) cell
+    # INPUT: (x)
+    #          x - tuple state
+    # OUTPUT: A tuple (i, j), or None if x is outside the state space
+    def state_to_cell(self, x):
+        i = int(round(x[0]/self.resolution)) - self.grid_lo[0]
+        j = int(round(x[1]/self.resolution)) - self.grid_lo[1]
+        if i < 0 or j < 0 or i >= self.grid_shape[0] or j >= self.grid_shape[1]:
+            return None
+        return (i, j)
+
+    def cell_to_state(self, cell):
+        return (self.resolution*(self.grid_lo[0] + cell[0]), self.resolution*(self.grid_lo[1] + cell[1]))
+
+    # Gets the components a path starting or ending at x can use. AStar treats
+    # its endpoints as free, so an occupied endpoint touches the components of
+    # its free neighbors
+    # INPUT: (cell)
+    #          cell - tuple (i, j) cell
+    # OUTPUT: A set of component labels
+    def cell_components(self, cell):
+        i, j = cell
+        if self.labels[j,i] > 0:
+            return set([self.labels[j,i]])
+        window = self.labels[max(0, j-1):j+2,max(0, i-1):i+2]
+        return set(window[window > 0].tolist())
+
+    # Checks if AStar can possibly find a path between two states. States
+    # outside of the state space are not indexed and are always reported as
+    # reachable, leaving the decision to the planner
+    # INPUT: (x1, x2)
+    #          x1 - first state tuple
+    #          x2 - second state tuple
+    # OUTPUT: Boolean True/False
+    def is_reachable(self, x1, x2):
+        cell1 = self.state_to_cell(self.snap_to_grid(x1))
+        cell2 = self.state_to_cell(self.snap_to_grid(x2))
+        if cell1 is None or cell2 is None:
+            return True
+        if abs(cell1[0]-cell2[0]) <= 1 and abs(cell1[1]-cell2[1]) <= 1:
+            return True
+        return len(self.cell_components(cell1) & self.cell_components(cell2)) > 0
+
+    # Finds the free state closest to x that is reachable from x_from, using a
+    # Euclidean distance transform of the cells outside x_from's components
+    # INPUT: (x, x_from)
+    #          x - tuple state, e.g. a goal inside an obstacle
+    #          x_from - tuple state the result must be reachable from
+    # OUTPUT: A tuple state, x itself if it is already reachable, or None if no free state is reachable
+    def nearest_reachable(self, x, x_from):
+        if self.is_reachable(x, x_from):
+            return self.snap_to_grid(x)
+        cell = self.state_to_cell(self.snap_to_grid(x))
+        cell_from = self.state_to_cell(self.snap_to_grid(x_from))
+        is_reachable_label = np.zeros(self.num_components+1, dtype=bool)
+        is_reachable_label[list(self.cell_components(cell_from))] = True
+        reachable = is_reachable_label[self.labels]
+        if not reachable.any():
+            return None
+        _, (near_j, near_i) = scipy.ndimage.distance_transform_edt(~reachable, return_indices=True)
+        return self.cell_to_state((int(near_i[cell[1],cell[0]]), int(near_j[cell[1],cell[0]])))
@@ -0,0 +1,105 @@
+import numpy as np
+import scipy.ndimage
+from astar import grid_index_range, occupancy_free_cells
+
+# clearance (m) beyond which a state has no clearance cost
+CLEARANCE_DISTANCE = 0.5
+
+# clearance cost of a state right next to an occupied state, as a fraction of
+# the length of the edges leading to it
+CLEARANCE_WEIGHT = 2.0
+
+# Clearance of the free states of a planning state space, computed once per
+# occupancy grid with a Euclidean distance transform of its occupied states.
+# The clearance cost of a state falls linearly from weight next to an occupied
+# state to 0 at max_clearance. Planners add it to the edges leading to a state,
+# in proportion to their length, which keeps paths away from the walls unless
+# the detour costs more, and the navigator can slow down where it is low.
+# Clearances are capped at max_clearance, which keeps the update after a map
+# change local to the states whose occupancy changed (see update_occupancy).
+class ClearanceCostmap(object):
+
+    def __init__(self, statespace_lo, statespace_hi, occupancy, resolution=1, max_clearance=CLEARANCE_DISTANCE, weight=CLEARANCE_WEIGHT):
+        self.statespace_lo = statespace_lo
+        self.statespace_hi = statespace_hi
+        self.occupancy = occupancy
+        self.resolution = resolution
+        self.max_clearance = max_clearance
+        self.weight = weight
+
+        self.grid_lo = []
+        self.grid_shape = []
+        for dim in range(2):
+            k_lo, n = grid_index_range(statespace_lo[dim], statespace_hi[dim], resolution)
+            self.grid_lo.append(k_lo)
+            self.grid_shape.append(n)
+
+        # distance from each state to the closest occupied state, capped at
+        # max_clearance, and clearance cost of each state, indexed [j, i]
+        self.free = occupancy_free_cells(occupancy, self.grid_lo, self.grid_shape, resolution)
+        self.clearance = self.compute_clearance(self.free)
+        self.costs = self.clearance_cost(self.clearance)
+
+    # capped Euclidean distance transform of a free state mask
+    def compute_clearance(self, free):
+        if free.all():
+            return np.full(free.shape, float(self.max_clearance))
+        return np.minimum(scipy.ndimage.distance_transform_edt(free, sampling=self.resolution), self.max_clearance)
+
+    def clearance_cost(self, clearance):
+        return self.weight*np.clip(1.0 - clearance/self.max_clearance, 0.0, 1.0)
+
+    # Updates the costmap for a new occupancy grid of the same state space.
+    # Only the states within max_clearance of a state whose occupancy changed
+    # can have a different clearance, and their closest occupied state is
+    # within max_clearance of them, so the distance transform is only
+    # recomputed over that neighborhood of the changes
+    # INPUT: (occupancy)
+    #          occupancy - new occupancy grid
+    # OUTPUT: Integer number of states whose occupancy changed
+    def update_occupancy(self, occupancy):
+        self.occupancy = occupancy
+        free = occupancy_free_cells(occupancy, self.grid_lo, self.grid_shape, self.resolution)
+        changed_j, changed_i = np.nonzero(free != self.free)
+        self.free = free
+        if len(changed_i) == 0:
+            return 0
+
+        margin = int(np.ceil(self.max_clearance/self.resolution))
+        n_i, n_j = self.grid_shape
+        # states whose clearance may change
+        i0, i1 = max(0, changed_i.min() - margin), min(n_i, changed_i.max() + margin + 1)
+        j0, j1 = max(0, changed_j.min() - margin), min(n_j, changed_j.max() + margin + 1)
+        # states that may be the closest occupied state of one of them
+        wi0, wi1 = max(0, i0 - margin), min(n_i, i1 + margin)
+        wj0, wj1 = max(0, j0 - margin), min(n_j, j1 + margin)
+
+        clearance = self.compute_clearance(free[wj0:wj1,wi0:wi1])[j0-wj0:j1-wj0,i0-wi0:i1-wi0]
+        self.clearance[j0:j1,i0:i1] = clearance
+        self.costs[j0:j1,i0:i1] = self.clearance_cost(clearance)
+        return len(changed_i)
+
+    # Converts a state to its (i, j) cell
+    # INPUT: (x)
+    #          x - tuple state
+    # OUTPUT: A tuple (i, j), or None if x is outside the state space
+    def state_to_cell(self, x):
+        i = int(round(x[0]/self.resolution)) - self.grid_lo[0]
+        j = int(round(x[1]/self.resolution)) - self.grid_lo[1]
+        if i < 0 or j < 0 or i >= self.grid_shape[0] or j >= self.grid_shape[1]:
+            return None
+        return (i, j)
+
+    # clearance of a state (m) capped at max_clearance, infinite outside of the state space
+    def clearance_at(self, x):
+        cell = self.state_to_cell(x)
+        if cell is None:
+            return np.inf
+        return self.clearance[cell[1],cell[0]]
+
+    # clearance cost of a state, 0 outside of the state space
+    def cost_at(self, x):
+        cell = self.state_to_cell(x)
+        if cell is None:
+            return 0.0
+        return self.costs[cell[1],cell[0]]
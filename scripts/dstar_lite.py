@@ -0,0 +1,265 @@
+import heapq
+import math
+import numpy as np
+import scipy.ndimage
+from astar import GridAStar, occupancy_changed_ranges, occupancy_free_cells
+from connectivity import EIGHT_CONNECTED
+
+# Incremental planner (D* Lite, Koenig and Likhachev 2002) over the same padded
+# cell grid as GridAStar. The search runs backwards from the goal and its g and
+# rhs values are kept between calls to solve(), so when the start moves
+# (update_start) or the occupancy grid changes (update_occupancy) only the
+# cells affected by the change are repaired instead of searching from scratch.
+# A planner is tied to one goal, build a new one when the goal changes.
+# Before searching, solve() checks that the start and the goal are in the
+# same connected component of the free cells, so an unreachable goal does
+# not flood its whole component.
+class DStarLite(GridAStar):
+
+    def __init__(self, statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution=1):
+        super(DStarLite, self).__init__(statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution)
+
+        self.rhs_cells = np.full(len(self.cell_free), np.inf)  # one step lookahead of g_cells
+        self.open_keys = {}     # key of each cell in the open set, heap entries with another key are stale
+        self.open_heap = []     # binary heap of (key1, key2, cell) entries
+        self.km = 0.0           # key modifier, accumulates the heuristic distance the start moved
+        self.last_cell = self.init_cell   # last start cell inside the state space, keys are relative to it
+
+        # flat index offsets and edge costs of the neighborhood, as numpy arrays
+        self.offset_array = np.array([offset for offset, _ in self.neighbor_offsets], dtype=np.int64)
+        self.cost_array = np.array([cost for _, cost in self.neighbor_offsets])
+
+        # occupancy of the interior cells, without the endpoint exception
+        self.map_free = self.pad_cells(self.compute_free_cells())
+        self.labels = None      # connected component of each cell of map_free (0 if occupied), computed when needed
+        self.cell_free[:] = self.map_free
+        if self.init_cell is not None:
+            self.cell_free[self.init_cell] = 1
+        if self.goal_cell is not None:
+            self.cell_free[self.goal_cell] = 1
+            self.rhs_cells[self.goal_cell] = 0.0
+            self.push(self.goal_cell)
+
+    # heuristic distance between two cells
+    def heuristic(self, cell1, cell2):
+        if cell1 is None:
+            return 0.0
+        j1, i1 = divmod(cell1, self.stride)
+        j2, i2 = divmod(cell2, self.stride)
+        return self.resolution*math.hypot(i1 - i2, j1 - j2)
+
+    def calculate_key(self, cell):
+        g_min = min(self.g_cells[cell], self.rhs_cells[cell])
+        return (g_min + self.heuristic(self.last_cell, cell) + self.km, g_min)
+
+    # inserts a cell in the open set, or updates its key
+    def push(self, cell):
+        key = self.calculate_key(cell)
+        self.open_keys[cell] = key
+        heapq.heappush(self.open_heap, (key[0], key[1], cell))
+
+    # Gets the open cell with the smallest key, dropping stale heap entries
+    # INPUT: None
+    # OUTPUT: A tuple (key1, key2, cell), or None if the open set is empty
+    def top(self):
+        while self.open_heap:
+            key1, key2, cell = self.open_heap[0]
+            if self.open_keys.get(cell) == (key1, key2):
+                return self.open_heap[0]
+            heapq.heappop(self.open_heap)
+        return None
+
+    # Computes the rhs values of cells from the g values of their free
+    # neighbors, for all of them at once over the flat cell layout
+    # INPUT: (cells)
+    #          cells - integer numpy array of flat cell indices
+    # OUTPUT: A float numpy array, the rhs value of each cell
+    def compute_rhs(self, cells):
+        rhs = np.full(len(cells), np.inf)
+        # only free cells have neighbors, which also keeps the padding from looking outside the grid
+        free = self.cell_free[cells] == 1
+        neighbors = cells[free,np.newaxis] + self.offset_array
+        costs = self.cost_array + self.g_cells[neighbors]
+        costs[self.cell_free[neighbors] != 1] = np.inf
+        rhs[free] = costs.min(axis=1)
+        rhs[cells == self.goal_cell] = 0.0
+        return rhs
+
+    # puts a cell whose g and rhs values differ in the open set, and takes it out otherwise
+    def update_open(self, cell):
+        if self.g_cells[cell] != self.rhs_cells[cell]:
+            self.push(cell)
+        else:
+            self.open_keys.pop(cell, None)
+
+    # recomputes the rhs values of cells and their membership in the open set
+    def update_vertices(self, cells):
+        cells = np.unique(cells)
+        self.rhs_cells[cells] = self.compute_rhs(cells)
+        for cell in cells.tolist():
+            self.update_open(cell)
+
+    # updates cells and all of their neighbors, whose edges to them may have changed
+    def update_neighborhoods(self, cells):
+        cells = np.asarray(cells, dtype=np.int64)
+        self.update_vertices(np.concatenate((cells, (cells[:,np.newaxis] + self.offset_array).ravel())))
+
+    # sets the effective occupancy of a cell, repairing the search if it changed
+    def set_cell_free(self, cell, free):
+        if (self.cell_free[cell] == 1) != free:
+            self.cell_free[cell] = 1 if free else 0
+            self.update_neighborhoods([cell])
+
+    # Moves the start of the plan, e.g. to the current robot location
+    # INPUT: (x_init)
+    #          x_init - tuple state, the new initial state
+    # OUTPUT: None
+    def update_start(self, x_init):
+        self.x_init = self.snap_to_grid(x_init)
+        self.init_cell = self.state_to_cell(self.x_init)
+        if self.init_cell is None or self.init_cell == self.last_cell:
+            return
+        old_cell = self.last_cell
+        self.km += self.heuristic(old_cell, self.init_cell)
+        self.last_cell = self.init_cell
+        self.set_cell_free(self.init_cell, True)
+        if old_cell is not None and old_cell != self.goal_cell:
+            self.set_cell_free(old_cell, self.map_free[old_cell])
+
+    # Installs a new occupancy grid and repairs the cells whose occupancy
+    # changed. Only the cells the new grid reports as changed since the
+    # current one are queried (see occupancy_changed_ranges)
+    # INPUT: (occupancy)
+    #          occupancy - the new occupancy grid
+    # OUTPUT: Integer, the number of cells whose occupancy changed
+    def update_occupancy(self, occupancy):
+        ranges = occupancy_changed_ranges(occupancy, self.occupancy, self.grid_lo, self.grid_shape, self.resolution)
+        self.occupancy = occupancy
+        if ranges is None:
+            new_free = self.pad_cells(self.compute_free_cells())
+            changed = np.flatnonzero(new_free != self.map_free)
+            self.map_free = new_free
+        else:
+            map_free = self.map_free.reshape(-1, self.stride)
+            changed = []
+            for i0, i1, j0, j1 in ranges:
+                new_free = occupancy_free_cells(occupancy, (self.grid_lo[0] + i0, self.grid_lo[1] + j0), (i1 - i0, j1 - j0), self.resolution)
+                changed_j, changed_i = np.nonzero(new_free != map_free[j0+1:j1+1,i0+1:i1+1])
+                map_free[j0+1:j1+1,i0+1:i1+1] = new_free
+                changed.append((changed_i + i0 + 1) + (changed_j + j0 + 1)*self.stride)
+            changed = np.unique(np.concatenate(changed)) if changed else np.zeros(0, dtype=np.int64)
+        if len(changed) == 0:
+            return 0
+
+        self.labels = None
+        # the endpoints keep their exception
+        changed = changed[(changed != self.init_cell) & (changed != self.goal_cell)]
+        self.cell_free[changed] = self.map_free[changed]
+        self.update_neighborhoods(changed)
+        return len(changed)
+
+    # Gets the components of map_free a path starting or ending at a cell can
+    # use, like ConnectivityIndex.cell_components
+    # INPUT: (cell)
+    #          cell - integer flat cell index
+    # OUTPUT: A set of component labels
+    def cell_components(self, cell):
+        if self.labels is None:
+            labels, _ = scipy.ndimage.label(self.map_free.reshape(-1, self.stride), structure=EIGHT_CONNECTED)
+            self.labels = labels.ravel()
+        if self.labels[cell] > 0:
+            return set([self.labels[cell]])
+        return set(self.labels[cell + offset] for offset, _ in self.neighbor_offsets) - set([0])
+
+    # Checks if the start and goal cells can be connected at all
+    # INPUT: None
+    # OUTPUT: Boolean True/False
+    def is_reachable(self):
+        j1, i1 = divmod(self.init_cell, self.stride)
+        j2, i2 = divmod(self.goal_cell, self.stride)
+        if abs(i1 - i2) <= 1 and abs(j1 - j2) <= 1:
+            return True
+        return len(self.cell_components(self.init_cell) & self.cell_components(self.goal_cell)) > 0
+
+    # Expands cells until the g value of the start cell is consistent. A cell
+    # whose g value drops only lowers the rhs values of its neighbors, which
+    # is done for all of them at once; a cell whose g value rises recomputes
+    # the rhs values of the neighbors that depended on it
+    def compute_shortest_path(self):
+        g_cells = self.g_cells
+        rhs_cells = self.rhs_cells
+        cell_free = self.cell_free
+        offset_array = self.offset_array
+        cost_array = self.cost_array
+        start = self.init_cell
+        while True:
+            top = self.top()
+            if top is None:
+                return
+            # cells whose key only exceeds the start key by float round off are
+            # still expanded, they can lie on the path out of the start cell
+            if top[0] > self.calculate_key(start)[0] + 1e-9 and rhs_cells[start] == g_cells[start]:
+                return
+            key_old = top[:2]
+            cell = top[2]
+            key_new = self.calculate_key(cell)
+            self.num_expanded += 1
+            if key_old < key_new:
+                self.push(cell)
+                continue
+            neighbors = cell + offset_array
+            g_old = g_cells[cell]
+            if g_old > rhs_cells[cell]:
+                g_cells[cell] = rhs_cells[cell]
+                del self.open_keys[cell]
+                candidates = cost_array + g_cells[cell]
+                improved = (cell_free[neighbors] == 1) & (candidates < rhs_cells[neighbors])
+                rhs_cells[neighbors[improved]] = candidates[improved]
+                for neighbor in neighbors[improved].tolist():
+                    self.update_open(neighbor)
+            else:
+                g_cells[cell] = np.inf
+                dependent = neighbors[(cell_free[neighbors] == 1) & (rhs_cells[neighbors] == cost_array + g_old)]
+                self.update_vertices(np.append(dependent, cell))
+
+    # Follows the steepest descent of g from the start cell to the goal cell
+    # INPUT: None
+    # OUTPUT: A list of tuples, which is a list of the states that go from start to goal
+    def reconstruct_path(self):
+        cells = [self.init_cell]
+        while cells[-1] != self.goal_cell:
+            neighbors = cells[-1] + self.offset_array
+            costs = self.cost_array + self.g_cells[neighbors]
+            costs[self.cell_free[neighbors] != 1] = np.inf
+            k = np.argmin(costs)
+            if costs[k] == np.inf or len(cells) > len(self.g_cells):
+                return None
+            cells.append(int(neighbors[k]))
+        path = [self.cell_to_state(cell) for cell in cells]
+        path[0] = self.x_init
+        path[-1] = self.x_goal
+        return path
+
+    # Repairs the search for the current start and occupancy grid and places
+    # the solution path inside self.path, like AStar.solve
+    # INPUT: None
+    # OUTPUT: Boolean, True if a solution from x_init to x_goal was found
+    def solve(self):
+        if self.init_cell is None or self.goal_cell is None:
+            # endpoints outside of the state space are only handled by the generic solver
+            problem = GridAStar(self.statespace_lo, self.statespace_hi, self.x_init, self.x_goal, self.occupancy, self.resolution)
+            found = problem.solve()
+            self.path = problem.path
+            return found
+
+        self.num_expanded = 0
+        if not self.is_reachable():
+            # the search would expand every cell connected to the goal
+            self.path = None
+            return False
+        self.compute_shortest_path()
+        if self.g_cells[self.init_cell] == np.inf:
+            self.path = None
+            return False
+        self.path = self.reconstruct_path()
+        return self.path is not None
@@ -1,7 +1,18 @@
+import bisect
+import copy
+import itertools
+import math
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 
+# number of updated() calls a StochOccupancyGrid2D remembers the changed
+# states of (see changed_bounds)
+CHANGE_HISTORY = 32
+
+# version numbers of the StochOccupancyGrid2D contents, unique in the process
+_grid_versions = itertools.count()
+
 
 # A 2D state space grid with a set of rectangular obstacles. The grid is fully deterministic
 class DetOccupancyGrid2D(object):
@@ -9,17 +20,61 @@ class DetOccupancyGrid2D(object):
         self.width = width
         self.height = height
         self.obstacles = obstacles
+        self.build_obstacle_index()
+
+    # Rasterizes the obstacles into a bitmap over the distinct coordinates of
+    # their edges. Along each dimension, slot 2k+1 stands for the edge
+    # coordinate edges[k] itself and slot 2k for the open interval just below
+    # it, so the bitmap matches the closed rectangle test of the obstacles
+    # exactly, at any float coordinate. A query costs a binary search per
+    # dimension and one lookup, O(log n) in the number of obstacles instead of
+    # the O(n) scan. A fixed resolution raster would be O(1) but only exact for
+    # edges and queries on its lattice; the searches run in C over lists, and
+    # measured faster than the arithmetic of a raster lookup. Call again if
+    # obstacles is modified.
+    def build_obstacle_index(self):
+        lower = np.array([obs[0] for obs in self.obstacles], dtype=float).reshape(-1, 2)
+        upper = np.array([obs[1] for obs in self.obstacles], dtype=float).reshape(-1, 2)
+        # rectangles with a lower corner above their upper corner contain no state
+        valid = np.all(lower <= upper, axis=1)
+        lower = lower[valid]
+        upper = upper[valid]
+
+        self.edges = [np.unique(np.concatenate((lower[:,dim], upper[:,dim]))) for dim in range(2)]
+        lower_slots = [2*np.searchsorted(self.edges[dim], lower[:,dim]) + 1 for dim in range(2)]
+        upper_slots = [2*np.searchsorted(self.edges[dim], upper[:,dim]) + 2 for dim in range(2)]
+        # 2D difference array of the obstacle counts, summed up into the bitmap
+        counts = np.zeros((2*len(self.edges[0]) + 2, 2*len(self.edges[1]) + 2), dtype=int)
+        np.add.at(counts, (lower_slots[0], lower_slots[1]), 1)
+        np.add.at(counts, (upper_slots[0], lower_slots[1]), -1)
+        np.add.at(counts, (lower_slots[0], upper_slots[1]), -1)
+        np.add.at(counts, (upper_slots[0], upper_slots[1]), 1)
+        self.occupied = counts.cumsum(axis=0).cumsum(axis=1)[:-1,:-1] > 0
+        self.edge_lists = [edges.tolist() for edges in self.edges]
+
+    # slot of the obstacle bitmap containing coordinate v along dimension dim
+    def edge_slot(self, dim, v):
+        edges = self.edge_lists[dim]
+        k = bisect.bisect_left(edges, v)
+        if k < len(edges) and edges[k] == v:
+            return 2*k + 1
+        return 2*k
 
     def is_free(self, x):
-        for obs in self.obstacles:
-            inside = True
-            for dim in range(len(x)):
-                if x[dim] < obs[0][dim] or x[dim] > obs[1][dim]:
-                    inside = False
-                    break
-            if inside:
-                return False
-        return True
+        return not self.occupied[self.edge_slot(0, x[0]), self.edge_slot(1, x[1])]
+
+    # vectorized is_free over arrays of x and y coordinates
+    def is_free_states(self, xs, ys):
+        slots = []
+        for dim, v in enumerate((xs, ys)):
+            v = np.asarray(v, dtype=float)
+            edges = self.edges[dim]
+            k = np.searchsorted(edges, v)
+            on_edge = np.zeros(v.shape, dtype=bool)
+            if len(edges) > 0:
+                on_edge = edges[np.minimum(k, len(edges) - 1)] == v
+            slots.append(2*k + on_edge)
+        return ~self.occupied[slots[0], slots[1]]
 
     def plot(self, fig_num=0):
         fig = plt.figure(fig_num)
@@ -39,19 +94,204 @@ class StochOccupancyGrid2D(object):
         self.height = height
         self.origin_x = origin_x
         self.origin_y = origin_y
-        self.probs = probs
+        # occupancy probabilities (percent, -1 unknown) of the cells, row by
+        # row, not copied if they already are an int8 numpy array
+        self.probs = np.asarray(probs, dtype=np.int8)
         self.window_size = window_size
         self.thresh = thresh
+        self.build_free_mask()
+
+        # version of the grid contents, and the (version, bounds) of the last
+        # CHANGE_HISTORY grids it was updated from, bounds of the states whose
+        # is_free may have changed with that version (None for the first grid
+        # or if none changed)
+        self.version = next(_grid_versions)
+        self.changes = ((self.version, None),)
 
     def snap_to_grid(self, x):
         return (self.resolution*round(x[0]/self.resolution), self.resolution*round(x[1]/self.resolution))
 
+    # offsets (in cells) of the window combined by is_free, relative to its center
+    def window_offsets(self):
+        lower = -int(round((self.window_size-1)/2))
+        upper = int(round((self.window_size-1)/2))
+        return lower, upper
+
+    # map cell index of each snapped grid coordinate resolution*k, computed with
+    # the same float operations as is_free_window. Cells on the first row/column
+    # or outside the map are not counted by is_free_window, they are mapped to
+    # the index n (an extra zero cell)
+    def window_cells(self, k, origin, n):
+        cells = np.trunc((self.resolution*k - origin) / self.resolution).astype(int)
+        cells[(cells <= 0) | (cells >= n)] = n
+        return cells
+
+    # Precomputes the free/occupied status of every snapped grid point whose
+    # window overlaps the map (see compute_free_mask)
+    def build_free_mask(self):
+        lower, upper = self.window_offsets()
+
+        # grid points whose window may touch the map, with a margin
+        self.mask_lo = (int(round(self.origin_x/self.resolution)) - upper - 2,
+                        int(round(self.origin_y/self.resolution)) - upper - 2)
+        n_x = self.width + upper - lower + 4
+        n_y = self.height + upper - lower + 4
+        # map cells of the windows, the window of grid point g covers cells[g:g+window_size]
+        self.cells_x = self.window_cells(np.arange(self.mask_lo[0]+lower, self.mask_lo[0]+n_x+upper), self.origin_x, self.width)
+        self.cells_y = self.window_cells(np.arange(self.mask_lo[1]+lower, self.mask_lo[1]+n_y+upper), self.origin_y, self.height)
+        self.free_mask = self.compute_free_mask(0, n_x, 0, n_y)
+
+    # log(1-p) of the bounding box of the map cells referenced by window cell
+    # indices, with an extra zero row and column last for the cells that
+    # is_free_window skips. Returns it with the indices remapped into it
+    def cropped_log_free(self, cells_x, cells_y):
+        inside_x = cells_x[cells_x < self.width]
+        inside_y = cells_y[cells_y < self.height]
+        x0, x1 = (inside_x.min(), inside_x.max() + 1) if len(inside_x) else (0, 0)
+        y0, y1 = (inside_y.min(), inside_y.max() + 1) if len(inside_y) else (0, 0)
+        probs = self.probs.reshape(self.height, self.width)[y0:y1,x0:x1]
+        log_free = np.zeros((y1-y0+1, x1-x0+1))
+        with np.errstate(divide='ignore'):
+            log_free[:-1,:-1] = np.log(1.0 - np.maximum(0.0, probs/100.0))
+        return (log_free,
+                np.where(cells_x < self.width, cells_x - x0, x1 - x0),
+                np.where(cells_y < self.height, cells_y - y0, y1 - y0))
+
+    # Computes the free/occupied status of the grid points [gx0, gx1) x
+    # [gy0, gy1) of the mask. The window product of (1-p) is computed as a box
+    # filter over log(1-p), separately along x and y. Grid points whose result
+    # is within float tolerance of the threshold are resolved with the exact
+    # product from is_free_window so the mask matches it bit for bit.
+    def compute_free_mask(self, gx0, gx1, gy0, gy1):
+        lower, upper = self.window_offsets()
+        size = upper - lower + 1
+        n_x = gx1 - gx0
+        n_y = gy1 - gy0
+        log_free, cells_x, cells_y = self.cropped_log_free(self.cells_x[gx0:gx1+size-1], self.cells_y[gy0:gy1+size-1])
+
+        window_x = np.zeros((log_free.shape[0], n_x))
+        for i in range(size):
+            window_x += log_free[:,cells_x[i:i+n_x]]
+        log_p_total = np.zeros((n_y, n_x))
+        for i in range(size):
+            log_p_total += window_x[cells_y[i:i+n_y],:]
+
+        occupied_prob = 1.0 - np.exp(log_p_total)
+        free_mask = occupied_prob < self.thresh
+        for gy, gx in zip(*np.nonzero(np.abs(occupied_prob - self.thresh) < 1e-9)):
+            state = (self.resolution*(self.mask_lo[0]+gx0+gx), self.resolution*(self.mask_lo[1]+gy0+gy))
+            free_mask[gy,gx] = self.is_free_window(state)
+        return free_mask
+
+    # range [g0, g1) of the mask grid points whose window covers some of the
+    # map cells [c0, c1) along one dimension, empty if there are none
+    def window_range(self, cells, c0, c1):
+        lower, upper = self.window_offsets()
+        size = upper - lower + 1
+        covered = np.flatnonzero((cells >= c0) & (cells < c1))
+        if len(covered) == 0:
+            return 0, 0
+        return max(0, covered[0] - size + 1), min(len(cells) - size + 1, covered[-1] + 1)
+
+    # Returns a new grid with the cells of a rectangle of the map replaced, as
+    # done by a map_msgs/OccupancyGridUpdate. This grid is left unchanged, and
+    # only the grid points of the free mask whose window overlaps the
+    # rectangle are recomputed.
+    # INPUT: (x, y, width, height, data)
+    #          x, y - map cell of the lower left corner of the rectangle
+    #          width, height - size of the rectangle (cells)
+    #          data - occupancy probabilities of the rectangle, row by row
+    # OUTPUT: A new StochOccupancyGrid2D
+    def updated(self, x, y, width, height, data):
+        grid = copy.copy(self)
+        grid.probs = self.probs.copy()
+        patch = np.asarray(data, dtype=np.int8).reshape(height, width)
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.width), min(y + height, self.height)
+        if x1 <= x0 or y1 <= y0:
+            return grid
+        grid.probs.reshape(self.height, self.width)[y0:y1,x0:x1] = patch[y0-y:y1-y,x0-x:x1-x]
+
+        gx0, gx1 = self.window_range(self.cells_x, x0, x1)
+        gy0, gy1 = self.window_range(self.cells_y, y0, y1)
+        grid.free_mask = self.free_mask.copy()
+        grid.version = next(_grid_versions)
+        bounds = None
+        if gx1 > gx0 and gy1 > gy0:
+            grid.free_mask[gy0:gy1,gx0:gx1] = grid.compute_free_mask(gx0, gx1, gy0, gy1)
+            # states looking up the recomputed grid points, with a grid point of
+            # margin for the states halfway between two of them
+            bounds = (self.resolution*(self.mask_lo[0] + gx0 - 1), self.resolution*(self.mask_lo[1] + gy0 - 1),
+                      self.resolution*(self.mask_lo[0] + gx1), self.resolution*(self.mask_lo[1] + gy1))
+        grid.changes = (self.changes + ((grid.version, bounds),))[-CHANGE_HISTORY:]
+        return grid
+
+    # Returns a grid with all the cell probabilities replaced, e.g. by a new
+    # map of the same size, in which only the bounding rectangle of the
+    # changed cells is recomputed (see updated)
+    # INPUT: (probs)
+    #          probs - occupancy probabilities of the cells, row by row
+    # OUTPUT: A new StochOccupancyGrid2D, or this grid if no cell changed
+    def replaced(self, probs):
+        probs = np.asarray(probs, dtype=np.int8).reshape(self.height, self.width)
+        changed = probs != self.probs.reshape(self.height, self.width)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if len(rows) == 0:
+            return self
+        cols = np.flatnonzero(changed.any(axis=0))
+        x0, x1 = cols[0], cols[-1] + 1
+        y0, y1 = rows[0], rows[-1] + 1
+        return self.updated(x0, y0, x1 - x0, y1 - y0, probs[y0:y1,x0:x1])
+
+    # Bounds of the states whose is_free may differ from an older grid, which
+    # this grid was obtained from by at most CHANGE_HISTORY calls to updated()
+    # or replaced()
+    # INPUT: (other)
+    #          other - older occupancy grid
+    # OUTPUT: A list of (x_min, y_min, x_max, y_max) bounds, empty if no state
+    #         changed, or None if the changes are not known
+    def changed_bounds(self, other):
+        versions = [version for version, bounds in self.changes]
+        if getattr(other, 'version', None) not in versions:
+            return None
+        k = versions.index(other.version)
+        return [bounds for version, bounds in self.changes[k+1:] if bounds is not None]
+
     def is_free(self, state):
+        # look up the precomputed mask at the grid point closest to state
+        kx = state[0]/self.resolution
+        ky = state[1]/self.resolution
+        if abs(kx - math.floor(kx) - 0.5) < 1e-6 or abs(ky - math.floor(ky) - 0.5) < 1e-6:
+            # halfway between grid points, rounding of the window cells may differ
+            return self.is_free_window(state)
+        gx = int(round(kx)) - self.mask_lo[0]
+        gy = int(round(ky)) - self.mask_lo[1]
+        if gx < 0 or gy < 0 or gx >= self.free_mask.shape[1] or gy >= self.free_mask.shape[0]:
+            # the window does not touch the map
+            return 0.0 < self.thresh
+        return bool(self.free_mask[gy,gx])
+
+    # vectorized is_free over arrays of x and y coordinates
+    def is_free_states(self, xs, ys):
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        kx = xs/self.resolution
+        ky = ys/self.resolution
+        free = np.full(kx.shape, 0.0 < self.thresh)
+        gx = np.round(kx).astype(int) - self.mask_lo[0]
+        gy = np.round(ky).astype(int) - self.mask_lo[1]
+        inside = (gx >= 0) & (gy >= 0) & (gx < self.free_mask.shape[1]) & (gy < self.free_mask.shape[0])
+        free[inside] = self.free_mask[gy[inside],gx[inside]]
+        ties = (np.abs(kx - np.floor(kx) - 0.5) < 1e-6) | (np.abs(ky - np.floor(ky) - 0.5) < 1e-6)
+        for i in np.flatnonzero(ties):
+            free.flat[i] = self.is_free_window((xs.flat[i], ys.flat[i]))
+        return free
+
+    def is_free_window(self, state):
         # combine the probabilities of each cell by assuming independence
         # of each estimation
         p_total = 1.0
-        lower = -int(round((self.window_size-1)/2))
-        upper = int(round((self.window_size-1)/2))
+        lower, upper = self.window_offsets()
         for dx in range(lower,upper+1):
             for dy in range(lower,upper+1):
                 x, y = self.snap_to_grid([state[0] + dx * self.resolution, state[1] + dy * self.resolution])
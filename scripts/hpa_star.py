@@ -0,0 +1,355 @@
+import heapq
+import math
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+from astar import GridAStar, grid_index_range, occupancy_free_cells
+
+# side length of the square clusters the state space is partitioned into, in cells
+CLUSTER_SIZE = 16
+
+# entrances at least this many cells wide get a transition at each end instead
+# of a single one in the middle
+ENTRANCE_SPLIT_LENGTH = 6
+ENTRANCE_SPACING = 8
+
+# Abstract graph of Hierarchical Path-Finding A* (Botea, Mueller and Schaeffer
+# 2004). The cells of a planning state space are partitioned into square
+# clusters. Along the border of two neighboring clusters, every run of cells
+# that are free on both sides is an entrance, crossed by one or two
+# transitions (pairs of cells facing each other). The cells of the transitions
+# are the nodes of the abstract graph, and the shortest paths between the nodes
+# of a cluster, staying inside the cluster, are computed upfront. Searches then
+# run over the abstract graph and only the path they pick is refined to cells.
+# Cells are flat indices j*grid_shape[0] + i into the state space grid.
+class ClusterGraph(object):
+
+    def __init__(self, statespace_lo, statespace_hi, occupancy, resolution=1, cluster_size=CLUSTER_SIZE):
+        self.statespace_lo = statespace_lo
+        self.statespace_hi = statespace_hi
+        self.resolution = resolution
+        self.cluster_size = cluster_size
+
+        self.grid_lo = []
+        self.grid_shape = []
+        for dim in range(2):
+            k_lo, n = grid_index_range(statespace_lo[dim], statespace_hi[dim], resolution)
+            self.grid_lo.append(k_lo)
+            self.grid_shape.append(n)
+        self.num_clusters = [int(math.ceil(float(n)/cluster_size)) for n in self.grid_shape]
+
+        self.transitions = {}           # dictionary of the transitions of each border (cluster, cluster)
+        self.cluster_nodes = {}         # dictionary of the node cells of each cluster
+        self.cluster_costs = {}         # dictionary of the path costs between the nodes of each cluster
+        self.cluster_predecessors = {}  # dictionary of the shortest path trees out of the nodes of each cluster
+        self.node_transitions = {}      # dictionary of the cells each node cell has a transition to
+
+        self.occupancy = None
+        self.free = None
+        self.update_occupancy(occupancy)
+
+    def clusters(self):
+        return [(ci, cj) for ci in range(self.num_clusters[0]) for cj in range(self.num_clusters[1])]
+
+    # the borders (cluster, cluster) of a cluster, lower cluster first
+    def cluster_borders(self, cluster):
+        ci, cj = cluster
+        borders = []
+        if ci > 0:
+            borders.append(((ci-1, cj), cluster))
+        if cj > 0:
+            borders.append(((ci, cj-1), cluster))
+        if ci + 1 < self.num_clusters[0]:
+            borders.append((cluster, (ci+1, cj)))
+        if cj + 1 < self.num_clusters[1]:
+            borders.append((cluster, (ci, cj+1)))
+        return borders
+
+    # cell ranges [i0, i1) and [j0, j1) of a cluster
+    def cluster_bounds(self, cluster):
+        i0 = cluster[0]*self.cluster_size
+        j0 = cluster[1]*self.cluster_size
+        return i0, min(i0 + self.cluster_size, self.grid_shape[0]), j0, min(j0 + self.cluster_size, self.grid_shape[1])
+
+    def cluster_of(self, cell):
+        j, i = divmod(cell, self.grid_shape[0])
+        return (i//self.cluster_size, j//self.cluster_size)
+
+    # checks if two cells are in the same or in touching clusters
+    def are_neighbors(self, cell1, cell2):
+        cluster1 = self.cluster_of(cell1)
+        cluster2 = self.cluster_of(cell2)
+        return abs(cluster1[0] - cluster2[0]) <= 1 and abs(cluster1[1] - cluster2[1]) <= 1
+
+    # Converts a state to its cell
+    # INPUT: (x)
+    #          x - tuple state
+    # OUTPUT: Integer cell, or None if x is outside the state space
+    def state_to_cell(self, x):
+        i = int(round(x[0]/self.resolution)) - self.grid_lo[0]
+        j = int(round(x[1]/self.resolution)) - self.grid_lo[1]
+        if i < 0 or j < 0 or i >= self.grid_shape[0] or j >= self.grid_shape[1]:
+            return None
+        return i + j*self.grid_shape[0]
+
+    def cell_to_state(self, cell):
+        j, i = divmod(cell, self.grid_shape[0])
+        return (self.resolution*(self.grid_lo[0] + i), self.resolution*(self.grid_lo[1] + j))
+
+    # Installs a new occupancy grid and recomputes the clusters it changed.
+    # Only the borders of clusters with a changed cell are recomputed, and only
+    # the clusters whose cells or nodes changed get their paths recomputed
+    # INPUT: (occupancy)
+    #          occupancy - the new occupancy grid
+    # OUTPUT: Integer, the number of clusters recomputed
+    def update_occupancy(self, occupancy):
+        self.occupancy = occupancy
+        new_free = occupancy_free_cells(occupancy, self.grid_lo, self.grid_shape, self.resolution)
+        if self.free is None:
+            dirty = set(self.clusters())
+        else:
+            changed_j, changed_i = np.nonzero(new_free != self.free)
+            dirty = set(zip((changed_i//self.cluster_size).tolist(), (changed_j//self.cluster_size).tolist()))
+        self.free = new_free
+
+        borders = set()
+        for cluster in dirty:
+            borders.update(self.cluster_borders(cluster))
+        recompute = set(dirty)
+        for border in borders:
+            transitions = self.find_transitions(border)
+            if transitions != self.transitions.get(border):
+                self.transitions[border] = transitions
+                recompute.update(border)
+
+        for cluster in recompute:
+            self.build_cluster(cluster)
+        self.node_transitions = {}
+        for transitions in self.transitions.values():
+            for cell1, cell2 in transitions:
+                self.node_transitions.setdefault(cell1, []).append(cell2)
+                self.node_transitions.setdefault(cell2, []).append(cell1)
+        return len(recompute)
+
+    # Finds the transitions across the border of two neighboring clusters
+    # INPUT: (border)
+    #          border - tuple (cluster, cluster), lower cluster first
+    # OUTPUT: A list of tuples (cell, cell), the cell of the lower cluster first
+    def find_transitions(self, border):
+        lower, upper = border
+        i0, i1, j0, j1 = self.cluster_bounds(lower)
+        if upper[0] != lower[0]:
+            # vertical border, between columns i1-1 and i1
+            side = np.append(self.free[j0:j1,i1-1] & self.free[j0:j1,i1], False)
+            cell = lambda k: (i1 - 1) + (j0 + k)*self.grid_shape[0]
+            step = 1
+        else:
+            # horizontal border, between rows j1-1 and j1
+            side = np.append(self.free[j1-1,i0:i1] & self.free[j1,i0:i1], False)
+            cell = lambda k: (i0 + k) + (j1 - 1)*self.grid_shape[0]
+            step = self.grid_shape[0]
+
+        transitions = []
+        # runs of cells open on both sides
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], side)).astype(int)))
+        for start, end in zip(edges[0::2].tolist(), (edges[1::2] - 1).tolist()):
+            if end - start + 1 >= ENTRANCE_SPLIT_LENGTH:
+                num = int(math.ceil(float(end - start)/ENTRANCE_SPACING))
+                positions = sorted(set(int(round(start + k*float(end - start)/num)) for k in range(num + 1)))
+            else:
+                positions = [(start + end)//2]
+            for k in positions:
+                transitions.append((cell(k), cell(k) + step))
+        return transitions
+
+    # Builds the graph of the free cells of a cluster, for scipy.sparse.csgraph
+    # INPUT: (cluster, forced_cells)
+    #          cluster - tuple cluster
+    #          forced_cells - cells treated as free, like the endpoints of a plan
+    # OUTPUT: The sparse graph over the cluster cells, indexed like to_local
+    def local_graph(self, cluster, forced_cells=()):
+        i0, i1, j0, j1 = self.cluster_bounds(cluster)
+        free = self.free[j0:j1,i0:i1].copy()
+        for cell in forced_cells:
+            if cell is not None and self.cluster_of(cell) == cluster:
+                j, i = divmod(cell, self.grid_shape[0])
+                free[j-j0,i-i0] = True
+        h, w = free.shape
+        index = np.arange(h*w).reshape(h, w)
+
+        sources = []
+        targets = []
+        costs = []
+        # each undirected edge once, towards the right and/or up
+        for dx, dy in [(1, 0), (0, 1), (1, 1), (-1, 1)]:
+            source_i = slice(max(0, -dx), w - max(0, dx))
+            target_i = slice(max(0, dx), w - max(0, -dx))
+            edges = free[0:h-dy,source_i] & free[dy:h,target_i]
+            sources.append(index[0:h-dy,source_i][edges])
+            targets.append(index[dy:h,target_i][edges])
+            costs.append(np.full(np.count_nonzero(edges), self.resolution*math.hypot(dx, dy)))
+        return scipy.sparse.csr_matrix((np.concatenate(costs), (np.concatenate(sources), np.concatenate(targets))), shape=(h*w, h*w))
+
+    # converts a cell to its index among the cells of its cluster
+    def to_local(self, cluster, cell):
+        i0, i1, j0, j1 = self.cluster_bounds(cluster)
+        j, i = divmod(cell, self.grid_shape[0])
+        return (i - i0) + (j - j0)*(i1 - i0)
+
+    def from_local(self, cluster, node):
+        i0, i1, j0, j1 = self.cluster_bounds(cluster)
+        j, i = divmod(int(node), i1 - i0)
+        return (i0 + i) + (j0 + j)*self.grid_shape[0]
+
+    # Recomputes the nodes of a cluster and the paths between them
+    def build_cluster(self, cluster):
+        nodes = set()
+        for border in self.cluster_borders(cluster):
+            for transition in self.transitions.get(border, []):
+                nodes.update(cell for cell in transition if self.cluster_of(cell) == cluster)
+        nodes = sorted(nodes)
+        self.cluster_nodes[cluster] = nodes
+        if not nodes:
+            self.cluster_costs[cluster] = np.zeros((0, 0))
+            self.cluster_predecessors[cluster] = None
+            return
+        graph = self.local_graph(cluster)
+        local_nodes = [self.to_local(cluster, cell) for cell in nodes]
+        dist, predecessors = scipy.sparse.csgraph.dijkstra(graph, directed=False, indices=local_nodes, return_predecessors=True)
+        self.cluster_costs[cluster] = dist[:,local_nodes]
+        self.cluster_predecessors[cluster] = predecessors
+
+    # Follows a shortest path tree of a cluster from a cell back to its root
+    # INPUT: (cluster, predecessors, cell)
+    #          cluster - tuple cluster
+    #          predecessors - the shortest path tree, indexed by the local cluster nodes
+    #          cell - integer cell reached by the tree
+    # OUTPUT: A list of cells, from cell to the root
+    def follow_predecessors(self, cluster, predecessors, cell):
+        node = self.to_local(cluster, cell)
+        cells = [cell]
+        while predecessors[node] >= 0:
+            node = predecessors[node]
+            cells.append(self.from_local(cluster, node))
+        return cells
+
+    # Searches the paths from an endpoint to the cells of its cluster
+    # INPUT: (cell, forced_cells)
+    #          cell - integer cell
+    #          forced_cells - cells treated as free
+    # OUTPUT: (costs, predecessors), the path costs and the shortest path tree over the local cluster nodes
+    def endpoint_search(self, cell, forced_cells):
+        cluster = self.cluster_of(cell)
+        graph = self.local_graph(cluster, forced_cells)
+        costs, predecessors = scipy.sparse.csgraph.dijkstra(graph, directed=False, indices=self.to_local(cluster, cell), return_predecessors=True)
+        return costs, predecessors
+
+    # Finds a path between two cells by searching the abstract graph with A*,
+    # then refining the abstract path cluster by cluster
+    # INPUT: (start, goal)
+    #          start - integer cell
+    #          goal - integer cell
+    # OUTPUT: (cells, num_expanded), the list of cells of the path (None if the
+    #         abstract graph does not connect them) and the number of abstract nodes expanded
+    def find_path(self, start, goal):
+        forced_cells = (start, goal)
+        start_cluster = self.cluster_of(start)
+        goal_cluster = self.cluster_of(goal)
+        start_costs, start_predecessors = self.endpoint_search(start, forced_cells)
+        goal_costs, goal_predecessors = self.endpoint_search(goal, forced_cells)
+
+        def neighbors(node):
+            if node == start:
+                for other in self.cluster_nodes[start_cluster]:
+                    yield other, start_costs[self.to_local(start_cluster, other)]
+                if goal_cluster == start_cluster:
+                    yield goal, start_costs[self.to_local(start_cluster, goal)]
+            cluster = self.cluster_of(node)
+            nodes = self.cluster_nodes[cluster]
+            if node in self.node_transitions:
+                costs = self.cluster_costs[cluster][nodes.index(node)]
+                for k, other in enumerate(nodes):
+                    yield other, costs[k]
+                for other in self.node_transitions[node]:
+                    yield other, self.resolution
+            if cluster == goal_cluster:
+                yield goal, goal_costs[self.to_local(goal_cluster, node)]
+
+        goal_j, goal_i = divmod(goal, self.grid_shape[0])
+        def heuristic(node):
+            j, i = divmod(node, self.grid_shape[0])
+            return self.resolution*math.hypot(i - goal_i, j - goal_j)
+
+        g_score = {start: 0.0}
+        came_from = {}
+        closed_set = set()
+        open_heap = [(heuristic(start), start)]
+        while open_heap:
+            _, current = heapq.heappop(open_heap)
+            if current in closed_set:
+                continue
+            if current == goal:
+                break
+            closed_set.add(current)
+            for neighbor, cost in neighbors(current):
+                if cost == np.inf or neighbor in closed_set:
+                    continue
+                tentative_g_score = g_score[current] + cost
+                if tentative_g_score < g_score.get(neighbor, np.inf):
+                    g_score[neighbor] = tentative_g_score
+                    came_from[neighbor] = current
+                    heapq.heappush(open_heap, (tentative_g_score + heuristic(neighbor), neighbor))
+        if goal not in came_from and goal != start:
+            return None, len(closed_set)
+
+        nodes = [goal]
+        while nodes[-1] != start:
+            nodes.append(came_from[nodes[-1]])
+        nodes.reverse()
+
+        # refine each abstract edge to the cells it stands for
+        cells = [start]
+        for node1, node2 in zip(nodes[:-1], nodes[1:]):
+            cluster = self.cluster_of(node1)
+            if self.cluster_of(node2) != cluster:
+                segment = [node1, node2]
+            elif node1 == start:
+                segment = self.follow_predecessors(cluster, start_predecessors, node2)[::-1]
+            elif node2 == goal:
+                segment = self.follow_predecessors(cluster, goal_predecessors, node1)
+            else:
+                predecessors = self.cluster_predecessors[cluster][self.cluster_nodes[cluster].index(node1)]
+                segment = self.follow_predecessors(cluster, predecessors, node2)[::-1]
+            cells.extend(segment[1:])
+        return cells, len(closed_set)
+
+# Planner searching a ClusterGraph of the state space, which can be shared
+# between plans as long as the state space, resolution and occupancy grid are
+# the same (see ClusterGraph.update_occupancy). Paths are near optimal, they
+# may be a few percent longer than GridAStar's. Plans between neighboring
+# clusters, whose detours through the entrances would be proportionally the
+# largest, and plans the abstract graph cannot connect (e.g. through a gap
+# between clusters only crossed diagonally) are handed to GridAStar.
+class HPAStar(GridAStar):
+
+    def __init__(self, statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution=1, cluster_graph=None):
+        super(HPAStar, self).__init__(statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution)
+        if cluster_graph is None:
+            cluster_graph = ClusterGraph(statespace_lo, statespace_hi, occupancy, resolution)
+        self.cluster_graph = cluster_graph
+
+    # Solves the planning problem over the abstract graph, places the solution
+    # path inside self.path, like AStar.solve
+    # INPUT: None
+    # OUTPUT: Boolean, True if a solution from x_init to x_goal was found
+    def solve(self):
+        start = self.cluster_graph.state_to_cell(self.x_init)
+        goal = self.cluster_graph.state_to_cell(self.x_goal)
+        if start is not None and goal is not None and not self.cluster_graph.are_neighbors(start, goal):
+            cells, self.num_expanded = self.cluster_graph.find_path(start, goal)
+            if cells is not None:
+                self.path = [self.cluster_graph.cell_to_state(cell) for cell in cells]
+                self.path[0] = self.x_init
+                self.path[-1] = self.x_goal
+                return True
+        return super(HPAStar, self).solve()
@@ -1,15 +1,28 @@
 #!/usr/bin/env python
 
 import rospy
+from rospy.numpy_msg import numpy_msg
 from nav_msgs.msg import OccupancyGrid, MapMetaData, Path
+from map_msgs.msg import OccupancyGridUpdate
 from gazebo_msgs.msg import ModelStates
 from geometry_msgs.msg import Twist, PoseArray, Pose2D, PoseStamped, PoseWithCovarianceStamped
 from std_msgs.msg import Float32MultiArray, String
 import tf
+import threading
+from collections import namedtuple
 import numpy as np
 from numpy import linalg
 from utils import wrapToPi
-from astar import AStar
+from astar import AStar, GridAStar, JumpPointSearch
+from dstar_lite import DStarLite
+from hpa_star import ClusterGraph, HPAStar
+from ara_star import AnytimeRepairingAStar
+from theta_star import ThetaStar
+from path_smoothing import shortcut_path
+from plan_tracking import densify_plan, tabulate_splines, desired_state
+from plan_tracking import nearest_segment, trim_plan, plan_blocked, shorter_route_possible, time_plan
+from connectivity import ConnectivityIndex
+from costmap import ClearanceCostmap
 from grids import StochOccupancyGrid2D
 import scipy.interpolate
 import matplotlib.pyplot as plt
@@ -21,9 +34,9 @@ from asl_turtlebot.msg import TSalesRequest, TSalesCircuit
 # from trajectory to pose control
 END_POS_THRESH = .2
 
-# threshold to be far enough into the plan
-# to recompute it
-START_POS_THRESH = .02
+# distance from the plan beyond which the robot
+# is off the plan and the plan is recomputed
+OFF_PLAN_THRESH = .2
 
 # thereshold in theta to start moving forward when path following
 THETA_START_THRESH = 0.09
@@ -48,6 +61,65 @@ KDY = 1.5
 # smoothing condition (see splrep documentation)
 SMOOTH = .01
 
+# planner used to compute navigation plans:
+# 'astar' plans from scratch with GridAStar every time,
+# 'jps' plans from scratch with JumpPointSearch every time,
+# 'hpa' searches an HPAStar cluster graph kept up to date with the map,
+# 'ara' plans with AnytimeRepairingAStar within PLAN_DEADLINE, and keeps
+# refining the plan while the robot is still at its start,
+# 'theta' plans any-angle paths from scratch with ThetaStar every time,
+# 'dstar_lite' keeps a DStarLite search between plans and repairs it where
+# the map changed and as the robot moves
+PLANNER = 'dstar_lite'
+
+# replace goals that cannot be reached from the robot location
+# by the closest reachable free location instead of giving up
+SNAP_UNREACHABLE_GOALS = False
+
+# time budget of a plan with the anytime planner (s)
+PLAN_DEADLINE = 0.1
+
+# spacing of the spline knots along the straight segments of any-angle plans (m)
+PLAN_KNOT_SPACING = 0.5
+
+# replace the cell by cell planned paths by straight free segments between
+# their corners before fitting the splines, with knots every PLAN_KNOT_SPACING
+SHORTCUT_PLANS = True
+
+# add the clearance cost of the current map to the edges searched by the
+# 'astar' planner, which keeps plans away from the walls
+CLEARANCE_COST = True
+
+# clearance (m) under which the plan is followed slower, down to
+# MIN_SPEED_FRACTION of its speed next to an occupied state
+SLOW_CLEARANCE = 0.3
+MIN_SPEED_FRACTION = 0.5
+
+# velocity profile of the plans: fraction of V_MAX and W_MAX they are timed
+# for, leaving the rest to the tracking feedback, and maximal acceleration
+# (m/s^2). Plans start and end at V_DES
+PROFILE_LIMIT_FRACTION = 0.8
+A_MAX = 0.2
+
+# a map update that does not block the current plan only triggers a replan if
+# it may open a route shorter than SHORTER_ROUTE_RATIO times the rest of the plan
+SHORTER_ROUTE_RATIO = 0.8
+
+# rate of the velocity commands sent by the control thread (Hz)
+CONTROL_RATE = 20
+
+# time after which the planner thread runs again without a new goal or map (s)
+PLAN_PERIOD = 0.5
+
+# time between two samples of the desired state tables of the plans (s)
+TRACK_TABLE_STEP = 0.01
+
+# plan followed by the control thread: the planned states, when their
+# tracking started, the desired state table sampled every table_step up to
+# tf (see tabulate_splines). The planner thread replaces it as a whole, so the
+# control thread always reads a consistent plan
+TrackedPlan = namedtuple('TrackedPlan', ['plan', 'start_time', 'table', 'table_step', 'tf'])
+
 class Navigator:
 
     def __init__(self):
@@ -55,17 +127,48 @@ class Navigator:
 
         rospy.wait_for_service('/static_map')
 
-        # current state
+        # current state, written by the control thread and the amcl callback
+        # under pose_lock, the other threads read it with get_pose
         self.x = 0.0
         self.y = 0.0
         self.theta = 0.0
+        self.pose_lock = threading.Lock()
 
         # goal state
         self.x_g = 0.0
         self.y_g = 0.0
         self.theta_g = 0.0
 
+        self.has_goal = False
+
+        # plan of the planner thread, and the plan tracked by the control thread
         self.current_plan = []
+        self.current_goal = None    # goal current_plan leads to
+        self.current_path = None    # path returned by the planner for current_plan
+        self.current_waypoints = [] # waypoints of current_plan, before densify_plan
+        self.plan_free = None       # free state mask of the connectivity index current_plan was last checked against
+        self.tracked_plan = None
+
+        # incremental or anytime planner kept between plans (PLANNER = 'dstar_lite' or 'ara')
+        self.planner = None
+
+        # abstract graph of the clusters of the state space (PLANNER = 'hpa'),
+        # its clusters touched by a map change are recomputed before planning
+        self.cluster_graph = None
+
+        # connected components of the free space, rebuilt when the map changes
+        self.connectivity = None
+
+        # clearance of the free space, only kept for the planner edges and the
+        # speed profile, and updated around the changes of the map
+        self.costmap = None
+
+        # paths between traveling salesman goals, kept until the map changes
+        self.path_cache = traveling_salesman.PathCache()
+
+        # latest traveling salesman request not yet picked up by the solver thread
+        self.tsales_pending = None
+        self.tsales_condition = threading.Condition()
 
         # map parameters
         self.map_width = 0
@@ -75,6 +178,9 @@ class Navigator:
         self.map_probs = []
         self.occupancy = None
         self.occupancy_updated = False
+        # held by the map callbacks while they build a new grid from
+        # self.occupancy and install it, so no update is lost between them
+        self.map_lock = threading.Lock()
 
         # plan parameters
         self.plan_resolution =  0.1
@@ -84,6 +190,9 @@ class Navigator:
         self.V_prev = 0
         self.V_prev_t = rospy.get_rostime()
 
+        # the planner thread waits on it for a new goal or map
+        self.plan_condition = threading.Condition()
+
         self.nav_path_pub = rospy.Publisher('/cmd_path', Path, queue_size=10)
         self.nav_pose_pub = rospy.Publisher('/cmd_pose', Pose2D, queue_size=10)
         self.nav_pathsp_pub = rospy.Publisher('/cmd_path_sp', PoseStamped, queue_size=10)
@@ -92,48 +201,104 @@ class Navigator:
 
         self.trans_listener = tf.TransformListener()
 
-        rospy.Subscriber('/map', OccupancyGrid, self.map_callback)
+        # maps are deserialized straight into int8 numpy arrays
+        rospy.Subscriber('/map', numpy_msg(OccupancyGrid), self.map_callback)
+        rospy.Subscriber('/map_updates', numpy_msg(OccupancyGridUpdate), self.map_update_callback)
         rospy.Subscriber('/map_metadata', MapMetaData, self.map_md_callback)
         rospy.Subscriber('/cmd_nav', Pose2D, self.cmd_nav_callback)
         rospy.Subscriber('/tsales_request', TSalesRequest, self.tsales_callback)
         rospy.Subscriber('/amcl_pose', PoseWithCovarianceStamped, self.amcl_callback)
 
+        self.tsales_thread = threading.Thread(target=self.tsales_worker)
+        self.tsales_thread.daemon = True
+        self.tsales_thread.start()
+
+        self.planner_thread = threading.Thread(target=self.planner_worker)
+        self.planner_thread.daemon = True
+        self.planner_thread.start()
+
+        self.control_thread = threading.Thread(target=self.control_worker)
+        self.control_thread.daemon = True
+        self.control_thread.start()
+
     def amcl_callback(self, msg):
         # update pose
-        self.x = msg.pose.pose.position.x
-        self.y = msg.pose.pose.position.y
         rotation = [msg.pose.pose.orientation.x, msg.pose.pose.orientation.y, msg.pose.pose.orientation.z, msg.pose.pose.orientation.w]
         euler = tf.transformations.euler_from_quaternion(rotation)
-        self.theta = euler[2]
+        with self.pose_lock:
+            self.x = msg.pose.pose.position.x
+            self.y = msg.pose.pose.position.y
+            self.theta = euler[2]
 
     def tsales_callback(self, msg):
+        # hand the request to the solver thread, replacing any request it has not started yet
+        with self.tsales_condition:
+            self.tsales_pending = msg
+            self.tsales_condition.notify()
+
+    def tsales_worker(self):
+        """ solves traveling salesman requests in the background, so the callbacks are never blocked """
+
+        while not rospy.is_shutdown():
+            with self.tsales_condition:
+                if self.tsales_pending is None:
+                    self.tsales_condition.wait(0.5)
+                msg = self.tsales_pending
+                self.tsales_pending = None
+            if msg is not None:
+                self.solve_tsales(msg)
+
+    def solve_tsales(self, msg):
+        """ publishes improving circuits for a traveling salesman request until the best one is found or a newer request arrives """
+
         print('Solving Traveling Salesman...')
         state_min = self.snap_to_grid((-self.plan_horizon, -self.plan_horizon))
         state_max = self.snap_to_grid((self.plan_horizon, self.plan_horizon))
-        x_init = self.snap_to_grid((self.x, self.y))
-        x_goal = self.snap_to_grid((self.x_g, self.y_g))
+        x, y, _ = self.get_pose()
+        x_init = self.snap_to_grid((x, y))
 
         x_goals = []
         for i in range(len(msg.goal_x)):
             x_goal = self.snap_to_grid((msg.goal_x[i], msg.goal_y[i]))
             x_goals.append((x_goal))
 
-        if msg.do_fast:
-            circuit = traveling_salesman.traveling_salesman_fast(
-                x_init, x_goals, state_min, state_max, self.occupancy, self.plan_resolution)
-        else:
-            circuit = traveling_salesman.traveling_salesman_exact(
-                x_init, x_goals, state_min, state_max, self.occupancy, self.plan_resolution)
-
-        ts_circ = TSalesCircuit()
-        ts_circ.circuit = circuit
-        self.tsales_circuit_pub.publish(ts_circ)
+        occupancy = self.occupancy
+        if not occupancy:
+            rospy.logwarn("Navigator: No occupancy to solve traveling salesman request %d", msg.request_id)
+            ts_circ = TSalesCircuit()
+            ts_circ.request_id = msg.request_id
+            ts_circ.length = np.inf
+            self.tsales_circuit_pub.publish(ts_circ)
+            return
+        connectivity = self.get_connectivity(state_min, state_max)
+        if connectivity.occupancy is not occupancy:
+            connectivity = ConnectivityIndex(state_min,state_max,occupancy,self.plan_resolution)
+
+        stats = {}
+        circuits = traveling_salesman.traveling_salesman_anytime(
+            x_init, x_goals, state_min, state_max, occupancy, self.plan_resolution, connectivity,
+            exact=not msg.do_fast, cache=self.path_cache, stats=stats)
+        for circuit, length in circuits:
+            if 'pair_times' in stats:
+                rospy.logdebug("Navigator: %d path searches (%d cached pairs) for request %d, longest %f s",
+                               stats['num_searches'], stats['num_cached'], msg.request_id, np.max(stats.pop('pair_times')))
+            if self.tsales_pending is not None:
+                rospy.loginfo("Navigator: Dropping traveling salesman request %d for a newer one", msg.request_id)
+                return
+            rospy.loginfo("Navigator: Traveling salesman circuit of length %f for request %d", length, msg.request_id)
+            ts_circ = TSalesCircuit()
+            ts_circ.circuit = circuit
+            ts_circ.length = length
+            ts_circ.request_id = msg.request_id
+            self.tsales_circuit_pub.publish(ts_circ)
 
     def cmd_nav_callback(self, data):
         self.x_g = data.x
         self.y_g = data.y
         self.theta_g = data.theta
-        self.run_navigator()
+        self.has_goal = True
+        with self.plan_condition:
+            self.plan_condition.notify()
 
     def map_md_callback(self, msg):
         print msg
@@ -143,91 +308,291 @@ class Navigator:
         self.map_origin = (msg.origin.position.x,msg.origin.position.y)
 
     def map_callback(self,msg):
-        print 'map callback'
-        print msg.data
-        self.map_probs = msg.data
-        if self.map_width>0 and self.map_height>0 and len(self.map_probs)>0:
-            self.occupancy = StochOccupancyGrid2D(self.map_resolution,
-                                                  self.map_width,
-                                                  self.map_height,
-                                                  self.map_origin[0],
-                                                  self.map_origin[1],
-                                                  8,
-                                                  self.map_probs)
-            self.occupancy_updated = True
-            print 'updated occupancy'
-        print self.occupancy
-
-    def close_to_end_location(self):
-        return (abs(self.x-self.x_g)<END_POS_THRESH and abs(self.y-self.y_g)<END_POS_THRESH)
+        # the layout comes with the map, /map_metadata may lag behind a grown map
+        info = msg.info
+        probs = np.asarray(msg.data, dtype=np.int8)
+        if info.width>0 and info.height>0 and len(probs)>0:
+            with self.map_lock:
+                self.map_width = info.width
+                self.map_height = info.height
+                self.map_resolution = info.resolution
+                self.map_origin = (info.origin.position.x,info.origin.position.y)
+                self.map_probs = probs
+                occupancy = self.occupancy
+                if occupancy is not None and (occupancy.resolution, occupancy.width, occupancy.height, occupancy.origin_x, occupancy.origin_y) == \
+                        (self.map_resolution, self.map_width, self.map_height, self.map_origin[0], self.map_origin[1]):
+                    # same map layout, only the changed rectangle is recomputed
+                    occupancy = occupancy.replaced(self.map_probs)
+                else:
+                    occupancy = StochOccupancyGrid2D(self.map_resolution,
+                                                     self.map_width,
+                                                     self.map_height,
+                                                     self.map_origin[0],
+                                                     self.map_origin[1],
+                                                     8,
+                                                     self.map_probs)
+                self.set_occupancy(occupancy)
+
+    def map_update_callback(self, msg):
+        with self.map_lock:
+            if self.occupancy is not None:
+                self.set_occupancy(self.occupancy.updated(msg.x, msg.y, msg.width, msg.height, msg.data))
+
+    def set_occupancy(self, occupancy):
+        """ switches to a new occupancy grid and wakes up the planner thread, unless the map did not change, call with map_lock held """
+
+        if occupancy is self.occupancy:
+            return
+        self.occupancy = occupancy
+        self.occupancy_updated = True
+        self.path_cache.new_map(occupancy)
+        with self.plan_condition:
+            self.plan_condition.notify()
+        rospy.loginfo("Navigator: Updated occupancy")
+
+    def planner_worker(self):
+        """ replans in the background on new goals and maps, and every PLAN_PERIOD, so the control thread is never blocked """
+
+        while not rospy.is_shutdown():
+            with self.plan_condition:
+                self.plan_condition.wait(PLAN_PERIOD)
+            if self.has_goal:
+                self.run_navigator()
+
+    def control_worker(self):
+        """ sends the velocity commands tracking the latest plan at CONTROL_RATE """
+
+        rate = rospy.Rate(CONTROL_RATE)
+        while not rospy.is_shutdown():
+            if self.has_goal:
+                self.run_controller()
+            try:
+                rate.sleep()
+            except rospy.ROSInterruptException:
+                break
+
+    def lookup_pose(self):
+        """ reads the robot pose (x, y, theta) in the map frame, returns None if it is not available """
+
+        try:
+            (translation,rotation) = self.trans_listener.lookupTransform('/map', '/base_footprint', rospy.Time(0))
+        except (tf.LookupException, tf.ConnectivityException, tf.ExtrapolationException):
+            return None
+        euler = tf.transformations.euler_from_quaternion(rotation)
+        return (translation[0], translation[1], euler[2])
+
+    def update_pose(self):
+        """ reads the robot pose in the map frame and stores it as the current state (control thread only), returns None if it is not available """
+
+        pose = self.lookup_pose()
+        if pose is not None:
+            with self.pose_lock:
+                self.x, self.y, self.theta = pose
+        return pose
+
+    def get_pose(self):
+        """ returns a consistent snapshot (x, y, theta) of the current state """
+
+        with self.pose_lock:
+            return (self.x, self.y, self.theta)
+
+    def clear_plan(self):
+        """ drops the current plan, the control thread stops the robot """
+
+        self.current_plan = []
+        self.tracked_plan = None
+
+    def close_to_end_location(self, x, y):
+        return (abs(x-self.x_g)<END_POS_THRESH and abs(y-self.y_g)<END_POS_THRESH)
 
     def snap_to_grid(self, x):
         return (self.plan_resolution*round(x[0]/self.plan_resolution), self.plan_resolution*round(x[1]/self.plan_resolution))
 
-    def close_to_start_location(self):
-        if len(self.current_plan)>0:
-            snapped_current = self.snap_to_grid([self.x, self.y])
-            snapped_start = self.snap_to_grid(self.current_plan_start_loc)
-            return (abs(snapped_current[0]-snapped_start[0])<START_POS_THRESH and abs(snapped_current[1]-snapped_start[1])<START_POS_THRESH)
+    def off_plan(self, x, y):
+        """ checks if the robot at (x, y) is farther than OFF_PLAN_THRESH from the current plan """
+
+        return nearest_segment(self.current_plan, x, y)[2] > OFF_PLAN_THRESH
+
+    def trim_current_plan(self, x, y):
+        """ drops the part of the current plan the robot at (x, y) has already driven, the plan then starts at its point closest to the robot """
+
+        self.current_plan = trim_plan(self.current_plan, x, y)
+        self.current_waypoints = trim_plan(self.current_waypoints, x, y)
+
+    def get_connectivity(self, state_min, state_max):
+        """ returns the connectivity index of the current occupancy grid """
+
+        if self.connectivity is None or self.connectivity.occupancy is not self.occupancy:
+            self.connectivity = ConnectivityIndex(state_min,state_max,self.occupancy,self.plan_resolution)
+        return self.connectivity
+
+    def get_costmap(self, state_min, state_max):
+        """ returns the clearance costmap of the current occupancy grid, updated around the changes of the map """
+
+        if self.costmap is None:
+            self.costmap = ClearanceCostmap(state_min,state_max,self.occupancy,self.plan_resolution)
+        elif self.costmap.occupancy is not self.occupancy:
+            self.costmap.update_occupancy(self.occupancy)
+        return self.costmap
+
+    def clearance_speed_fractions(self, points):
+        """ returns the fraction of the speed kept at each plan point, lowered where the clearance is under SLOW_CLEARANCE """
+
+        if self.costmap is None or MIN_SPEED_FRACTION >= 1:
+            return np.ones(len(points))
+        clearance = np.array([self.costmap.clearance_at(x) for x in points])
+        return MIN_SPEED_FRACTION + (1-MIN_SPEED_FRACTION)*np.minimum(1.0, clearance/SLOW_CLEARANCE)
+
+    def get_planner(self, state_min, state_max, x_init, x_goal):
+        """ returns the planning problem for the current start and goal, reusing the incremental planner when possible """
+
+        if PLANNER == 'ara':
+            if self.planner is None or self.planner.x_init != x_init or self.planner.x_goal != x_goal or self.planner.occupancy is not self.occupancy:
+                self.planner = AnytimeRepairingAStar(state_min,state_max,x_init,x_goal,self.occupancy,self.plan_resolution,deadline=PLAN_DEADLINE)
+            return self.planner
+        if PLANNER == 'hpa':
+            if self.cluster_graph is None:
+                self.cluster_graph = ClusterGraph(state_min,state_max,self.occupancy,self.plan_resolution)
+            elif self.cluster_graph.occupancy is not self.occupancy:
+                num_recomputed = self.cluster_graph.update_occupancy(self.occupancy)
+                rospy.loginfo("Navigator: %d planning clusters recomputed", num_recomputed)
+            return HPAStar(state_min,state_max,x_init,x_goal,self.occupancy,self.plan_resolution,self.cluster_graph)
+        if PLANNER == 'theta':
+            return ThetaStar(state_min,state_max,x_init,x_goal,self.occupancy,self.plan_resolution)
+        if PLANNER == 'jps':
+            return JumpPointSearch(state_min,state_max,x_init,x_goal,self.occupancy,self.plan_resolution)
+        if PLANNER != 'dstar_lite':
+            costmap = self.get_costmap(state_min, state_max) if CLEARANCE_COST else None
+            return GridAStar(state_min,state_max,x_init,x_goal,self.occupancy,self.plan_resolution,costmap)
+
+        if self.planner is None or self.planner.x_goal != x_goal:
+            self.planner = DStarLite(state_min,state_max,x_init,x_goal,self.occupancy,self.plan_resolution)
+        else:
+            if self.planner.occupancy is not self.occupancy:
+                num_changed = self.planner.update_occupancy(self.occupancy)
+                rospy.loginfo("Navigator: %d planning cells changed occupancy", num_changed)
+            self.planner.update_start(x_init)
+        return self.planner
+
+    def plan_improvable(self, x, y):
+        """ checks if the anytime planner can still improve the current plan, which is only replaced while the robot at (x, y) is at its start """
+
+        return (PLANNER == 'ara' and self.planner is not None and not self.planner.complete
+                and self.planner.x_init == self.snap_to_grid((x, y)))
+
+    def plan_invalidated(self, connectivity, x_goal, x, y):
+        """ checks if the map changes since the current plan was checked block it, or may have opened a clearly shorter route for the robot at (x, y) """
+
+        free = connectivity.free
+        if free is self.plan_free:
+            return False
+        if plan_blocked(self.current_waypoints, self.plan_free, free, connectivity.grid_lo, self.plan_resolution):
+            rospy.loginfo("Navigator: Map update blocks the current plan")
+            return True
+        if shorter_route_possible(self.current_plan, self.plan_free, free, connectivity.grid_lo, self.plan_resolution,
+                                  x_goal, x, y, SHORTER_ROUTE_RATIO):
+            rospy.loginfo("Navigator: Map update may open a shorter route")
+            return True
         return False
 
     def run_navigator(self):
-        """ computes a path from current state to goal state using A* and sends it to the path controller """
+        """ computes a path from current state to goal state using A* and hands it to the control thread """
 
-        # makes sure we have a location
-        try:
-            (translation,rotation) = self.trans_listener.lookupTransform('/map', '/base_footprint', rospy.Time(0))
-            self.x = translation[0]
-            self.y = translation[1]
-            euler = tf.transformations.euler_from_quaternion(rotation)
-            self.theta = euler[2]
-        except (tf.LookupException, tf.ConnectivityException, tf.ExtrapolationException):
-            self.current_plan = []
+        # makes sure we have a location, the planner works on its own reading
+        # of the pose while the control thread updates the current state
+        pose = self.lookup_pose()
+        if pose is None:
+            self.clear_plan()
             return
+        x, y, _ = pose
 
         # makes sure we have a map
-        if not self.occupancy:
+        occupancy = self.occupancy
+        if not occupancy:
             print('no occupancy')
             rospy.loginfo('no occupancy')
-            self.current_plan = []
+            self.clear_plan()
             return
 
-        # if close to the goal, use the pose_controller instead
-        if self.close_to_end_location():
-            rospy.loginfo("Navigator: Close to nav goal using pose controller")
-            pose_g_msg = Pose2D()
-            pose_g_msg.x = self.x_g
-            pose_g_msg.y = self.y_g
-            pose_g_msg.theta = self.theta_g
-            self.nav_pose_pub.publish(pose_g_msg)
-            self.current_plan = []
-            self.V_prev = 0
+        # if close to the goal, the control thread uses the pose_controller instead
+        if self.close_to_end_location(x, y):
+            self.clear_plan()
             return
 
-        # if there is no plan, we are far from the start of the plan,
-        # or the occupancy grid has been updated, update the current plan
-        if len(self.current_plan)==0 or not(self.close_to_start_location()) or self.occupancy_updated:
+        state_min = self.snap_to_grid((-self.plan_horizon, -self.plan_horizon))
+        state_max = self.snap_to_grid((self.plan_horizon, self.plan_horizon))
+        x_goal = self.snap_to_grid((self.x_g, self.y_g))
+
+        # if there is no plan for the goal, the robot is off the plan, or the
+        # anytime planner may still improve the plan, update the current plan
+        replan = (len(self.current_plan)==0 or self.current_goal != x_goal
+                  or self.off_plan(x, y) or self.plan_improvable(x, y))
+
+        # if the occupancy grid has been updated, the rest of the plan is
+        # checked against it, and only recomputed if the update invalidates it
+        if not replan and self.occupancy_updated:
+            connectivity = self.get_connectivity(state_min, state_max)
+            self.trim_current_plan(x, y)
+            replan = self.plan_invalidated(connectivity, x_goal, x, y)
+            if not replan:
+                self.plan_free = connectivity.free
+                if connectivity.occupancy is self.occupancy:
+                    self.occupancy_updated = False
+        if replan:
 
             # use A* to compute new plan
-            state_min = self.snap_to_grid((-self.plan_horizon, -self.plan_horizon))
-            state_max = self.snap_to_grid((self.plan_horizon, self.plan_horizon))
-            x_init = self.snap_to_grid((self.x, self.y))
-            x_goal = self.snap_to_grid((self.x_g, self.y_g))
-            problem = AStar(state_min,state_max,x_init,x_goal,self.occupancy,self.plan_resolution)
+            x_init = self.snap_to_grid((x, y))
+
+            # reject goals outside of the robot's free space component without searching
+            connectivity = self.get_connectivity(state_min, state_max)
+            if not connectivity.is_reachable(x_init, x_goal):
+                x_goal_reachable = None
+                if SNAP_UNREACHABLE_GOALS:
+                    x_goal_reachable = connectivity.nearest_reachable(x_goal, x_init)
+                if x_goal_reachable is None:
+                    rospy.logwarn("Navigator: Goal is not reachable")
+                    self.clear_plan()
+                    return
+                rospy.logwarn("Navigator: Goal is not reachable, moving it to (%.2f, %.2f)", x_goal_reachable[0], x_goal_reachable[1])
+                x_goal = x_goal_reachable
+                self.x_g = x_goal[0]
+                self.y_g = x_goal[1]
+
+            plan_free = connectivity.free
+            # the clearance costmap is only kept up to date when the speed
+            # profile uses it, the 'astar' planner updates it for its edges
+            if MIN_SPEED_FRACTION < 1:
+                self.get_costmap(state_min, state_max)
+            problem = self.get_planner(state_min,state_max,x_init,x_goal)
 
             rospy.loginfo("Navigator: Computing navigation plan")
             if problem.solve():
-                if len(problem.path) > 3:
+                waypoints = problem.path
+                if SHORTCUT_PLANS:
+                    waypoints = shortcut_path(waypoints, self.occupancy, self.plan_resolution)
+                plan = waypoints
+                if SHORTCUT_PLANS or PLANNER == 'theta':
+                    plan = densify_plan(waypoints, PLAN_KNOT_SPACING)
+                if problem.path is self.current_path and len(self.current_plan) > 0:
+                    # the anytime planner has not improved the plan yet
+                    pass
+                elif len(plan) > 3:
                     # cubic spline interpolation requires 4 points
-                    self.current_plan = problem.path
+                    self.current_path = problem.path
+                    self.current_waypoints = waypoints
+                    self.plan_free = plan_free
+                    self.current_plan = plan
+                    self.current_goal = x_goal
                     self.current_plan_start_time = rospy.get_rostime()
-                    self.current_plan_start_loc = [self.x, self.y]
-                    self.occupancy_updated = False
+                    # a map received while planning is taken into account by the next plan
+                    if self.occupancy is occupancy:
+                        self.occupancy_updated = False
 
-                    # publish plan for visualization
+                    # publish plan for visualization, the knots added between
+                    # its waypoints are not needed to draw it
                     path_msg = Path()
                     path_msg.header.frame_id = 'map'
-                    for state in self.current_plan:
+                    for state in waypoints:
                         pose_st = PoseStamped()
                         pose_st.pose.position.x = state[0]
                         pose_st.pose.position.y = state[1]
@@ -236,41 +601,67 @@ class Navigator:
                         path_msg.poses.append(pose_st)
                     self.nav_path_pub.publish(path_msg)
 
-                    path_t = [0]
-                    path_x = [self.current_plan[0][0]]
-                    path_y = [self.current_plan[0][1]]
-                    for i in range(len(self.current_plan)-1):
-                        dx = self.current_plan[i+1][0]-self.current_plan[i][0]
-                        dy = self.current_plan[i+1][1]-self.current_plan[i][1]
-                        path_t.append(path_t[i] + np.sqrt(dx**2 + dy**2) / V_DES)
-                        path_x.append(self.current_plan[i+1][0])
-                        path_y.append(self.current_plan[i+1][1])
+                    # speed profile within V_MAX, lowered by the clearance, W_MAX in the turns and A_MAX
+                    v_limit = PROFILE_LIMIT_FRACTION*V_MAX*self.clearance_speed_fractions(self.current_plan)
+                    path_t = time_plan(self.current_plan, v_limit, PROFILE_LIMIT_FRACTION*W_MAX, A_MAX, V_DES)
+                    path_x = [state[0] for state in self.current_plan]
+                    path_y = [state[1] for state in self.current_plan]
 
                     # interpolate the path with cubic spline
-                    self.path_x_spline = scipy.interpolate.splrep(path_t, path_x, k=3, s=SMOOTH)
-                    self.path_y_spline = scipy.interpolate.splrep(path_t, path_y, k=3, s=SMOOTH)
-                    self.path_tf = path_t[-1]
+                    path_x_spline = scipy.interpolate.splrep(path_t, path_x, k=3, s=SMOOTH)
+                    path_y_spline = scipy.interpolate.splrep(path_t, path_y, k=3, s=SMOOTH)
+
+                    # swap in the new plan for the control thread
+                    table, table_step = tabulate_splines(path_x_spline, path_y_spline, path_t[-1], TRACK_TABLE_STEP)
+                    self.tracked_plan = TrackedPlan(self.current_plan, self.current_plan_start_time,
+                                                    table, table_step, path_t[-1])
 
                     # to inspect the interpolation and smoothing
                     # t_test = np.linspace(path_t[0],path_t[-1],1000)
                     # plt.plot(path_t,path_x,'ro')
-                    # plt.plot(t_test,scipy.interpolate.splev(t_test,self.path_x_spline,der=0))
+                    # plt.plot(t_test,scipy.interpolate.splev(t_test,path_x_spline,der=0))
                     # plt.plot(path_t,path_y,'bo')
-                    # plt.plot(t_test,scipy.interpolate.splev(t_test,self.path_y_spline,der=0))
+                    # plt.plot(t_test,scipy.interpolate.splev(t_test,path_y_spline,der=0))
                     # plt.show()
                 else:
                     rospy.logwarn("Navigator: Path too short, not updating")
+            elif getattr(problem, 'timed_out', False):
+                rospy.logwarn("Navigator: No path found before the planning deadline, resuming next cycle")
+                self.clear_plan()
             else:
                 rospy.logwarn("Navigator: Could not find path")
-                self.current_plan = []
+                self.clear_plan()
+
+    def run_controller(self):
+        """ sends the velocity command tracking the latest plan, or hands over to the pose controller close to the goal """
+
+        # makes sure we have a location
+        pose = self.update_pose()
+        if pose is None:
+            return
+        x, y, theta = pose
+
+        # if close to the goal, use the pose_controller instead
+        if self.close_to_end_location(x, y):
+            pose_g_msg = Pose2D()
+            pose_g_msg.x = self.x_g
+            pose_g_msg.y = self.y_g
+            pose_g_msg.theta = self.theta_g
+            self.nav_pose_pub.publish(pose_g_msg)
+            self.V_prev = 0
+            return
+
+        # read the plan once, the planner thread may replace it at any time
+        tracked_plan = self.tracked_plan
+        plan = tracked_plan.plan if tracked_plan is not None else []
 
         # if we have a path, execute it (we need at least 3 points for this controller)
-        if len(self.current_plan) > 3:
+        if len(plan) > 3:
 
             # if currently not moving, first line up with the plan
             if self.V_prev == 0:
-                theta_init = np.arctan2(self.current_plan[1][1]-self.current_plan[0][1],self.current_plan[1][0]-self.current_plan[0][0])
-                theta_err = theta_init-self.theta
+                theta_init = np.arctan2(plan[1][1]-plan[0][1],plan[1][0]-plan[0][0])
+                theta_err = theta_init-theta
                 if abs(theta_err)>THETA_START_THRESH:
                     cmd_msg = Twist()
                     cmd_msg.linear.x = 0
@@ -279,16 +670,11 @@ class Navigator:
                     return
 
             # compute the "current" time along the path execution
-            t = (rospy.get_rostime()-self.current_plan_start_time).to_sec()
+            t = (rospy.get_rostime()-tracked_plan.start_time).to_sec()
             t = max(0.0, t)
-            t = min(t, self.path_tf)
+            t = min(t, tracked_plan.tf)
 
-            x_d = scipy.interpolate.splev(t, self.path_x_spline, der=0)
-            y_d = scipy.interpolate.splev(t, self.path_y_spline, der=0)
-            xd_d = scipy.interpolate.splev(t, self.path_x_spline, der=1)
-            yd_d = scipy.interpolate.splev(t, self.path_y_spline, der=1)
-            xdd_d = scipy.interpolate.splev(t, self.path_x_spline, der=2)
-            ydd_d = scipy.interpolate.splev(t, self.path_y_spline, der=2)
+            x_d, y_d, xd_d, yd_d, xdd_d, ydd_d = desired_state(tracked_plan.table, tracked_plan.table_step, t)
 
             # publish current desired x and y for visualization only
             pathsp_msg = PoseStamped()
@@ -308,27 +694,27 @@ class Navigator:
 
             dt = (rospy.get_rostime()-self.V_prev_t).to_sec()
 
-            xd = self.V_prev*np.cos(self.theta)
-            yd = self.V_prev*np.sin(self.theta)
+            xd = self.V_prev*np.cos(theta)
+            yd = self.V_prev*np.sin(theta)
 
-            u = np.array([xdd_d + KPX*(x_d-self.x) + KDX*(xd_d-xd),
-                          ydd_d + KPY*(y_d-self.y) + KDY*(yd_d-yd)])
-            J = np.array([[np.cos(self.theta), -self.V_prev*np.sin(self.theta)],
-                          [np.sin(self.theta), self.V_prev*np.cos(self.theta)]])
+            u = np.array([xdd_d + KPX*(x_d-x) + KDX*(xd_d-xd),
+                          ydd_d + KPY*(y_d-y) + KDY*(yd_d-yd)])
+            J = np.array([[np.cos(theta), -self.V_prev*np.sin(theta)],
+                          [np.sin(theta), self.V_prev*np.cos(theta)]])
             a, om = linalg.solve(J, u)
             V = self.V_prev + a*dt
 
             # apply saturation limits
             cmd_x_dot = np.sign(V)*min(V_MAX, np.abs(V))
             cmd_theta_dot = np.sign(om)*min(W_MAX, np.abs(om))
-        elif len(self.current_plan) > 0:
+        elif len(plan) > 0:
             # using the pose controller for paths too short
             # just send the next point
             pose_g_msg = Pose2D()
-            pose_g_msg.x = self.current_plan[0][0]
-            pose_g_msg.y = self.current_plan[0][1]
-            if len(self.current_plan)>1:
-                pose_g_msg.theta = np.arctan2(self.current_plan[1][1]-self.current_plan[0][1],self.current_plan[1][0]-self.current_plan[0][0])
+            pose_g_msg.x = plan[0][0]
+            pose_g_msg.y = plan[0][1]
+            if len(plan)>1:
+                pose_g_msg.theta = np.arctan2(plan[1][1]-plan[0][1],plan[1][0]-plan[0][0])
             else:
                 pose_g_msg.theta = self.theta_g
             self.nav_pose_pub.publish(pose_g_msg)
@@ -349,5 +735,7 @@ class Navigator:
 
 
 if __name__ == '__main__':
+    # the path search workers are forked before rospy starts any thread
+    traveling_salesman.start_path_pool()
     nav = Navigator()
     rospy.spin()
@@ -0,0 +1,79 @@
+import numpy as np
+from theta_star import supercover_line
+
+# Removes the points of a path that lie on a straight line between their
+# neighbors, e.g. the intermediate cells of straight and diagonal A* runs
+# INPUT: (path)
+#          path - list of tuple states
+# OUTPUT: A list of tuples, the corners of the path, with its first and last state
+def remove_collinear(path):
+    if len(path) < 3:
+        return list(path)
+    points = np.array(path, dtype=float)
+    steps = np.diff(points, axis=0)
+    cross = steps[:-1,0]*steps[1:,1] - steps[:-1,1]*steps[1:,0]
+    dot = np.sum(steps[:-1]*steps[1:], axis=1)
+    scale = np.linalg.norm(steps[:-1], axis=1)*np.linalg.norm(steps[1:], axis=1)
+    corners = np.flatnonzero((np.abs(cross) > 1e-9*scale) | (dot <= 0)) + 1
+    return [path[0]] + [path[k] for k in corners] + [path[-1]]
+
+# Checks that the straight segment between two states only passes through
+# free states of the discrete state grid
+# INPUT: (x1, x2, occupancy, resolution, exempt)
+#          x1, x2 - tuple states on the discrete state grid
+#          occupancy - occupancy grid
+#          resolution - resolution of the discrete state grid
+#          exempt - set of integer grid coordinates (i, j) that are always free, e.g. the endpoints of the plan
+# OUTPUT: Boolean True/False
+def segment_is_free(x1, x2, occupancy, resolution, exempt=()):
+    i, j = supercover_line(int(round(x1[0]/resolution)), int(round(x1[1]/resolution)),
+                           int(round(x2[0]/resolution)), int(round(x2[1]/resolution)))
+    keep = np.ones(len(i), dtype=bool)
+    for cell in exempt:
+        keep &= (i != cell[0]) | (j != cell[1])
+    xs = resolution*i[keep]
+    ys = resolution*j[keep]
+    if hasattr(occupancy, 'is_free_states'):
+        return bool(np.all(occupancy.is_free_states(xs, ys)))
+    return all(occupancy.is_free((x, y)) for x, y in zip(xs, ys))
+
+# Shortens a planned path by replacing runs of waypoints with straight segments
+# that stay in free space. Collinear points are removed first, then each
+# remaining waypoint is connected to the furthest next one it has a free
+# segment to. Consecutive waypoints are kept connected as planned. The
+# endpoints of the path are treated as free, like in AStar.
+# INPUT: (path, occupancy, resolution)
+#          path - list of tuple states on the discrete state grid
+#          occupancy - occupancy grid
+#          resolution - resolution of the discrete state grid
+# OUTPUT: A list of tuples, the waypoints of the shortened path
+def shortcut_path(path, occupancy, resolution):
+    corners = remove_collinear(path)
+    exempt = set((int(round(x[0]/resolution)), int(round(x[1]/resolution))) for x in (path[0], path[-1]))
+    waypoints = [corners[0]]
+    k = 0
+    while k < len(corners) - 1:
+        last = k + 1
+        while last + 1 < len(corners) and segment_is_free(corners[k], corners[last + 1], occupancy, resolution, exempt):
+            last += 1
+        waypoints.append(corners[last])
+        k = last
+    return waypoints
+
+# Finds the cells of the discrete state grid a path passes through: the cells
+# of its states, and the supercover of its segments longer than a grid step
+# (grid steps are checked like in AStar, through their endpoints only)
+# INPUT: (path, resolution)
+#          path - list of tuple states on the discrete state grid
+#          resolution - resolution of the discrete state grid
+# OUTPUT: (i, j), integer numpy arrays of the grid coordinates of the cells, with repetitions
+def path_cells(path, resolution):
+    cells = np.round(np.array(path, dtype=float)/resolution).astype(int).reshape(-1, 2)
+    i = [cells[:,0]]
+    j = [cells[:,1]]
+    steps = np.abs(np.diff(cells, axis=0)).max(axis=1) if len(cells) > 1 else []
+    for k in np.flatnonzero(np.asarray(steps) > 1):
+        segment_i, segment_j = supercover_line(cells[k,0], cells[k,1], cells[k+1,0], cells[k+1,1])
+        i.append(segment_i)
+        j.append(segment_j)
+    return np.concatenate(i), np.concatenate(j)
@@ -0,0 +1,162 @@
+import numpy as np
+import scipy.interpolate
+from path_smoothing import path_cells
+from utils import wrapToPi
+
+# Plan post-processing and tracking computations of the navigator, kept free
+# of ROS so they can be checked on their own
+
+# Inserts evenly spaced points along the straight segments of a plan, e.g.
+# the waypoints of a shortcut or any-angle path, so a cubic spline through
+# them follows the segments. There are at least 4 points in total for the spline
+# INPUT: (path, spacing)
+#          path - list of tuple states
+#          spacing - largest distance between two consecutive points (m)
+# OUTPUT: A list of tuples, the points of the plan, with the states of path among them
+def densify_plan(path, spacing):
+    min_steps = int(np.ceil(3.0/(len(path)-1))) if len(path) > 1 else 0
+    plan = [path[0]]
+    for i in range(len(path)-1):
+        start = np.array(path[i])
+        end = np.array(path[i+1])
+        steps = max(min_steps, int(np.ceil(np.linalg.norm(end-start)/spacing)))
+        for k in range(1, steps+1):
+            plan.append(tuple(start + (end-start)*float(k)/steps))
+    plan[-1] = path[-1]
+    return plan
+
+# Samples the position, velocity and acceleration of the splines of a plan at
+# evenly spaced times from 0 to tf, at most step apart
+# INPUT: (x_spline, y_spline, tf, step)
+#          x_spline, y_spline - splrep representations of x(t) and y(t)
+#          tf - duration of the plan (s)
+#          step - largest time between two samples (s)
+# OUTPUT: (table, table_step), a numpy array with a row (x, y, xd, yd, xdd, ydd)
+#         per sample, and the exact time between two samples
+def tabulate_splines(x_spline, y_spline, tf, step):
+    n = max(2, int(np.ceil(tf/step)) + 1)
+    t = np.linspace(0.0, tf, n)
+    table = np.empty((n, 6))
+    for der in range(3):
+        table[:,2*der] = scipy.interpolate.splev(t, x_spline, der=der)
+        table[:,2*der+1] = scipy.interpolate.splev(t, y_spline, der=der)
+    return table, tf/(n-1)
+
+# Interpolates the desired state of a plan linearly between the samples of its table
+# INPUT: (table, table_step, t)
+#          table, table_step - as returned by tabulate_splines
+#          t - time along the plan, in [0, tf] (s)
+# OUTPUT: A tuple (x, y, xd, yd, xdd, ydd)
+def desired_state(table, table_step, t):
+    s = t/table_step if table_step > 0 else 0.0
+    k = min(int(s), len(table)-2)
+    frac = s - k
+    return tuple(table[k]*(1.0-frac) + table[k+1]*frac)
+
+# Finds the segment of a polyline closest to a point
+# INPUT: (points, x, y)
+#          points - list of tuple points of the polyline
+#          x, y - coordinates of the point
+# OUTPUT: (k, closest, distance), the index of the segment, its point closest
+#         to (x, y) as a tuple and the distance to it
+def nearest_segment(points, x, y):
+    points = np.array(points, dtype=float)
+    if len(points) < 2:
+        return 0, tuple(points[0]), np.hypot(points[0,0]-x, points[0,1]-y)
+    starts = points[:-1]
+    steps = np.diff(points, axis=0)
+    lengths2 = np.maximum(np.sum(steps**2, axis=1), 1e-12)
+    s = np.clip(((x-starts[:,0])*steps[:,0] + (y-starts[:,1])*steps[:,1])/lengths2, 0.0, 1.0)
+    closest = starts + s[:,np.newaxis]*steps
+    distances = np.hypot(closest[:,0] - x, closest[:,1] - y)
+    k = np.argmin(distances)
+    return k, tuple(closest[k]), distances[k]
+
+# Drops the part of a plan a robot at (x, y) has already driven
+# INPUT: (points, x, y)
+#          points - list of tuple points of the plan
+#          x, y - coordinates of the robot
+# OUTPUT: A list of tuples, the rest of the plan, starting at its point closest to the robot
+def trim_plan(points, x, y):
+    k, closest, _ = nearest_segment(points, x, y)
+    rest = list(points[k+1:])
+    return rest if np.allclose(closest, rest[0]) else [closest] + rest
+
+# Checks if a cell a plan passes through became occupied. The endpoints of
+# the plan are always free for the planners, and never block it
+# INPUT: (waypoints, plan_free, free, grid_lo, resolution)
+#          waypoints - list of tuple states of the plan, on the discrete state grid
+#          plan_free, free - boolean numpy arrays, the free states (indexed [j,i])
+#                            the plan was checked against and the current ones
+#          grid_lo - integer grid coordinates (i, j) of free[0,0]
+#          resolution - resolution of the discrete state grid
+# OUTPUT: Boolean True/False
+def plan_blocked(waypoints, plan_free, free, grid_lo, resolution):
+    n_j, n_i = free.shape
+    i, j = path_cells(waypoints, resolution)
+    i = i - grid_lo[0]
+    j = j - grid_lo[1]
+    inside = (i >= 0) & (j >= 0) & (i < n_i) & (j < n_j)
+    blocked = np.zeros(len(i), dtype=bool)
+    blocked[inside] = plan_free[j[inside],i[inside]] & ~free[j[inside],i[inside]]
+    endpoints = path_cells([waypoints[0], waypoints[-1]], resolution)
+    for end_i, end_j in zip(*endpoints):
+        blocked &= (i != end_i - grid_lo[0]) | (j != end_j - grid_lo[1])
+    return bool(blocked.any())
+
+# Checks if the states that became free may open a route to the goal shorter
+# than ratio times the rest of a plan. A route through a freed state is at
+# least as long as the straight lines through it
+# INPUT: (plan, plan_free, free, grid_lo, resolution, x_goal, x, y, ratio)
+#          plan - list of tuple points of the plan
+#          plan_free, free, grid_lo, resolution - as in plan_blocked
+#          x_goal - tuple goal state
+#          x, y - coordinates of the robot
+#          ratio - fraction of the rest of the plan a new route has to beat
+# OUTPUT: Boolean True/False
+def shorter_route_possible(plan, plan_free, free, grid_lo, resolution, x_goal, x, y, ratio):
+    freed_j, freed_i = np.nonzero(free & ~plan_free)
+    if len(freed_i) == 0:
+        return False
+    plan = np.array(plan, dtype=float)
+    position = np.array([x, y])
+    k = np.argmin(np.linalg.norm(plan - position, axis=1))
+    remaining = np.linalg.norm(plan[k] - position) + np.sum(np.linalg.norm(np.diff(plan[k:], axis=0), axis=1))
+    freed_x = resolution*(grid_lo[0] + freed_i)
+    freed_y = resolution*(grid_lo[1] + freed_j)
+    shortest = np.min(np.hypot(freed_x - x, freed_y - y) + np.hypot(freed_x - x_goal[0], freed_y - x_goal[1]))
+    return shortest < ratio*remaining
+
+# Times a plan with a speed profile limited by v_limit at its points, by
+# w_limit in its turns and by a_max, with constant acceleration along each
+# segment. The curvature at an inner point is its turning angle over the
+# length of its shorter segment. The acceleration limits on the squared
+# speeds u, u[i+1] <= u[i] + 2*a_max*length[i] forward and
+# u[i] <= u[i+1] + 2*a_max*length[i] backward, are solved in closed form:
+# u[i] = min over k <= i of u_limit[k] + S[i] - S[k] forward, and likewise backward
+# INPUT: (plan, v_limit, w_limit, a_max, v_end)
+#          plan - list of tuple points, at least 2
+#          v_limit - numpy array, the speed limit at each point (m/s)
+#          w_limit - angular speed limit (rad/s)
+#          a_max - acceleration limit (m/s^2)
+#          v_end - speed limit at the first and last points (m/s)
+# OUTPUT: A numpy array, the times at which the points are reached, from 0
+def time_plan(plan, v_limit, w_limit, a_max, v_end):
+    points = np.array(plan, dtype=float)
+    steps = np.diff(points, axis=0)
+    lengths = np.hypot(steps[:,0], steps[:,1])
+
+    v_limit = np.array(v_limit, dtype=float)
+    turns = np.abs(wrapToPi(np.diff(np.arctan2(steps[:,1], steps[:,0]))))
+    curvature = turns/np.maximum(np.minimum(lengths[:-1], lengths[1:]), 1e-9)
+    v_limit[1:-1] = np.minimum(v_limit[1:-1], w_limit/np.maximum(curvature, 1e-9))
+    v_limit[0] = min(v_limit[0], v_end)
+    v_limit[-1] = min(v_limit[-1], v_end)
+
+    s = np.concatenate(([0.0], np.cumsum(2*a_max*lengths)))
+    u = v_limit**2
+    u = s + np.minimum.accumulate(u - s)
+    u = np.minimum.accumulate((u + s)[::-1])[::-1] - s
+    v = np.sqrt(u)
+
+    return np.concatenate(([0.0], np.cumsum(2*lengths/(v[:-1] + v[1:]))))
@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+
+# Headless benchmark of the planners and TSP solvers, no ROS needed. Runs every
+# solver on seeded random DetOccupancyGrid2D worlds and on the saved SLAM maps,
+# and writes nodes expanded, expansions per second, wall time percentiles,
+# memory peak and path length of each (world, solver) case to a JSON file so
+# runs can be compared, e.g.
+#   python planner_benchmark.py --output before.json
+#   python planner_benchmark.py --output after.json --planners grid_astar dstar_lite
+
+import argparse
+import collections
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import numpy as np
+from astar import AStar, BidirectionalAStar, GridAStar, JumpPointSearch, DetOccupancyGrid2D
+from dstar_lite import DStarLite
+from hpa_star import HPAStar
+from ara_star import AnytimeRepairingAStar
+from theta_star import ThetaStar
+from grids import StochOccupancyGrid2D
+import traveling_salesman
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# random worlds, like the large random example of astar.py
+RANDOM_WORLDS = 3
+RANDOM_WORLD_SIZE = 101
+RANDOM_NUM_OBS = 15
+RANDOM_MIN_SIZE = 5
+RANDOM_MAX_SIZE = 25
+
+# SLAM maps loaded as StochOccupancyGrid2D: (name, image, resolution, origin),
+# as in their .yaml files. slam_map.yaml points at slam_map1.pgm, the map
+# saved as slam_map.pgm is used here
+SLAM_MAPS = [('slam_map', 'slam_map.pgm', 0.05, (0.0, 0.0)),
+             ('slam_map_sim', 'slam_map_sim.pgm', 0.05, (-10.0, -10.0))]
+SLAM_OCCUPIED_THRESH = 0.65
+SLAM_FREE_THRESH = 0.196
+SLAM_WINDOW_SIZE = 8            # window of the navigator's StochOccupancyGrid2D
+SLAM_PLAN_RESOLUTION = 0.1      # plan_resolution of the navigator
+
+# planning queries per world, and TSP problems per world with their number of goals
+NUM_QUERIES = 5
+NUM_TSP_PROBLEMS = 2
+NUM_TSP_GOALS = 6
+
+# planners, constructed as planner(statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution).
+# Only solve() is timed, precomputation in the constructor (e.g. the HPAStar
+# cluster graph, shared between plans by the navigator) is not
+PLANNERS = collections.OrderedDict([
+    ('astar', AStar),
+    ('bidirectional', BidirectionalAStar),
+    ('grid_astar', GridAStar),
+    ('jps', JumpPointSearch),
+    ('dstar_lite', DStarLite),
+    ('hpa', HPAStar),
+    ('ara', AnytimeRepairingAStar),
+    ('theta', ThetaStar),
+])
+
+# TSP solvers, called as solver(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution)
+# and returning a circuit of goal indices
+TSP_SOLVERS = collections.OrderedDict([
+    ('tsp_fast', traveling_salesman.traveling_salesman_fast),
+    ('tsp_improved', traveling_salesman.traveling_salesman_improved),
+    ('tsp_exact', traveling_salesman.traveling_salesman_exact),
+])
+
+# A benchmark world: an occupancy grid, its planning state space and the
+# states that are free in it, used to draw random queries
+World = collections.namedtuple('World', ['name', 'occupancy', 'statespace_lo', 'statespace_hi', 'resolution', 'free_states'])
+
+# Generates a random world of rectangular obstacles
+# INPUT: (name, rng)
+#          name - world name
+#          rng - numpy RandomState
+# OUTPUT: A World
+def random_world(name, rng):
+    width = height = RANDOM_WORLD_SIZE
+    obs_corners_x = rng.randint(0, width, RANDOM_NUM_OBS)
+    obs_corners_y = rng.randint(0, height, RANDOM_NUM_OBS)
+    obs_lower_corners = np.vstack([obs_corners_x, obs_corners_y]).T
+    obs_sizes = rng.randint(RANDOM_MIN_SIZE, RANDOM_MAX_SIZE, (RANDOM_NUM_OBS, 2))
+    obs_upper_corners = obs_lower_corners + obs_sizes
+    obstacles = list(zip(obs_lower_corners.tolist(), obs_upper_corners.tolist()))
+    occupancy = DetOccupancyGrid2D(width, height, obstacles)
+    free_states = [(x, y) for x in range(width) for y in range(height) if occupancy.is_free((x, y))]
+    return World(name, occupancy, (0, 0), (width, height), 1, free_states)
+
+# Reads a binary (P5) PGM image
+# INPUT: (path)
+#          path - image file
+# OUTPUT: A uint8 numpy array of shape (height, width), first row at the top of the image
+def read_pgm(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    fields = []
+    i = 0
+    while len(fields) < 4:
+        while data[i:i+1].isspace():
+            i += 1
+        if data[i:i+1] == b'#':
+            while data[i:i+1] != b'\n':
+                i += 1
+            continue
+        j = i
+        while not data[j:j+1].isspace():
+            j += 1
+        fields.append(data[i:j])
+        i = j
+    if fields[0] != b'P5' or int(fields[3]) > 255:
+        raise ValueError('{} is not an 8 bit binary PGM image'.format(path))
+    width, height = int(fields[1]), int(fields[2])
+    return np.frombuffer(data[i+1:i+1+width*height], dtype=np.uint8).reshape(height, width)
+
+# Loads a SLAM map image as the occupancy grid the navigator would receive from
+# the map server, and the navigator's planning state space over it
+# INPUT: (name, image, resolution, origin)
+#          name - world name
+#          image - PGM file, relative to the package directory
+#          resolution - map resolution (m/cell)
+#          origin - map origin (x, y)
+# OUTPUT: A World
+def slam_world(name, image, resolution, origin):
+    pixels = read_pgm(os.path.join(PACKAGE_DIR, image))[::-1]   # map rows start at the bottom
+    height, width = pixels.shape
+    occupied = (255 - pixels.astype(float))/255.0
+    probs = np.where(occupied > SLAM_OCCUPIED_THRESH, 100, np.where(occupied < SLAM_FREE_THRESH, 0, -1))
+    occupancy = StochOccupancyGrid2D(resolution, width, height, origin[0], origin[1],
+                                     SLAM_WINDOW_SIZE, tuple(probs.ravel().tolist()))
+    statespace_lo = (origin[0], origin[1])
+    statespace_hi = (origin[0] + width*resolution, origin[1] + height*resolution)
+    res = SLAM_PLAN_RESOLUTION
+    xs = res*np.arange(int(math.ceil(statespace_lo[0]/res)), int(math.floor(statespace_hi[0]/res)))
+    ys = res*np.arange(int(math.ceil(statespace_lo[1]/res)), int(math.floor(statespace_hi[1]/res)))
+    grid_x, grid_y = np.meshgrid(xs, ys)
+    free = occupancy.is_free_states(grid_x, grid_y)
+    free_states = list(zip(grid_x[free].tolist(), grid_y[free].tolist()))
+    return World(name, occupancy, statespace_lo, statespace_hi, res, free_states)
+
+# Draws random free states of a world
+def sample_states(world, rng, n):
+    return [world.free_states[k] for k in rng.randint(len(world.free_states), size=n)]
+
+def path_length(path):
+    if not path:
+        return None
+    path = np.array(path, dtype=float)
+    return float(np.sum(np.linalg.norm(np.diff(path, axis=0), axis=1)))
+
+# peak resident set size of the current process, in kB
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak//1024 if sys.platform == 'darwin' else peak
+
+# Summarizes a list of samples, None entries (e.g. no path found) are skipped
+def summarize(samples):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        return None
+    return {'mean': float(np.mean(samples)),
+            'p50': float(np.percentile(samples, 50)),
+            'p90': float(np.percentile(samples, 90)),
+            'p99': float(np.percentile(samples, 99)),
+            'max': float(np.max(samples))}
+
+# Runs a planner on every query of a world
+# INPUT: (world, planner, queries)
+#          world - World
+#          planner - planner class
+#          queries - list of (x_init, x_goal)
+# OUTPUT: A dictionary of the results
+def run_planner(world, planner, queries):
+    times = []
+    expanded = []
+    inserted = []
+    lengths = []
+    found = 0
+    for x_init, x_goal in queries:
+        problem = planner(world.statespace_lo, world.statespace_hi, x_init, x_goal, world.occupancy, world.resolution)
+        start = time.time()
+        solved = problem.solve()
+        times.append(time.time() - start)
+        expanded.append(problem.num_expanded)
+        inserted.append(getattr(problem, 'num_inserted', None))   # only counted by some planners
+        if solved:
+            found += 1
+            lengths.append(path_length(problem.path))
+    return {'runs': len(queries),
+            'found': found,
+            'nodes_expanded': summarize(expanded),
+            'open_set_insertions': summarize(inserted),
+            'expansions_per_s': float(sum(expanded)/sum(times)) if sum(times) > 0 else None,
+            'wall_time_s': summarize(times),
+            'path_length': summarize(lengths)}
+
+# Runs a TSP solver on every problem of a world. Reports the length of the
+# circuits, computed from paths searched outside of the timed solver calls
+# INPUT: (world, solver, problems)
+#          world - World
+#          solver - TSP solver function
+#          problems - list of (x_init, x_goals)
+# OUTPUT: A dictionary of the results
+def run_tsp_solver(world, solver, problems):
+    times = []
+    lengths = []
+    found = 0
+    for x_init, x_goals in problems:
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')   # the solvers log every circuit they find
+        try:
+            start = time.time()
+            circuit = solver(x_init, x_goals, world.statespace_lo, world.statespace_hi, world.occupancy, world.resolution)
+            times.append(time.time() - start)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if circuit is None or len(circuit) != len(x_goals):
+            continue
+        found += 1
+        waypoints = [x_init] + [x_goals[i] for i in circuit]
+        length = 0.0
+        for k in range(len(waypoints) - 1):
+            problem = GridAStar(world.statespace_lo, world.statespace_hi, waypoints[k], waypoints[k+1], world.occupancy, world.resolution)
+            length += path_length(problem.path) if problem.solve() else np.inf
+        lengths.append(length)
+    return {'runs': len(problems),
+            'found': found,
+            'wall_time_s': summarize(times),
+            'path_length': summarize(lengths)}
+
+# Runs one (world, solver) case in a child process, so that the memory peak
+# of each case is measured on its own
+def run_case(run, args):
+    def target(queue):
+        rss_before = peak_rss_kb()
+        result = run(*args)
+        result['peak_rss_kb'] = peak_rss_kb()
+        result['rss_growth_kb'] = result['peak_rss_kb'] - rss_before
+        queue.put(result)
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=(queue,))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless planner and TSP solver benchmark')
+    parser.add_argument('--output', required=True, help='JSON file the results are written to')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--worlds', type=int, default=RANDOM_WORLDS, help='number of random worlds')
+    parser.add_argument('--maps', nargs='*', default=[m[0] for m in SLAM_MAPS], choices=[m[0] for m in SLAM_MAPS])
+    parser.add_argument('--queries', type=int, default=NUM_QUERIES, help='planning queries per world')
+    parser.add_argument('--planners', nargs='*', default=list(PLANNERS), choices=list(PLANNERS))
+    parser.add_argument('--tsp-problems', type=int, default=NUM_TSP_PROBLEMS, help='TSP problems per world')
+    parser.add_argument('--tsp-goals', type=int, default=NUM_TSP_GOALS, help='number of goals of each TSP problem')
+    parser.add_argument('--tsp-solvers', nargs='*', default=list(TSP_SOLVERS), choices=list(TSP_SOLVERS))
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    worlds = [random_world('random_{}'.format(k), rng) for k in range(args.worlds)]
+    for name, image, resolution, origin in SLAM_MAPS:
+        if name in args.maps:
+            worlds.append(slam_world(name, image, resolution, origin))
+
+    results = []
+    for world in worlds:
+        queries = [tuple(sample_states(world, rng, 2)) for _ in range(args.queries)]
+        problems = []
+        for _ in range(args.tsp_problems):
+            states = sample_states(world, rng, args.tsp_goals + 1)
+            problems.append((states[0], states[1:]))
+
+        for name in args.planners:
+            result = run_case(run_planner, (world, PLANNERS[name], queries))
+            result.update({'world': world.name, 'solver': name})
+            results.append(result)
+            if result['wall_time_s'] is not None:
+                print('{:>14} {:>14}: {}/{} found, {:.3f} s median'.format(
+                    world.name, name, result['found'], result['runs'], result['wall_time_s']['p50']))
+        for name in args.tsp_solvers:
+            result = run_case(run_tsp_solver, (world, TSP_SOLVERS[name], problems))
+            result.update({'world': world.name, 'solver': name})
+            results.append(result)
+            if result['wall_time_s'] is not None:
+                print('{:>14} {:>14}: {}/{} found, {:.3f} s median'.format(
+                    world.name, name, result['found'], result['runs'], result['wall_time_s']['p50']))
+
+    report = {'config': vars(args),
+              'environment': {'python': platform.python_version(),
+                              'numpy': np.__version__,
+                              'platform': platform.platform(),
+                              'cpu_count': multiprocessing.cpu_count()},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('Results written to {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ from asl_turtlebot.msg import DetectedObject, TSalesRequest, TSalesCircuit
 import landmarks
 import tf
 import math
+import threading
 from sound_play.msg import SoundRequest
 from sound_play.libsoundplay import SoundClient
 # from asl_turtlebot import finalcount.wav
@@ -114,6 +115,14 @@ class Supervisor:
         # status flag for traveling salesman circuit received
         self.tsales_circuit_received = 1
 
+        # id of the last traveling salesman request, circuits for older ones are ignored
+        self.tsales_request_id = 0
+        # order of the animal waypoints relative to the order they were requested in
+        self.tsales_order = np.zeros(0, dtype=int)
+        # held while the animal waypoints are reordered or popped, the circuit
+        # callback runs on another thread than the main loop
+        self.animal_waypoints_lock = threading.Lock()
+
         # status flag for amcl init received
         self.amcl_init_received = False
 
@@ -338,7 +347,8 @@ class Supervisor:
 
     def pop_animal(self):
         # remove the animal from the rescue queue
-        waypoint, animal_type = self.animal_waypoints.pop()
+        with self.animal_waypoints_lock:
+            waypoint, animal_type = self.animal_waypoints.pop()
         print waypoint, animal_type
 
         if np.any(waypoint == None):
@@ -367,7 +377,10 @@ class Supervisor:
 
         print(self.animal_waypoints.poses)
         print(self.animal_waypoints.observations_count)
-        self.animal_waypoints.cull(ANIMAL_MIN_OBSERVATIONS)
+        with self.animal_waypoints_lock:
+            self.animal_waypoints.cull(ANIMAL_MIN_OBSERVATIONS)
+            self.tsales_order = np.arange(self.animal_waypoints.poses.shape[0])
+            self.tsales_request_id += 1     # circuits of earlier requests are ignored from now on
         print(self.animal_waypoints.poses)
         print(self.animal_waypoints.observations_count)
 
@@ -376,6 +389,7 @@ class Supervisor:
             tsales_request.goal_x = self.animal_waypoints.poses[:,0].tolist()
             tsales_request.goal_y = self.animal_waypoints.poses[:,1].tolist()
             tsales_request.do_fast = 0
+            tsales_request.request_id = self.tsales_request_id
             print('publish tsales request')
             self.tsales_request_publisher.publish(tsales_request) 
         else: 
@@ -383,17 +397,34 @@ class Supervisor:
 
     def tsales_circuit_callback(self, msg): 
         print('tsales circuit callback')
+        # the navigator publishes improving circuits for each request, drop
+        # circuits of older requests and improvements that come after the
+        # rescue has started. The first circuit only orders the goals by
+        # straight line distance (unknown length), the rescue waits for one
+        # planned around the obstacles
+        if msg.request_id != self.tsales_request_id:
+            rospy.loginfo('Ignoring circuit of stale traveling salesman request %d', msg.request_id)
+            return
+        if self.tsales_circuit_received and self.mode not in (Mode.PLAN_RESCUE, Mode.REQUEST_RESCUE):
+            return
+
         try:
             circuit = np.array(map(int, msg.circuit))
         except:
             rospy.loginfo('Traveling salesman failed')
             self.tsales_circuit_received = 1
             return
+        if circuit.shape[0] > 0 and not np.isfinite(msg.length):
+            rospy.loginfo('Waiting for a planned traveling salesman circuit')
+            return
 
-        if circuit.shape[0] == self.animal_waypoints.poses.shape[0]:
-            self.animal_waypoints.reorder(circuit)
-        else:         
-            rospy.loginfo('Traveling salesman failed')
+        with self.animal_waypoints_lock:
+            if circuit.shape[0] > 0 and circuit.shape[0] == self.animal_waypoints.poses.shape[0]:
+                # circuits index the waypoints in the order they were requested in
+                self.animal_waypoints.reorder(np.argsort(self.tsales_order)[circuit])
+                self.tsales_order = circuit
+            else:
+                rospy.loginfo('Traveling salesman failed')
 
         self.tsales_circuit_received = 1
 
@@ -0,0 +1,108 @@
+import numpy as np
+from grids import StochOccupancyGrid2D
+from costmap import ClearanceCostmap
+
+# Checks the precomputed free mask of StochOccupancyGrid2D against the window
+# product of is_free_window, and the incremental map updates (of the grid and
+# of ClearanceCostmap) against grids built from scratch. Run with pytest from
+# this directory.
+
+MAP_WIDTH = 40
+MAP_HEIGHT = 30
+RESOLUTION = 0.05
+# origin off the grid of the planning states, like most SLAM maps
+ORIGIN = (-0.73, 0.41)
+WINDOW_SIZES = [3, 8]
+NUM_UPDATES = 20
+
+# Draws the probabilities of a map: mostly free cells, unknown cells and a few
+# occupied blobs with probabilities around the threshold
+def random_probs(rng):
+    probs = np.zeros((MAP_HEIGHT, MAP_WIDTH), dtype=np.int8)
+    probs[rng.rand(MAP_HEIGHT, MAP_WIDTH) < 0.1] = -1
+    for k in range(12):
+        x, y = rng.randint(0, MAP_WIDTH), rng.randint(0, MAP_HEIGHT)
+        probs[y:y+rng.randint(1, 5),x:x+rng.randint(1, 5)] = rng.randint(5, 101)
+    return probs.ravel()
+
+def build_grid(probs, window_size):
+    return StochOccupancyGrid2D(RESOLUTION, MAP_WIDTH, MAP_HEIGHT, ORIGIN[0], ORIGIN[1], window_size, probs)
+
+# snapped planning states covering the map and a margin around it, and the
+# states halfway between them
+def query_states():
+    lo = np.array(ORIGIN) - 6*RESOLUTION
+    hi = np.array(ORIGIN) + RESOLUTION*np.array([MAP_WIDTH + 6, MAP_HEIGHT + 6])
+    ks = [np.arange(int(np.floor(lo[d]/RESOLUTION)), int(np.ceil(hi[d]/RESOLUTION))) for d in range(2)]
+    states = [(RESOLUTION*kx, RESOLUTION*ky) for kx in ks[0] for ky in ks[1]]
+    states += [(RESOLUTION*(kx + 0.5), RESOLUTION*ky) for kx in ks[0][::3] for ky in ks[1][::3]]
+    return states
+
+def test_is_free_matches_window():
+    rng = np.random.RandomState(0)
+    states = query_states()
+    xs = np.array([x[0] for x in states])
+    ys = np.array([x[1] for x in states])
+    for window_size in WINDOW_SIZES:
+        grid = build_grid(random_probs(rng), window_size)
+        expected = np.array([grid.is_free_window(x) for x in states])
+        assert np.array_equal(np.array([grid.is_free(x) for x in states]), expected)
+        assert np.array_equal(grid.is_free_states(xs, ys), expected)
+
+# checks that a grid updated in place has the same cells and free mask as one built from its probabilities
+def assert_same_grid(grid, window_size):
+    rebuilt = build_grid(grid.probs.copy(), window_size)
+    assert np.array_equal(grid.probs, rebuilt.probs)
+    assert grid.mask_lo == rebuilt.mask_lo
+    assert np.array_equal(grid.free_mask, rebuilt.free_mask)
+
+def test_updated_matches_rebuild():
+    rng = np.random.RandomState(1)
+    for window_size in WINDOW_SIZES:
+        grid = build_grid(random_probs(rng), window_size)
+        for k in range(NUM_UPDATES):
+            # rectangles may stick out of the map, like the updates of a growing map
+            width, height = rng.randint(1, 12, size=2)
+            x, y = rng.randint(-4, MAP_WIDTH, size=1)[0], rng.randint(-4, MAP_HEIGHT, size=1)[0]
+            data = rng.choice([-1, 0, 0, 0, 40, 60, 100], size=width*height)
+            grid = grid.updated(x, y, width, height, data)
+            assert_same_grid(grid, window_size)
+
+def test_updated_leaves_grid_unchanged():
+    rng = np.random.RandomState(2)
+    grid = build_grid(random_probs(rng), WINDOW_SIZES[0])
+    probs = grid.probs.copy()
+    free_mask = grid.free_mask.copy()
+    grid.updated(0, 0, MAP_WIDTH, MAP_HEIGHT, np.full(MAP_WIDTH*MAP_HEIGHT, 100))
+    assert np.array_equal(grid.probs, probs)
+    assert np.array_equal(grid.free_mask, free_mask)
+
+def test_replaced_matches_rebuild():
+    rng = np.random.RandomState(3)
+    for window_size in WINDOW_SIZES:
+        grid = build_grid(random_probs(rng), window_size)
+        assert grid.replaced(grid.probs.copy()) is grid
+        for k in range(NUM_UPDATES//2):
+            probs = grid.probs.copy().reshape(MAP_HEIGHT, MAP_WIDTH)
+            x, y = rng.randint(0, MAP_WIDTH), rng.randint(0, MAP_HEIGHT)
+            probs[y:y+rng.randint(1, 8),x:x+rng.randint(1, 8)] = rng.choice([-1, 0, 55, 100])
+            grid = grid.replaced(probs.ravel())
+            assert_same_grid(grid, window_size)
+
+def test_costmap_update_matches_rebuild():
+    rng = np.random.RandomState(4)
+    window_size = WINDOW_SIZES[0]
+    statespace_lo = (-1.0, 0.0)
+    statespace_hi = (1.5, 2.0)
+    plan_resolution = 0.1
+    grid = build_grid(random_probs(rng), window_size)
+    costmap = ClearanceCostmap(statespace_lo, statespace_hi, grid, plan_resolution)
+    for k in range(NUM_UPDATES):
+        width, height = rng.randint(1, 8, size=2)
+        x, y = rng.randint(0, MAP_WIDTH), rng.randint(0, MAP_HEIGHT)
+        grid = grid.updated(x, y, width, height, rng.choice([0, 100], size=width*height))
+        costmap.update_occupancy(grid)
+        rebuilt = ClearanceCostmap(statespace_lo, statespace_hi, grid, plan_resolution)
+        assert np.array_equal(costmap.free, rebuilt.free)
+        assert np.allclose(costmap.clearance, rebuilt.clearance)
+        assert np.allclose(costmap.costs, rebuilt.costs)
@@ -0,0 +1,198 @@
+import math
+import numpy as np
+import scipy.interpolate
+import plan_tracking
+from astar import GridAStar, DetOccupancyGrid2D
+from path_smoothing import shortcut_path, segment_is_free
+from connectivity import ConnectivityIndex
+
+# Checks the plan post-processing and tracking functions of the navigator on
+# small worlds and hand-made plans. Run with pytest from this directory.
+
+WORLD_SIZE = 24
+NUM_WORLDS = 10
+NUM_OBSTACLES = 14
+RESOLUTION = 1
+KNOT_SPACING = 0.5
+TABLE_STEP = 0.01
+# fraction of the rest of a plan a new route has to beat to replan (SHORTER_ROUTE_RATIO)
+SHORTER_ROUTE_RATIO = 0.8
+# a wall the plans of WALL_START to WALL_GOAL go around, and a blob out of their way
+WALL = ((10, 0), (11, 16))
+BLOB = ((20, 20), (22, 22))
+WALL_START = (2.0, 2.0)
+WALL_GOAL = (20.0, 2.0)
+# limits of the speed profiles
+V_LIMIT = 0.16
+W_LIMIT = 0.32
+A_LIMIT = 0.2
+V_END = 0.12
+# largest error of the linear interpolation of the tables, relative to the largest value
+TABLE_TOLERANCE = 1e-3
+
+def random_world(rng):
+    obstacles = []
+    for k in range(NUM_OBSTACLES):
+        x, y = rng.randint(0, WORLD_SIZE - 2, size=2)
+        w, h = rng.randint(1, WORLD_SIZE//4, size=2)
+        obstacles.append(((x, y), (x + w, y + h)))
+    return DetOccupancyGrid2D(WORLD_SIZE, WORLD_SIZE, obstacles)
+
+def random_free_state(rng, occupancy):
+    while True:
+        x = tuple(float(v) for v in rng.randint(0, WORLD_SIZE, size=2))
+        if occupancy.is_free(x):
+            return x
+
+def path_length(path):
+    return sum(math.hypot(x2[0] - x1[0], x2[1] - x1[1]) for x1, x2 in zip(path[:-1], path[1:]))
+
+# GridAStar paths on random worlds, with the world they were planned in
+def random_paths(seed):
+    rng = np.random.RandomState(seed)
+    for w in range(NUM_WORLDS):
+        occupancy = random_world(rng)
+        x_init = random_free_state(rng, occupancy)
+        x_goal = random_free_state(rng, occupancy)
+        astar = GridAStar((0, 0), (WORLD_SIZE, WORLD_SIZE), x_init, x_goal, occupancy, RESOLUTION)
+        if astar.solve() and len(astar.path) > 1:
+            yield astar.path, occupancy
+
+# checks that the states of a path between two of its states lie on the segment between them
+def is_straight_run(path, x1, x2):
+    run = np.array(path[path.index(x1):path.index(x2)+1], dtype=float)
+    cross = (run[:,0] - x1[0])*(x2[1] - x1[1]) - (run[:,1] - x1[1])*(x2[0] - x1[0])
+    return len(run) > 1 and np.all(np.abs(cross) < 1e-9)
+
+def test_shortcut_path():
+    # shortcuts keep the endpoints, replace runs of the path by free segments
+    # (straight runs of the path are kept as planned) and never lengthen it
+    for path, occupancy in random_paths(0):
+        waypoints = shortcut_path(path, occupancy, RESOLUTION)
+        assert waypoints[0] == path[0] and waypoints[-1] == path[-1]
+        assert all(x in path for x in waypoints)
+        exempt = set((int(x[0]), int(x[1])) for x in (path[0], path[-1]))
+        for x1, x2 in zip(waypoints[:-1], waypoints[1:]):
+            assert is_straight_run(path, x1, x2) or segment_is_free(x1, x2, occupancy, RESOLUTION, exempt)
+        assert path_length(waypoints) <= path_length(path) + 1e-9
+
+def test_densify_plan():
+    # knots at most KNOT_SPACING apart along the same segments, through every waypoint
+    for path, occupancy in random_paths(1):
+        waypoints = shortcut_path(path, occupancy, RESOLUTION)
+        plan = plan_tracking.densify_plan(waypoints, KNOT_SPACING)
+        assert len(plan) >= 4
+        assert plan[0] == waypoints[0] and plan[-1] == waypoints[-1]
+        steps = np.diff(np.array(plan), axis=0)
+        assert np.all(np.hypot(steps[:,0], steps[:,1]) <= KNOT_SPACING + 1e-9)
+        assert abs(path_length(plan) - path_length(waypoints)) < 1e-9
+        points = np.array(plan)
+        for x in waypoints:
+            assert np.min(np.hypot(points[:,0] - x[0], points[:,1] - x[1])) < 1e-9
+
+# cubic splines through the knots of a plan, timed at a constant speed
+def plan_splines(plan, speed=0.12):
+    points = np.array(plan, dtype=float)
+    t = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T)/speed)))
+    x_spline = scipy.interpolate.splrep(t, points[:,0], k=3, s=0.01)
+    y_spline = scipy.interpolate.splrep(t, points[:,1], k=3, s=0.01)
+    return x_spline, y_spline, t[-1]
+
+def test_desired_state_matches_splines():
+    rng = np.random.RandomState(2)
+    for path, occupancy in random_paths(3):
+        plan = plan_tracking.densify_plan(shortcut_path(path, occupancy, RESOLUTION), KNOT_SPACING)
+        x_spline, y_spline, tf = plan_splines(plan)
+        table, table_step = plan_tracking.tabulate_splines(x_spline, y_spline, tf, TABLE_STEP)
+        assert table_step <= TABLE_STEP and abs(table_step*(len(table) - 1) - tf) < 1e-9
+        for t in np.concatenate(([0.0, tf], rng.uniform(0, tf, size=50))):
+            expected = [scipy.interpolate.splev(t, spline, der=der) for der in range(3) for spline in (x_spline, y_spline)]
+            state = plan_tracking.desired_state(table, table_step, t)
+            scale = np.max(np.abs(table), axis=0)
+            assert np.all(np.abs(np.array(state) - expected) <= TABLE_TOLERANCE*np.maximum(scale, 1.0))
+
+def test_trim_plan():
+    plan = [(0.0, 0.0), (1.0, 0.0), (2.0, 0.0), (2.0, 1.0)]
+    # between two points, the plan starts at the projection of the robot
+    assert np.allclose(plan_tracking.trim_plan(plan, 1.5, 0.1), [(1.5, 0.0), (2.0, 0.0), (2.0, 1.0)])
+    # on a point, it is not repeated
+    assert np.allclose(plan_tracking.trim_plan(plan, 1.0, -0.1), [(1.0, 0.0), (2.0, 0.0), (2.0, 1.0)])
+    # past the end of the plan, only its last point is left
+    assert np.allclose(plan_tracking.trim_plan(plan, 2.5, 2.0), [(2.0, 1.0)])
+    k, closest, distance = plan_tracking.nearest_segment(plan, 2.2, 0.5)
+    assert k == 2 and np.allclose(closest, (2.0, 0.5)) and abs(distance - 0.2) < 1e-9
+
+# plans from WALL_START to WALL_GOAL around WALL, with the free states they were checked against
+def wall_plan():
+    occupancy = DetOccupancyGrid2D(WORLD_SIZE, WORLD_SIZE, [WALL, BLOB])
+    astar = GridAStar((0, 0), (WORLD_SIZE, WORLD_SIZE), WALL_START, WALL_GOAL, occupancy, RESOLUTION)
+    assert astar.solve()
+    connectivity = ConnectivityIndex((0, 0), (WORLD_SIZE, WORLD_SIZE), occupancy, RESOLUTION)
+    return astar.path, connectivity
+
+def new_free(obstacles):
+    occupancy = DetOccupancyGrid2D(WORLD_SIZE, WORLD_SIZE, obstacles)
+    return ConnectivityIndex((0, 0), (WORLD_SIZE, WORLD_SIZE), occupancy, RESOLUTION).free
+
+def test_plan_blocked():
+    path, connectivity = wall_plan()
+    def blocked(extra_obstacles):
+        free = new_free([WALL, BLOB] + extra_obstacles)
+        return plan_tracking.plan_blocked(path, connectivity.free, free, connectivity.grid_lo, RESOLUTION)
+    middle = path[len(path)//2]
+    assert not blocked([])
+    assert blocked([(middle, middle)])
+    # the endpoints never block the plan, states off the plan neither
+    assert not blocked([(path[-1], path[-1])])
+    assert not blocked([((2, 20), (3, 21))])
+    # the segments of shortcut plans are checked cell by cell
+    occupancy = DetOccupancyGrid2D(WORLD_SIZE, WORLD_SIZE, [WALL, BLOB])
+    waypoints = shortcut_path(path, occupancy, RESOLUTION)
+    free = new_free([WALL, BLOB, (middle, middle)])
+    assert plan_tracking.plan_blocked(waypoints, connectivity.free, free, connectivity.grid_lo, RESOLUTION)
+
+def test_shorter_route_possible():
+    path, connectivity = wall_plan()
+    def shorter(obstacles):
+        free = new_free(obstacles)
+        return plan_tracking.shorter_route_possible(path, connectivity.free, free, connectivity.grid_lo, RESOLUTION,
+                                                    WALL_GOAL, WALL_START[0], WALL_START[1], SHORTER_ROUTE_RATIO)
+    assert not shorter([WALL, BLOB])
+    # removing the wall opens the straight route
+    assert shorter([BLOB])
+    # removing the blob frees states no route through is short enough
+    assert not shorter([WALL])
+
+# speeds at the points of a timed plan, with constant acceleration along its segments
+def profile_speeds(plan, times, v_start):
+    steps = np.diff(np.array(plan, dtype=float), axis=0)
+    lengths = np.hypot(steps[:,0], steps[:,1])
+    v = [v_start]
+    for length, dt in zip(lengths, np.diff(times)):
+        v.append(2*length/dt - v[-1])
+    return np.array(v), lengths, steps
+
+def test_time_plan_within_limits():
+    rng = np.random.RandomState(4)
+    for path, occupancy in random_paths(5):
+        plan = plan_tracking.densify_plan(shortcut_path(path, occupancy, RESOLUTION), KNOT_SPACING)
+        v_limit = V_LIMIT*rng.uniform(0.5, 1.0, size=len(plan))
+        times = plan_tracking.time_plan(plan, v_limit, W_LIMIT, A_LIMIT, V_END)
+        assert times[0] == 0.0 and np.all(np.diff(times) > 0)
+        v, lengths, steps = profile_speeds(plan, times, min(v_limit[0], V_END))
+        assert np.all(v <= v_limit + 1e-9)
+        assert v[-1] <= V_END + 1e-9
+        # turning rate in the turns, with the curvature of time_plan
+        turns = np.abs(np.angle(np.exp(1j*np.diff(np.arctan2(steps[:,1], steps[:,0])))))
+        curvature = turns/np.minimum(lengths[:-1], lengths[1:])
+        assert np.all(v[1:-1]*curvature <= W_LIMIT + 1e-9)
+        assert np.all(np.abs(np.diff(v**2)) <= 2*A_LIMIT*lengths + 1e-9)
+
+def test_time_plan_reaches_limit():
+    # a long straight plan speeds up to v_limit and slows down at its end
+    plan = [(0.1*k, 0.0) for k in range(101)]
+    times = plan_tracking.time_plan(plan, np.full(len(plan), V_LIMIT), W_LIMIT, A_LIMIT, V_END)
+    v, lengths, steps = profile_speeds(plan, times, V_END)
+    assert abs(v[len(plan)//2] - V_LIMIT) < 1e-9
+    assert abs(v[-1] - V_END) < 1e-6
+    assert abs(times[-1] - 10.0/V_LIMIT) < 1.0
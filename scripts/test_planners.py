@@ -0,0 +1,154 @@
+import math
+import numpy as np
+from astar import AStar, BidirectionalAStar, GridAStar, JumpPointSearch, DetOccupancyGrid2D
+from dstar_lite import DStarLite
+from hpa_star import HPAStar
+from ara_star import AnytimeRepairingAStar
+from theta_star import ThetaStar
+from path_smoothing import segment_is_free
+
+# Checks the planners against AStar on small random DetOccupancyGrid2D worlds.
+# Run with pytest from this directory.
+
+WORLD_SIZE = 24
+NUM_WORLDS = 12
+NUM_QUERIES = 4
+NUM_OBSTACLES = 14
+STATESPACE_LO = (0, 0)
+STATESPACE_HI = (WORLD_SIZE, WORLD_SIZE)
+RESOLUTION = 1
+
+# HPAStar paths are near optimal, at most this much longer than AStar's
+HPA_MAX_RATIO = 1.25
+
+# Builds a world of random rectangular obstacles
+# INPUT: (rng)
+#          rng - numpy RandomState
+# OUTPUT: A DetOccupancyGrid2D
+def random_world(rng):
+    obstacles = []
+    for k in range(NUM_OBSTACLES):
+        x, y = rng.randint(0, WORLD_SIZE - 2, size=2)
+        w, h = rng.randint(1, WORLD_SIZE//4, size=2)
+        obstacles.append(((x, y), (x + w, y + h)))
+    return DetOccupancyGrid2D(WORLD_SIZE, WORLD_SIZE, obstacles)
+
+def random_free_state(rng, occupancy):
+    while True:
+        x = tuple(float(v) for v in rng.randint(0, WORLD_SIZE, size=2))
+        if occupancy.is_free(x):
+            return x
+
+# random worlds, each with NUM_QUERIES pairs of free endpoints
+def random_problems(seed):
+    rng = np.random.RandomState(seed)
+    for w in range(NUM_WORLDS):
+        occupancy = random_world(rng)
+        queries = [(random_free_state(rng, occupancy), random_free_state(rng, occupancy)) for q in range(NUM_QUERIES)]
+        yield occupancy, queries
+
+def path_length(path):
+    return sum(math.hypot(x2[0] - x1[0], x2[1] - x1[1]) for x1, x2 in zip(path[:-1], path[1:]))
+
+# solves a query with AStar, returns the length of its path, None if there is none
+def reference_length(x_init, x_goal, occupancy):
+    astar = AStar(STATESPACE_LO, STATESPACE_HI, x_init, x_goal, occupancy, RESOLUTION)
+    if not astar.solve():
+        return None
+    return path_length(astar.path)
+
+# checks that a path goes from x_init to x_goal in grid moves through free states
+def assert_grid_path(path, x_init, x_goal, occupancy):
+    assert tuple(path[0]) == x_init and tuple(path[-1]) == x_goal
+    for x1, x2 in zip(path[:-1], path[1:]):
+        assert max(abs(x2[0] - x1[0]), abs(x2[1] - x1[1])) == RESOLUTION
+    for x in path:
+        assert occupancy.is_free(x)
+
+# Checks that a planner finds a path exactly when AStar does, and that its
+# paths are valid grid paths as long as AStar's, or at most max_ratio longer
+def check_grid_planner(planner_class, seed, max_ratio=1.0, **kwargs):
+    for occupancy, queries in random_problems(seed):
+        for x_init, x_goal in queries:
+            expected = reference_length(x_init, x_goal, occupancy)
+            planner = planner_class(STATESPACE_LO, STATESPACE_HI, x_init, x_goal, occupancy, RESOLUTION, **kwargs)
+            solved = planner.solve()
+            assert solved == (expected is not None)
+            if solved:
+                assert_grid_path(planner.path, x_init, x_goal, occupancy)
+                assert expected - 1e-9 <= path_length(planner.path) <= max_ratio*expected + 1e-9
+
+def test_grid_astar():
+    check_grid_planner(GridAStar, 0)
+
+def test_bidirectional_astar():
+    check_grid_planner(BidirectionalAStar, 1)
+
+def test_jump_point_search():
+    for occupancy, queries in random_problems(2):
+        for x_init, x_goal in queries:
+            expected = reference_length(x_init, x_goal, occupancy)
+            jps = JumpPointSearch(STATESPACE_LO, STATESPACE_HI, x_init, x_goal, occupancy, RESOLUTION)
+            assert jps.solve() == (expected is not None)
+            if expected is not None:
+                assert tuple(jps.path[0]) == x_init and tuple(jps.path[-1]) == x_goal
+                assert abs(path_length(jps.path) - expected) < 1e-9
+
+def test_dstar_lite():
+    check_grid_planner(DStarLite, 3)
+
+def test_dstar_lite_repair():
+    rng = np.random.RandomState(4)
+    for w in range(NUM_WORLDS):
+        occupancy = random_world(rng)
+        x_init = random_free_state(rng, occupancy)
+        x_goal = random_free_state(rng, occupancy)
+        dstar = DStarLite(STATESPACE_LO, STATESPACE_HI, x_init, x_goal, occupancy, RESOLUTION)
+        dstar.solve()
+
+        # new obstacles and a new start, the repaired search matches a fresh AStar
+        obstacles = occupancy.obstacles + random_world(rng).obstacles[:NUM_OBSTACLES//2]
+        occupancy = DetOccupancyGrid2D(WORLD_SIZE, WORLD_SIZE, obstacles)
+        if not occupancy.is_free(x_goal):
+            continue
+        x_init = random_free_state(rng, occupancy)
+        dstar.update_occupancy(occupancy)
+        dstar.update_start(x_init)
+        expected = reference_length(x_init, x_goal, occupancy)
+        solved = dstar.solve()
+        assert solved == (expected is not None)
+        if solved:
+            assert_grid_path(dstar.path, x_init, x_goal, occupancy)
+            assert abs(path_length(dstar.path) - expected) < 1e-9
+
+def test_hpa_star():
+    check_grid_planner(HPAStar, 5, max_ratio=HPA_MAX_RATIO)
+
+def test_ara_star_complete():
+    # without a deadline the anytime search runs until its path is optimal
+    for occupancy, queries in random_problems(6):
+        for x_init, x_goal in queries:
+            expected = reference_length(x_init, x_goal, occupancy)
+            ara = AnytimeRepairingAStar(STATESPACE_LO, STATESPACE_HI, x_init, x_goal, occupancy, RESOLUTION, deadline=60.0)
+            solved = ara.solve()
+            assert ara.complete
+            assert solved == (expected is not None)
+            if solved:
+                assert_grid_path(ara.path, x_init, x_goal, occupancy)
+                assert abs(path_length(ara.path) - expected) < 1e-9
+
+def test_theta_star():
+    # any-angle paths are made of grid moves (which may cut corners like AStar's)
+    # and free segments, and are never longer than grid paths
+    for occupancy, queries in random_problems(7):
+        for x_init, x_goal in queries:
+            expected = reference_length(x_init, x_goal, occupancy)
+            theta = ThetaStar(STATESPACE_LO, STATESPACE_HI, x_init, x_goal, occupancy, RESOLUTION)
+            solved = theta.solve()
+            assert solved == (expected is not None)
+            if solved:
+                assert tuple(theta.path[0]) == x_init and tuple(theta.path[-1]) == x_goal
+                for x1, x2 in zip(theta.path[:-1], theta.path[1:]):
+                    grid_move = max(abs(x2[0] - x1[0]), abs(x2[1] - x1[1])) == RESOLUTION
+                    assert grid_move or segment_is_free(x1, x2, occupancy, RESOLUTION)
+                assert path_length(theta.path) <= expected + 1e-9
@@ -0,0 +1,99 @@
+import itertools
+import numpy as np
+import traveling_salesman
+from astar import DetOccupancyGrid2D
+
+# Checks the traveling salesman solvers on random distance matrices and a
+# small world. Run with pytest from this directory.
+
+MAX_BRUTE_FORCE_GOALS = 7
+NUM_MATRICES = 5
+
+# Builds a symmetric matrix of pairwise distances between n random points and
+# node 0, with some pairs made unreachable
+def random_dists(rng, n, unreachable_fraction=0.0):
+    points = rng.rand(n+1, 2)
+    dists = np.hypot(points[:,np.newaxis,0] - points[np.newaxis,:,0], points[:,np.newaxis,1] - points[np.newaxis,:,1])
+    unreachable = np.triu(rng.rand(n+1, n+1) < unreachable_fraction, 1)
+    dists[unreachable | unreachable.T] = np.inf
+    return dists
+
+def circuit_length(circuit, dists):
+    return sum(dists[i,j] for i, j in zip(circuit[:-1], circuit[1:]))
+
+# shortest path from node 0 through every other node, by trying every order
+def brute_force_length(dists):
+    n = dists.shape[0] - 1
+    return min(circuit_length([0] + list(order), dists) for order in itertools.permutations(range(1, n+1)))
+
+def assert_visits_all(circuit, n):
+    assert circuit[0] == 0
+    assert sorted(circuit) == list(range(n+1))
+
+def test_held_karp_matches_brute_force():
+    rng = np.random.RandomState(0)
+    for n in range(MAX_BRUTE_FORCE_GOALS+1):
+        for k in range(NUM_MATRICES):
+            dists = random_dists(rng, n)
+            circuit, length = traveling_salesman.held_karp(dists)
+            assert_visits_all(circuit, n)
+            assert abs(circuit_length(circuit, dists) - length) < 1e-9
+            assert abs(length - brute_force_length(dists)) < 1e-9
+
+def test_held_karp_unreachable_goals():
+    rng = np.random.RandomState(1)
+    for n in range(2, MAX_BRUTE_FORCE_GOALS+1):
+        for k in range(NUM_MATRICES):
+            dists = random_dists(rng, n, unreachable_fraction=0.3)
+            expected = brute_force_length(dists)
+            circuit, length = traveling_salesman.held_karp(dists)
+            if expected == np.inf:
+                assert length == np.inf
+            else:
+                assert_visits_all(circuit, n)
+                assert abs(length - expected) < 1e-9
+
+def test_improve_circuit():
+    rng = np.random.RandomState(2)
+    for n in range(2, 30, 3):
+        dists = random_dists(rng, n)
+        circuit, length = traveling_salesman.nearest_neighbor_circuit(dists)
+        assert_visits_all(circuit, n)
+        assert abs(circuit_length(circuit, dists) - length) < 1e-9
+        improved, improved_length = traveling_salesman.improve_circuit(circuit, dists)
+        assert_visits_all(improved, n)
+        assert abs(circuit_length(improved, dists) - improved_length) < 1e-9
+        assert improved_length <= length + 1e-9
+        if n <= MAX_BRUTE_FORCE_GOALS:
+            assert improved_length >= brute_force_length(dists) - 1e-9
+
+def test_path_length_matrix_cache():
+    # cached paths give the same matrix as new searches, and are dropped with the map
+    occupancy = DetOccupancyGrid2D(12, 12, [((3, 0), (4, 8)), ((7, 4), (8, 12))])
+    nodes = [(1.0, 1.0), (10.0, 10.0), (1.0, 10.0), (10.0, 1.0), (5.0, 5.0)]
+    lo, hi = (0, 0), (12, 12)
+    expected = traveling_salesman.path_length_matrix(nodes, lo, hi, occupancy, 1)
+    cache = traveling_salesman.PathCache()
+    cache.new_map(occupancy)
+    assert np.array_equal(traveling_salesman.path_length_matrix(nodes, lo, hi, occupancy, 1, cache=cache), expected)
+    assert len(cache.entries) == len(nodes)*(len(nodes)-1)//2
+    assert np.array_equal(traveling_salesman.path_length_matrix(nodes, lo, hi, occupancy, 1, cache=cache), expected)
+    cache.new_map(DetOccupancyGrid2D(12, 12, []))
+    assert len(cache.entries) == 0
+
+def test_path_length_matrix_stats():
+    # every searched pair is timed by the search it was found by, cached pairs are not searched
+    occupancy = DetOccupancyGrid2D(12, 12, [((3, 0), (4, 8)), ((7, 4), (8, 12))])
+    nodes = [(1.0, 1.0), (10.0, 10.0), (1.0, 10.0), (10.0, 1.0)]
+    lo, hi = (0, 0), (12, 12)
+    cache = traveling_salesman.PathCache()
+    cache.new_map(occupancy)
+    stats = {}
+    traveling_salesman.path_length_matrix(nodes[:2], lo, hi, occupancy, 1, cache=cache)
+    traveling_salesman.path_length_matrix(nodes, lo, hi, occupancy, 1, cache=cache, stats=stats)
+    assert stats['num_searches'] == len(nodes) - 1
+    assert stats['num_cached'] == 1
+    pair_times = stats['pair_times']
+    assert np.array_equal(pair_times, pair_times.T)
+    assert pair_times[0,1] == 0 and np.all(np.diag(pair_times) == 0)
+    assert np.all(pair_times[np.triu_indices(len(nodes), 2)] > 0)
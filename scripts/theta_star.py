@@ -0,0 +1,135 @@
+import heapq
+import math
+import numpy as np
+from astar import GridAStar
+
+# Finds every cell a straight segment between two cell centers passes
+# through (its supercover). Crossings of the cell borders are parametrized
+# by integers along the segment, so crossings through a cell corner are
+# detected exactly, and both cells beside the corner are included.
+# INPUT: (i0, j0, i1, j1)
+#          i0, j0 - integer cell coordinates of the start of the segment
+#          i1, j1 - integer cell coordinates of the end of the segment
+# OUTPUT: (i, j), integer numpy arrays of the cell coordinates, in order along the segment
+#         (with the corner cells right after the crossing they belong to)
+def supercover_line(i0, j0, i1, j1):
+    di = int(i1 - i0)
+    dj = int(j1 - j0)
+    step_i = (di > 0) - (di < 0)
+    step_j = (dj > 0) - (dj < 0)
+    # the segment crosses the borders between columns at (2a+1)*u_i and the
+    # borders between rows at (2b+1)*u_j, for a common integer scale of u
+    u_i = max(abs(dj), 1)
+    u_j = max(abs(di), 1)
+    crossings_i = (2*np.arange(abs(di)) + 1)*u_i
+    crossings_j = (2*np.arange(abs(dj)) + 1)*u_j
+    crossings = np.union1d(crossings_i, crossings_j)
+    crosses_i = np.zeros(len(crossings), dtype=bool)
+    crosses_i[np.searchsorted(crossings, crossings_i)] = True
+    crosses_j = np.zeros(len(crossings), dtype=bool)
+    crosses_j[np.searchsorted(crossings, crossings_j)] = True
+
+    i = i0 + step_i*np.concatenate(([0], np.cumsum(crosses_i)))
+    j = j0 + step_j*np.concatenate(([0], np.cumsum(crosses_j)))
+    corners = np.flatnonzero(crosses_i & crosses_j)
+    if len(corners) == 0:
+        return i, j
+    return (np.concatenate((i, i[corners] + step_i, i[corners])),
+            np.concatenate((j, j[corners], j[corners] + step_j)))
+
+# Any-angle planner (Lazy Theta*, Nash, Koenig and Tovey 2010) on the
+# GridAStar cell grid. A cell reached from a neighbor inherits the neighbor's
+# parent, as long as the straight segment from that parent does not pass
+# through an occupied cell, so paths are made of straight segments between
+# corners of the obstacles instead of 8-connected grid steps. Line of sight
+# is only checked when a cell is expanded, against a mask of the whole state
+# space (see occupancy_free_cells), with one vectorized lookup per segment.
+class ThetaStar(GridAStar):
+
+    # Checks that the segment between two cells only passes through free cells
+    # INPUT: (cell1, cell2)
+    #          cell1, cell2 - integer flat cell indices
+    # OUTPUT: Boolean True/False
+    def line_of_sight(self, cell1, cell2):
+        j1, i1 = divmod(cell1, self.stride)
+        j2, i2 = divmod(cell2, self.stride)
+        if abs(i1 - i2) <= 1 and abs(j1 - j2) <= 1:
+            return True     # grid move, allowed like in GridAStar
+        i, j = supercover_line(i1, j1, i2, j2)
+        return bool(np.all(self.cell_free[i + j*self.stride] == 1))
+
+    def cell_distance(self, cell1, cell2):
+        j1, i1 = divmod(cell1, self.stride)
+        j2, i2 = divmod(cell2, self.stride)
+        return self.resolution*math.hypot(i1 - i2, j1 - j2)
+
+    # Follows the parent array from a cell back to the initial cell
+    # INPUT: (cell)
+    #          cell - integer flat cell index, reached by the search
+    # OUTPUT: A list of tuples, the corners of the path that goes from start to the cell
+    def path_to_cell(self, cell):
+        cells = [cell]
+        while cells[-1] != self.init_cell:
+            cells.append(int(self.parent_cells[cells[-1]]))
+        path = [self.cell_to_state(c) for c in reversed(cells)]
+        path[0] = self.x_init
+        return path
+
+    # Solves the planning problem with Lazy Theta*. Places the solution path
+    # inside self.path, as the list of its corners from x_init to x_goal
+    # INPUT: None
+    # OUTPUT: Boolean, True if a solution from x_init to x_goal was found
+    def solve(self):
+        if self.init_cell is None or self.goal_cell is None:
+            # endpoints outside of the state space are only handled by the generic solver
+            return super(ThetaStar, self).solve()
+
+        self.cell_free[:] = self.pad_cells(self.compute_free_cells())
+        self.cell_free[self.init_cell] = 1
+        self.cell_free[self.goal_cell] = 1
+
+        g_cells = self.g_cells
+        parent_cells = self.parent_cells
+        visited_cells = self.visited_cells
+        cell_free = self.cell_free
+        goal_cell = self.goal_cell
+        init_cell = self.init_cell
+
+        g_cells[init_cell] = 0.0
+        parent_cells[init_cell] = init_cell
+        open_heap = [(self.cell_distance(init_cell, goal_cell), init_cell)]
+        while open_heap:
+            _, current = heapq.heappop(open_heap)
+            if visited_cells[current]:
+                continue    # stale entry for a cell that was already expanded
+            visited_cells[current] = True
+            self.num_expanded += 1
+
+            # the parent was assumed to be visible, if it is not fall back to
+            # the best expanded grid neighbor
+            parent = int(parent_cells[current])
+            if not self.line_of_sight(parent, current):
+                g_cells[current] = np.inf
+                for offset, cost in self.neighbor_offsets:
+                    neighbor = current - offset
+                    if visited_cells[neighbor] and neighbor != current and g_cells[neighbor] + cost < g_cells[current]:
+                        g_cells[current] = g_cells[neighbor] + cost
+                        parent_cells[current] = neighbor
+                parent = int(parent_cells[current])
+            if current == goal_cell:
+                parent_cells[init_cell] = -1
+                self.path = self.reconstruct_path()
+                return True
+
+            g_parent = g_cells[parent]
+            for offset, _ in self.neighbor_offsets:
+                neighbor = current + offset
+                if visited_cells[neighbor] or cell_free[neighbor] != 1:
+                    continue
+                tentative_g_score = g_parent + self.cell_distance(parent, neighbor)
+                if tentative_g_score < g_cells[neighbor]:
+                    g_cells[neighbor] = tentative_g_score
+                    parent_cells[neighbor] = parent
+                    heapq.heappush(open_heap, (tentative_g_score + self.cell_distance(neighbor, goal_cell), neighbor))
+
+        return False
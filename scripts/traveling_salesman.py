@@ -1,29 +1,245 @@
-from astar import AStar
+from astar import GridDijkstra
 from astar import DetOccupancyGrid2D
+from connectivity import ConnectivityIndex
 import numpy as np
 import matplotlib.pyplot as plt
+import collections
 import itertools
+import multiprocessing
+import threading
+import time
 import pdb
 
-def find_closest(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution):
-    min_dist = np.float('inf')
-    closest = None
+# largest number of goals traveling_salesman_exact solves with the Held-Karp
+# dynamic program (O(2^n n^2) time, O(2^n n) memory), larger problems fall
+# back to the nearest neighbor heuristic so the solver returns in bounded time
+MAX_EXACT_GOALS = 15
+
+# limits of the 2-opt/Or-opt refinement of traveling_salesman_fast circuits
+IMPROVE_MAX_ITERATIONS = 1000
+IMPROVE_TIME_LIMIT = 0.05
+
+# number of processes of the pool started by start_path_pool, and the number
+# of nodes below which path_length_matrix runs its searches serially. A round
+# trip of the problem to a started pool takes about 1 ms, the searches of
+# fewer nodes are too short and unbalanced between the workers to gain from it
+PATH_WORKERS = multiprocessing.cpu_count()
+MIN_PARALLEL_NODES = 8
+
+# maximum number of paths kept by a PathCache
+PATH_CACHE_SIZE = 1000
+
+# persistent pool of worker processes for path_length_matrix and its number
+# of processes, None until start_path_pool is called
+_path_pool = None
+_path_pool_size = 0
+
+# Starts the pool of worker processes path_length_matrix spreads its searches
+# over. Call it once, at start up, before the process starts any thread: the
+# workers are forked, and forking a process whose threads may hold locks
+# (logging, ROS) can deadlock the children
+# INPUT: (workers)
+#          workers - number of worker processes, 1 or less to always search serially
+# OUTPUT: None
+def start_path_pool(workers=PATH_WORKERS):
+    global _path_pool, _path_pool_size
+    if _path_pool is None and workers > 1:
+        _path_pool = multiprocessing.Pool(workers)
+        _path_pool_size = workers
+
+# Least recently used cache of the paths between pairs of snapped states,
+# keyed by (start, goal, map version). Call new_map whenever a new occupancy
+# grid is installed, it bumps the map version and drops every cached path.
+# Only searches on that occupancy grid use the cache.
+# Paths are also dropped if the planning state space or resolution changes.
+# The cache is shared between threads (the map callbacks call new_map while
+# the traveling salesman thread looks paths up), its methods hold its lock.
+class PathCache(object):
+
+    def __init__(self, max_entries=PATH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.map_version = 0
+        self.occupancy = None       # occupancy grid of the current map version
+        self.statespace = None      # (statespace_lo, statespace_hi, resolution) of the cached paths
+        self.entries = collections.OrderedDict()   # (start, goal, map version) -> path, None if there is none
+        self.lock = threading.Lock()
+
+    def new_map(self, occupancy):
+        with self.lock:
+            self.map_version += 1
+            self.occupancy = occupancy
+            self.entries.clear()
+
+    # map version of an occupancy grid, None if it is not the current one
+    def map_version_of(self, occupancy):
+        with self.lock:
+            return self.map_version if occupancy is self.occupancy else None
+
+    def key(self, x1, x2, resolution):
+        snap = lambda x: (resolution*round(x[0]/resolution), resolution*round(x[1]/resolution))
+        return (snap(x1), snap(x2), self.map_version)
+
+    # called with the lock held
+    def check_statespace(self, statespace_lo, statespace_hi, resolution):
+        statespace = (tuple(statespace_lo), tuple(statespace_hi), resolution)
+        if statespace != self.statespace:
+            self.statespace = statespace
+            self.entries.clear()
+
+    # Looks up the path between two states, in either direction
+    # OUTPUT: (found, path), path is None if it is known there is no path
+    def get(self, x1, x2, statespace_lo, statespace_hi, resolution):
+        with self.lock:
+            self.check_statespace(statespace_lo, statespace_hi, resolution)
+            key = self.key(x1, x2, resolution)
+            reverse = False
+            if key not in self.entries:
+                key = self.key(x2, x1, resolution)
+                reverse = True
+                if key not in self.entries:
+                    return False, None
+            path = self.entries.pop(key)
+            self.entries[key] = path    # most recently used
+        if path is not None and reverse:
+            path = path[::-1]
+        return True, path
+
+    # Stores the path between two states. Paths computed on the occupancy grid of
+    # an older map version (given by map_version) are not stored
+    def put(self, x1, x2, path, statespace_lo, statespace_hi, resolution, map_version=None):
+        with self.lock:
+            if map_version is not None and map_version != self.map_version:
+                return
+            self.check_statespace(statespace_lo, statespace_hi, resolution)
+            key = self.key(x1, x2, resolution)
+            self.entries.pop(key, None)
+            self.entries[key] = path
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+# Computes the shortest paths from x_init to each of x_goals with a single
+# GridDijkstra search, None for the goals that cannot be reached. Goals that
+# connectivity reports as unreachable are not searched for
+def find_paths(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity=None):
+    paths = [None for x_goal in x_goals]
+    if connectivity is not None:
+        x_goals = [x_goal if connectivity.is_reachable(x_init, x_goal) else None for x_goal in x_goals]
+    reachable_goals = [x_goal for x_goal in x_goals if x_goal is not None]
+    if len(reachable_goals) == 0:
+        return paths
+
+    dijkstra = GridDijkstra(statespace_lo, statespace_hi, x_init, reachable_goals, occupancy, resolution)
+    dijkstra.solve()
+    for i in range(len(x_goals)):
+        if x_goals[i] is not None:
+            paths[i] = dijkstra.paths[dijkstra.snap_to_grid(x_goals[i])]
+    return paths
+
+# Computes the shortest path lengths (number of states in the path) from
+# x_init to each of x_goals, np.inf for the goals that cannot be reached
+def find_path_lengths(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity=None):
+    paths = find_paths(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity)
+    return [len(path) if path is not None else np.inf for path in paths]
+
+# Finds the goal closest to x_init (the first one settled by a single
+# GridDijkstra search) and the length of the path to it
+def find_closest(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity=None):
+    if connectivity is not None:
+        x_goals = [x_goal for x_goal in x_goals if connectivity.is_reachable(x_init, x_goal)]
+    if len(x_goals) == 0:
+        return None, np.inf
+
+    dijkstra = GridDijkstra(statespace_lo, statespace_hi, x_init, x_goals, occupancy, resolution)
+    if not dijkstra.solve(first_only=True):
+        return None, np.inf
     for x_goal in x_goals:
-        astar = AStar(statespace_lo, statespace_hi, x_init, x_goal, occupancy, resolution)
- 
-        if astar.solve() and len(astar.path) < min_dist:
-            min_dist = len(astar.path)
-            closest = x_goal
+        path = dijkstra.paths[dijkstra.snap_to_grid(x_goal)]
+        if path is not None:
+            return x_goal, len(path)
+
+# Computes the paths from each node i of a batch of tasks (i, targets) to its
+# target nodes, and times each search. The planning problem comes with the
+# batch, so it is pickled once per batch
+# INPUT: (batch)
+#          batch - tuple (problem, tasks), see path_length_matrix
+# OUTPUT: A list of (paths, seconds) tuples, one per task
+def _paths_from(batch):
+    problem, tasks = batch
+    nodes, statespace_lo, statespace_hi, occupancy, resolution, connectivity = problem
+    results = []
+    for i, targets in tasks:
+        start_time = time.time()
+        paths = find_paths(nodes[i], [nodes[j] for j in targets], statespace_lo, statespace_hi, occupancy, resolution, connectivity)
+        results.append((paths, time.time() - start_time))
+    return results
+
+# Computes the symmetric matrix of path lengths between all pairs of nodes,
+# with one search per node to all of the nodes after it. Pairs found in the
+# PathCache cache are not searched again, and new paths are added to it when
+# occupancy is the current map of the cache. The
+# searches are spread over the pool of start_path_pool if it was started and
+# there are at least MIN_PARALLEL_NODES nodes, in one batch per worker. The
+# workers get a pickled copy of the occupancy grid and connectivity index with
+# each batch (about 0.5 MB and 1 ms for a 384x384 map, growing with its number
+# of cells), since the pool is forked before any map is received.
+# If stats is a dict, it receives the timing of the searches:
+#   'pair_times': matrix of the duration (s) of the search each pair was
+#                 found by, one search covers all the pairs of its node, 0 for
+#                 cached pairs
+#   'num_searches', 'num_cached': number of searches and of cached pairs
+def path_length_matrix(nodes, statespace_lo, statespace_hi, occupancy, resolution, connectivity=None, cache=None, stats=None):
+    map_version = cache.map_version_of(occupancy) if cache is not None else None
+    if map_version is None:
+        # the map was replaced since occupancy was read, its paths are not cached
+        cache = None
+    dists = np.zeros((len(nodes), len(nodes)))
+    tasks = []
+    for i in range(len(nodes) - 1):
+        targets = []
+        for j in range(i+1, len(nodes)):
+            found, path = (False, None) if cache is None else cache.get(nodes[i], nodes[j], statespace_lo, statespace_hi, resolution)
+            if found:
+                dists[i,j] = dists[j,i] = len(path) if path is not None else np.inf
+            else:
+                targets.append(j)
+        if targets:
+            tasks.append((i, targets))
 
-    return closest, min_dist
+    problem = (nodes, statespace_lo, statespace_hi, occupancy, resolution, connectivity)
+    if _path_pool is not None and len(nodes) >= MIN_PARALLEL_NODES and len(tasks) > 1:
+        # interleaved batches, the first nodes have the most targets
+        num_batches = min(_path_pool_size, len(tasks))
+        batches = [(problem, tasks[k::num_batches]) for k in range(num_batches)]
+        results = [None for task in tasks]
+        for k, batch_results in enumerate(_path_pool.map(_paths_from, batches, chunksize=1)):
+            results[k::num_batches] = batch_results
+    else:
+        results = _paths_from((problem, tasks))
 
-def traveling_salesman_fast(x_init, x_orig_goals, statespace_lo, statespace_hi, occupancy, resolution):
+    pair_times = np.zeros((len(nodes), len(nodes)))
+    for (i, targets), (paths, seconds) in zip(tasks, results):
+        for j, path in zip(targets, paths):
+            dists[i,j] = dists[j,i] = len(path) if path is not None else np.inf
+            pair_times[i,j] = pair_times[j,i] = seconds
+            if cache is not None:
+                cache.put(nodes[i], nodes[j], path, statespace_lo, statespace_hi, resolution, map_version)
+    if stats is not None:
+        stats['pair_times'] = pair_times
+        stats['num_searches'] = len(tasks)
+        stats['num_cached'] = len(nodes)*(len(nodes) - 1)//2 - sum(len(targets) for i, targets in tasks)
+    return dists
+
+def traveling_salesman_fast(x_init, x_orig_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity=None, improve=False, cache=None):
+    if connectivity is None:
+        connectivity = ConnectivityIndex(statespace_lo, statespace_hi, occupancy, resolution)
+    if improve:
+        return traveling_salesman_improved(x_init, x_orig_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity, cache)
     wps = []
     circuit = []
     x_goals = list(x_orig_goals) # make a copy
     circuit_length = 0
     for i in range(len(x_goals)):
-        closest, curr_length = find_closest(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution)
+        closest, curr_length = find_closest(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity)
         circuit_length += curr_length
 
         if closest == None:
@@ -41,6 +257,27 @@ def traveling_salesman_fast(x_init, x_orig_goals, statespace_lo, statespace_hi,
     print(wps)
     return circuit
 
+# Nearest neighbor circuit refined with improve_circuit, on the pairwise path
+# length matrix. Like traveling_salesman_fast, stops the circuit at the first
+# goal that cannot be reached
+def traveling_salesman_improved(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity=None, cache=None):
+    dists = path_length_matrix([x_init] + list(x_goals), statespace_lo, statespace_hi, occupancy, resolution, connectivity, cache=cache)
+    circuit, circuit_length = nearest_neighbor_circuit(dists)
+    if circuit_length < np.inf:
+        circuit, circuit_length = improve_circuit(circuit, dists)
+    else:
+        print "Could not find circuit"
+        reachable = 1
+        while dists[circuit[reachable-1],circuit[reachable]] < np.inf:
+            reachable += 1
+        circuit = circuit[:reachable]
+
+    circuit = [x-1 for x in circuit[1:]]
+    print("Found path with length: {}:".format(circuit_length))
+    print(circuit)
+    print([x_goals[i] for i in circuit])
+    return circuit
+
 def get_circuit_length(circuit, paths):
     circuit_length = 0 
     for i in range(len(circuit) - 1):
@@ -55,36 +292,180 @@ def get_circuit_length(circuit, paths):
 
     return circuit_length
 
-def traveling_salesman_exact(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution):
-    paths = {}
-    for i in range(len(x_goals)):
-        astar = AStar(statespace_lo, statespace_hi, x_init, x_goals[i], occupancy, resolution)
-        if astar.solve():
-            paths[(0, i+1)] = len(astar.path)
-        else:
-            paths[(0,i+1)] = np.float('inf')
-
-    for pair in itertools.combinations(range(len(x_goals)), 2):
-        astar = AStar(statespace_lo, statespace_hi, x_goals[pair[0]], x_goals[pair[1]], occupancy, resolution)
-        pair = [x+1 for x in list(pair)]
-        pair = tuple(pair)
-        if astar.solve():
-            paths[pair] = len(astar.path)
-        else:
-            paths[pair] = np.float('inf')
-
-    min_length = np.float('inf')
-    min_circuit = [0]
-    for circuit in itertools.permutations(range(len(x_goals))):
-
-        circuit = [x+1 for x in list(circuit)]
-        circuit = [0] + circuit
-        curr_length = get_circuit_length(circuit, paths) 
-        if curr_length < min_length:
-            min_length = curr_length
-            min_circuit = circuit
+# Finds the shortest path starting at node 0 and visiting every other node
+# with the Held-Karp dynamic program. dp[S, j] is the length of the shortest
+# path from node 0 through the set S of nodes (a bitmask over nodes 1..n)
+# ending at node j. All the subsets of a given size are computed at once with
+# numpy, one end node at a time.
+# INPUT: (dists)
+#          dists - (n+1)x(n+1) numpy array of pairwise path lengths, np.inf if unreachable
+# OUTPUT: (circuit, length), the node order starting with 0 and its length
+def held_karp(dists):
+    n = dists.shape[0] - 1
+    if n == 0:
+        return [0], 0.0
+    num_sets = 1 << n
+    bits = 1 << np.arange(n)
+    dp = np.full((num_sets, n), np.inf)
+    parent = np.zeros((num_sets, n), dtype=np.int8)
+    dp[bits, np.arange(n)] = dists[0,1:]
+
+    # sets grouped by their number of nodes
+    sets = np.arange(num_sets)
+    set_sizes = np.zeros(num_sets, dtype=int)
+    for j in range(n):
+        set_sizes += (sets >> j) & 1
+
+    goal_dists = dists[1:,1:]
+    for size in range(2, n+1):
+        sets_of_size = sets[set_sizes == size]
+        for j in range(n):
+            ending_sets = sets_of_size[(sets_of_size & bits[j]) != 0]
+            lengths = dp[ending_sets ^ bits[j],:] + goal_dists[:,j]
+            best = np.argmin(lengths, axis=1)
+            dp[ending_sets,j] = lengths[np.arange(len(ending_sets)),best]
+            parent[ending_sets,j] = best
+
+    # walk back from the best end node of the full set
+    current_set = num_sets - 1
+    j = int(np.argmin(dp[current_set]))
+    length = dp[current_set,j]
+    if length == np.inf:
+        return [0], length
+    circuit = []
+    while current_set:
+        circuit.append(j+1)
+        previous = int(parent[current_set,j])
+        current_set ^= bits[j]
+        j = previous
+    return [0] + circuit[::-1], length
+
+# Builds a path starting at node 0 by always moving to the closest unvisited node
+# INPUT: (dists)
+#          dists - (n+1)x(n+1) numpy array of pairwise path lengths, np.inf if unreachable
+# OUTPUT: (circuit, length), the node order starting with 0 and its length
+def nearest_neighbor_circuit(dists):
+    circuit = [0]
+    length = 0.0
+    unvisited = set(range(1, dists.shape[0]))
+    while unvisited:
+        closest = min(unvisited, key=lambda j: dists[circuit[-1],j])
+        length += dists[circuit[-1],closest]
+        circuit.append(closest)
+        unvisited.remove(closest)
+    return circuit, length
+
+# Improves a path starting at node 0 with 2-opt moves (reversing a segment)
+# and Or-opt moves (moving a segment of up to 3 nodes, possibly reversed),
+# applying the best move found at each iteration. The path is closed with a
+# dummy node at zero distance from every node, so the end of the path is free
+# to change like any other edge. The gains of all the moves of a kind are
+# computed at once with numpy.
+# INPUT: (circuit, dists, max_iterations, time_limit)
+#          circuit - list of nodes starting with 0
+#          dists - numpy array of pairwise path lengths, all finite along circuit
+#          max_iterations - maximum number of moves applied
+#          time_limit - time (s) after which no more moves are searched for
+# OUTPUT: (circuit, length), the improved node order starting with 0 and its length
+def improve_circuit(circuit, dists, max_iterations=IMPROVE_MAX_ITERATIONS, time_limit=IMPROVE_TIME_LIMIT):
+    n = len(circuit)
+    finite = dists[np.isfinite(dists)]
+    big = (finite.max() + 1.0) * n * 10 if len(finite) else 1.0
+    d = np.zeros((n + 1, n + 1))
+    d[:n,:n] = np.where(np.isfinite(dists), dists, big)
+    tour = np.array(list(circuit) + [n])   # dummy node n closes the path
+
+    start_time = time.time()
+    for iteration in range(max_iterations):
+        if time.time() - start_time > time_limit:
+            break
+        best_gain = 1e-9
+        best_tour = None
+
+        # 2-opt: reverse tour[i:j+1], 1 <= i < j <= n-1
+        if n > 2:
+            i, j = np.triu_indices(n, 1)
+            keep = (i >= 1) & (j <= n - 1)
+            i = i[keep]
+            j = j[keep]
+            gains = (d[tour[i-1],tour[i]] + d[tour[j],tour[j+1]]
+                     - d[tour[i-1],tour[j]] - d[tour[i],tour[j+1]])
+            if len(gains) and gains.max() > best_gain:
+                k = np.argmax(gains)
+                best_gain = gains[k]
+                best_tour = np.concatenate((tour[:i[k]], tour[i[k]:j[k]+1][::-1], tour[j[k]+1:]))
+
+        # Or-opt: move tour[i:i+length] between tour[k] and tour[k+1]
+        for length in range(1, 4):
+            for i in range(1, n - length + 1):
+                segment = tour[i:i+length]
+                rest = np.concatenate((tour[:i], tour[i+length:]))
+                removal_gain = d[tour[i-1],segment[0]] + d[segment[-1],tour[i+length]] - d[tour[i-1],tour[i+length]]
+                k = np.arange(len(rest) - 1)
+                edge = d[rest[k],rest[k+1]]
+                forward = removal_gain - (d[rest[k],segment[0]] + d[segment[-1],rest[k+1]] - edge)
+                backward = removal_gain - (d[rest[k],segment[-1]] + d[segment[0],rest[k+1]] - edge)
+                forward[i-1] = -np.inf  # putting the segment back where it was
+                backward[i-1] = -np.inf if length == 1 else backward[i-1]
+                for gains, reverse in [(forward, False), (backward, True)]:
+                    best = np.argmax(gains)
+                    if gains[best] > best_gain:
+                        best_gain = gains[best]
+                        moved = segment[::-1] if reverse else segment
+                        best_tour = np.concatenate((rest[:best+1], moved, rest[best+1:]))
+
+        if best_tour is None:
+            break
+        tour = best_tour
+
+    circuit = [int(x) for x in tour[:-1]]
+    length = sum(dists[circuit[k],circuit[k+1]] for k in range(n - 1))
+    return circuit, length
+
+# Generates circuits of decreasing length, so a caller can act on a first
+# answer while better ones are computed:
+#   1. the nearest neighbor circuit on straight line distances, before any search
+#   2. the nearest neighbor circuit on path lengths, refined with improve_circuit
+#   3. if exact is set and there are at most max_exact_goals goals, the optimal circuit
+# Each is a (circuit, length) pair like the other solvers return, the length
+# of the first one is unknown (np.inf). Later circuits are only generated when
+# they are shorter. If some goal cannot be reached, the last circuit is empty.
+# stats receives the search timing of path_length_matrix.
+def traveling_salesman_anytime(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity=None, exact=True, max_exact_goals=MAX_EXACT_GOALS, cache=None, stats=None):
+    nodes = np.array([x_init] + list(x_goals), dtype=float)
+    straight_dists = np.sqrt(((nodes[:,None,:] - nodes[None,:,:])**2).sum(axis=2))
+    circuit, _ = nearest_neighbor_circuit(straight_dists)
+    yield [x-1 for x in circuit[1:]], np.inf
+
+    if connectivity is None:
+        connectivity = ConnectivityIndex(statespace_lo, statespace_hi, occupancy, resolution)
+    dists = path_length_matrix([x_init] + list(x_goals), statespace_lo, statespace_hi, occupancy, resolution, connectivity, cache=cache, stats=stats)
+    circuit, length = nearest_neighbor_circuit(dists)
+    if length == np.inf:
+        print "Could not find circuit"
+        yield [], np.inf
+        return
+    circuit, length = improve_circuit(circuit, dists)
+    yield [x-1 for x in circuit[1:]], length
+
+    if exact and len(x_goals) <= max_exact_goals:
+        min_circuit, min_length = held_karp(dists)
+        if min_length < length:
+            yield [x-1 for x in min_circuit[1:]], min_length
 
+def traveling_salesman_exact(x_init, x_goals, statespace_lo, statespace_hi, occupancy, resolution, connectivity=None, max_exact_goals=MAX_EXACT_GOALS, cache=None):
+    if connectivity is None:
+        connectivity = ConnectivityIndex(statespace_lo, statespace_hi, occupancy, resolution)
+    nodes = [x_init] + list(x_goals)
+    dists = path_length_matrix(nodes, statespace_lo, statespace_hi, occupancy, resolution, connectivity, cache=cache)
 
+    if len(x_goals) <= max_exact_goals:
+        min_circuit, min_length = held_karp(dists)
+    else:
+        print("{} goals is too many for the exact solver, using nearest neighbor".format(len(x_goals)))
+        min_circuit, min_length = nearest_neighbor_circuit(dists)
+    if min_length == np.inf:
+        min_circuit = [0]
 
     min_circuit = min_circuit[1:]
     min_circuit = [x-1 for x in min_circuit]